@@ -1,23 +1,27 @@
-from flask import Blueprint, render_template, request, redirect, url_for, flash, session
+from flask import Blueprint, render_template, request, redirect, url_for, flash, session, jsonify, send_file
 from models import (
-    add_teacher, remove_teacher, add_student, remove_student, 
-    change_teacher_password, get_class_report,
+    add_teacher, remove_teacher, add_student, remove_student, update_student, move_class,
+    get_student_years, get_student_sections,
+    change_teacher_password, get_class_report, iter_class_report, iter_class_reports, get_class_data_version,
     add_subject, remove_subject, get_all_subjects,
-    allocate_subject, get_all_allocations, remove_allocation
+    allocate_subject, get_all_allocations, remove_allocation, get_attendance_history
 )
-from utils import generate_csv_report, generate_pdf_report, generate_excel_report
-from db import get_db_connection
+from utils import (
+    generate_csv_report, generate_zip_report, send_cached_report, get_engine, ENGINES, CLASS_REPORT_COLUMNS
+)
+from jobs import (
+    enqueue, get_job, job_status, artifact_path, render_many, class_report_key, cache_artifact, get_executor
+)
+from db import get_db_connection, pool_stats, checkpoint_stats
+from cache import cache_stats, report_cache_stats
+from passwords import auth_stats
+from auth import role_required
+from importer import import_students, IMPORT_COLUMNS
+from session_store import session_stats
 
 admin_bp = Blueprint("admin", __name__, url_prefix="/admin")
 
-def login_required(f):
-    from functools import wraps
-    @wraps(f)
-    def decorated(*args, **kwargs):
-        if "user_type" not in session or session["user_type"] != "admin":
-            return redirect(url_for("auth.login"))
-        return f(*args, **kwargs)
-    return decorated
+login_required = role_required("admin")
 
 @admin_bp.route("/")
 @login_required
@@ -82,6 +86,21 @@ def admin_add_student():
             flash(f"Student {mis_no} already exists!", "danger")
     return render_template("add_student.html")
 
+@admin_bp.route("/import_students", methods=["GET", "POST"])
+@login_required
+def admin_import_students():
+    result = None
+    if request.method == "POST":
+        roster = request.files.get("roster")
+        if not roster or not roster.filename:
+            flash("Choose a CSV or XLSX file to import.", "danger")
+        else:
+            result = import_students(roster.stream, roster.filename, get_executor())
+            category = "warning" if result["errors"] else "success"
+            flash(f"Imported {result['imported']} students in {result['seconds']}s; "
+                  f"{len(result['errors'])} rows skipped.", category)
+    return render_template("import_students.html", result=result, columns=IMPORT_COLUMNS)
+
 # --- UPDATED FUNCTION: REMOVE STUDENT ---
 @admin_bp.route("/remove_student", methods=["GET", "POST"])
 @login_required
@@ -96,13 +115,8 @@ def admin_remove_student():
     search = request.args.get("search", "").strip()
 
     # 2. Get distinct years for dropdown
-    cur.execute("SELECT DISTINCT year FROM students")
-    years = [row["year"] for row in cur.fetchall()]
-
-    sections = []
-    if year:
-        cur.execute("SELECT DISTINCT section FROM students WHERE year=?", (year,))
-        sections = [row["section"] for row in cur.fetchall()]
+    years = get_student_years()
+    sections = get_student_sections(year) if year else []
 
     students = []
     
@@ -157,12 +171,8 @@ def admin_update_student():
     section = request.args.get("section")
     search = request.args.get("search", "").strip()
 
-    cur.execute("SELECT DISTINCT year FROM students")
-    years = [row["year"] for row in cur.fetchall()]
-    sections = []
-    if year:
-        cur.execute("SELECT DISTINCT section FROM students WHERE year=?", (year,))
-        sections = [row["section"] for row in cur.fetchall()]
+    years = get_student_years()
+    sections = get_student_sections(year) if year else []
 
     query = "SELECT mis_no, name, year, semester, section FROM students WHERE 1=1"
     params = []
@@ -184,21 +194,7 @@ def admin_update_student():
         section_new = request.form["section"]
         password = request.form.get("password")
 
-        conn_post = get_db_connection()
-        cur_post = conn_post.cursor()
-        if password:
-            from werkzeug.security import generate_password_hash
-            cur_post.execute(
-                "UPDATE students SET name=?, year=?, semester=?, section=?, password=? WHERE mis_no=?",
-                (name, year_new, semester_new, section_new, generate_password_hash(password), mis_no),
-            )
-        else:
-            cur_post.execute(
-                "UPDATE students SET name=?, year=?, semester=?, section=? WHERE mis_no=?",
-                (name, year_new, semester_new, section_new, mis_no),
-            )
-        conn_post.commit()
-        conn_post.close()
+        update_student(mis_no, name, year_new, semester_new, section_new, password)
         
         flash(f"Student '{mis_no}' updated successfully!", "success")
         return redirect(
@@ -212,6 +208,34 @@ def admin_update_student():
         selected_year=year, selected_semester=semester, selected_section=section, search=search,
     )
 
+@admin_bp.route("/move_class", methods=["GET", "POST"])
+@login_required
+def admin_move_class():
+    form = request.form
+    source = tuple(form.get(f"from_{f}", "").strip() for f in ("year", "semester", "section"))
+    target = tuple(form.get(f"to_{f}", "").strip() for f in ("year", "semester", "section"))
+    carry = bool(form.get("carry_allocations"))
+    summary = None
+
+    if request.method == "POST":
+        if not all(source + target):
+            flash("Fill in both the current and the new year, semester and section.", "danger")
+        elif source == target:
+            flash("The new class is the same as the current one.", "danger")
+        elif form.get("action") == "move":
+            summary = move_class(source, target, carry)
+            carried = sum(1 for a in summary["allocations"] if not a["at_target"])
+            flash(f"Moved {summary['students']} students to {' / '.join(target)}"
+                  + (f" and carried over {carried} allocations." if carry else "."), "success")
+            return redirect(url_for("admin.admin_move_class"))
+        else:
+            summary = move_class(source, target, carry, dry_run=True)
+
+    return render_template(
+        "move_class.html", years=get_student_years(), source=source, target=target,
+        carry=carry, summary=summary,
+    )
+
 @admin_bp.route("/manage_subjects", methods=["GET", "POST"])
 @login_required
 def admin_manage_subjects():
@@ -243,13 +267,10 @@ def admin_allocate_subjects():
     cur = conn.cursor()
     cur.execute("SELECT username FROM teachers WHERE username!='admin'")
     teachers = cur.fetchall()
-    cur.execute("SELECT subject_id, subject_name, subject_code FROM subjects")
-    subjects = cur.fetchall()
-    cur.execute("SELECT DISTINCT year FROM students")
-    years = [row['year'] for row in cur.fetchall()]
-    cur.execute("SELECT DISTINCT section FROM students")
-    sections = [row['section'] for row in cur.fetchall()]
     conn.close()
+    subjects = get_all_subjects()
+    years = get_student_years()
+    sections = get_student_sections()
 
     if request.method == "POST":
         teacher_username = request.form["teacher_username"]
@@ -285,15 +306,9 @@ def admin_view_reports():
     reports = []
     year, section, subject_id = None, None, None
     total_classes = 0
-    conn = get_db_connection()
-    cur = conn.cursor()
-    cur.execute("SELECT DISTINCT year FROM students")
-    years = [row['year'] for row in cur.fetchall()]
-    cur.execute("SELECT DISTINCT section FROM students")
-    sections = [row['section'] for row in cur.fetchall()]
-    cur.execute("SELECT subject_id, subject_name, subject_code FROM subjects")
-    all_subjects = cur.fetchall()
-    conn.close()
+    years = get_student_years()
+    sections = get_student_sections()
+    all_subjects = get_all_subjects()
 
     if request.method == "POST":
         year = request.form["year"]
@@ -326,27 +341,98 @@ def download_all_reports(file_type):
         flash("Year, Section, and Subject are required for download.", "danger")
         return redirect(url_for("admin.admin_view_reports"))
 
-    reports, total_classes = get_class_report(year, semester, section, subject_id)
-    data = [(mis_no, name, attended, total, percent) for mis_no, name, attended, total, percent in reports]
-    columns = ["MIS Number", "Name", "Classes Attended", "Total Classes", "Attendance %"]
-
     conn = get_db_connection()
     cur = conn.cursor()
     cur.execute("SELECT subject_code FROM subjects WHERE subject_id=?", (subject_id,))
     row = cur.fetchone()
     subject_code = row['subject_code'] if row else "SUB"
     conn.close()
-    
+
     filename = f"{year}_Sem{semester}_{section}_{subject_code}_attendance.{file_type}"
+    if file_type not in ("csv", "pdf", "xlsx"):
+        return "Invalid file type", 400
+
+    params = {
+        "year": year, "semester": semester, "section": section, "subject_id": subject_id,
+        "file_type": file_type, "chart_title": f"{year} {section} - {subject_code}",
+        "version": get_class_data_version(year, semester, section),
+    }
+    cached_report = send_cached_report(class_report_key(params), filename, get_engine(file_type).mimetype)
+    if cached_report:
+        return cached_report
 
     if file_type == "csv":
-        return generate_csv_report(data, columns, filename)
-    elif file_type == "pdf":
-        return generate_pdf_report(data, columns, filename, chart_title=f"{year} {section} - {subject_code}")
-    elif file_type == "xlsx":
-        return generate_excel_report(data, columns, filename)
+        rows = iter_class_report(year, semester, section, subject_id)
+        return generate_csv_report(rows, CLASS_REPORT_COLUMNS, filename, cache_key=class_report_key(params))
+    # Rendered in the report worker pool; the browser polls for the file
+    job_id = enqueue("class_report", params, owner=session["username"], filename=filename)
+    return redirect(url_for("admin.admin_report_job", job_id=job_id))
+
+@admin_bp.route("/bulk_export", methods=["POST"])
+@login_required
+def admin_bulk_export():
+    file_type = request.form.get("file_type", "csv")
+    year = request.form.get("year")
+    semester = request.form.get("semester")
+    section = request.form.get("section")
+    allocated_only = request.form.get("scope") == "allocated"
+    scope = "_".join(part for part in (year and f"Y{year}", semester and f"Sem{semester}", section) if part) or "all"
+    if file_type == "workbook":
+        # A single XLSX with a sheet per class, built by a report worker
+        job_id = enqueue("class_workbook", {
+            "year": year, "semester": semester, "section": section, "allocated_only": allocated_only,
+        }, owner=session["username"], filename=f"attendance_{scope}.xlsx")
+        return redirect(url_for("admin.admin_report_job", job_id=job_id))
+    if file_type not in ENGINES:
+        flash("Invalid file type.", "danger")
+        return redirect(url_for("admin.admin_view_reports"))
+
+    classes = iter_class_reports(year, semester, section, allocated_only)
+    tasks = (
+        (f"{y}_Sem{sem}_{sec}_{code}_attendance.{file_type}", rows, {"chart_title": f"{y} {sec} - {code}"})
+        for y, sem, sec, _, code, rows in classes
+    )
+    if file_type == "csv":
+        # Cheaper to encode here than to ship the rows to a worker
+        csv_engine = get_engine("csv")
+        members = ((name, csv_engine.render(rows, CLASS_REPORT_COLUMNS)) for name, rows, _ in tasks)
     else:
-        return "Invalid file type", 400
+        members = render_many(file_type, tasks)
+
+    return generate_zip_report(members, f"attendance_{scope}_{file_type}.zip")
+
+@admin_bp.route("/jobs/<job_id>")
+@login_required
+def admin_report_job(job_id):
+    job = get_job(job_id, session["username"])
+    if not job:
+        flash("Report not found or expired.", "danger")
+        return redirect(url_for("admin.admin_view_reports"))
+    return render_template(
+        "report_job.html", job=job_status(job),
+        status_url=url_for("admin.admin_report_job_status", job_id=job_id),
+        download_url=url_for("admin.admin_report_job_download", job_id=job_id),
+        back_url=url_for("admin.admin_view_reports"),
+    )
+
+@admin_bp.route("/jobs/<job_id>/status")
+@login_required
+def admin_report_job_status(job_id):
+    job = get_job(job_id, session["username"])
+    if not job:
+        return jsonify({"error": "not found"}), 404
+    return jsonify(job_status(job))
+
+@admin_bp.route("/jobs/<job_id>/download")
+@login_required
+def admin_report_job_download(job_id):
+    job = get_job(job_id, session["username"])
+    path = artifact_path(job) if job else None
+    if not path:
+        flash("Report is not ready or has expired.", "danger")
+        return redirect(url_for("admin.admin_view_reports"))
+    cache_artifact(job, path)
+    return send_file(path, as_attachment=True, download_name=job["filename"], mimetype=job["mimetype"])
 
 @admin_bp.route("/change_password", methods=["GET","POST"])
 @login_required
@@ -357,4 +443,83 @@ def admin_change_password():
         change_teacher_password(username, new_password)
         flash("Password changed successfully", "success")
         return redirect(url_for("admin.admin_dashboard"))
-    return render_template("change_password.html", username=session["username"])
\ No newline at end of file
+    return render_template("change_password.html", username=session["username"])
+
+AUDIT_LIMIT = 500
+
+@admin_bp.route("/audit")
+@login_required
+def admin_audit():
+    filters = {
+        "mis_no": request.args.get("mis_no", "").strip() or None,
+        "subject_id": request.args.get("subject_id", type=int),
+        "teacher_username": request.args.get("teacher", "").strip() or None,
+        "date_from": request.args.get("date_from") or None,
+        "date_to": request.args.get("date_to") or None,
+    }
+    # One more than is shown, to tell whether older changes were left out
+    entries = get_attendance_history(**filters, limit=AUDIT_LIMIT + 1) if any(filters.values()) else None
+    return render_template("audit_log.html", entries=entries, subjects=get_all_subjects(),
+                           filters=filters, limit=AUDIT_LIMIT)
+
+# --- ANALYTICS ---
+def _analytics_request():
+    """(analytics module, term, options) for the filters in the query string, or None without NumPy."""
+    try:
+        # Imported on first use so that NumPy is not loaded at startup
+        import analytics
+    except ImportError:
+        flash("Analytics need NumPy: pip install numpy", "danger")
+        return None
+    options = {
+        "year": request.args.get("year") or None,
+        "semester": request.args.get("semester", "").strip() or None,
+        "section": request.args.get("section", "").strip() or None,
+        "threshold": request.args.get("threshold", analytics.DETENTION_THRESHOLD, type=float),
+        "min_streak": request.args.get("min_streak", analytics.MIN_STREAK, type=int),
+    }
+    conn = get_db_connection()
+    try:
+        term = analytics.load_term(conn.cursor(), options["year"], options["semester"], options["section"])
+    finally:
+        conn.close()
+    return analytics, term, options
+
+@admin_bp.route("/analytics")
+@login_required
+def admin_analytics():
+    results, options = None, {}
+    if request.args:
+        loaded = _analytics_request()
+        if loaded:
+            analytics, term, options = loaded
+            results = {
+                "marks": len(term), "students": len(term.students), "classes": len(term.classes),
+                "distributions": analytics.distributions(term, options["threshold"]),
+                "detention": analytics.detention_list(term, options["threshold"]),
+                "streaks": analytics.absence_streaks(term, options["min_streak"]),
+                "weekdays": analytics.weekday_trend(term),
+                "weeks": analytics.term_trend(term),
+            }
+    return render_template("analytics.html", results=results, options=options,
+                           years=get_student_years(), limit=500)
+
+@admin_bp.route("/analytics/<kind>.csv")
+@login_required
+def admin_analytics_export(kind):
+    if kind not in ("distributions", "detention", "streaks"):
+        return "Invalid export", 400
+    loaded = _analytics_request()
+    if not loaded:
+        return redirect(url_for("admin.admin_analytics"))
+    analytics, term, options = loaded
+    columns, rows = analytics.export_rows(term, kind, options["threshold"], options["min_streak"])
+    name = "_".join(str(options[key]) for key in ("year", "semester", "section") if options[key]) or "all"
+    return generate_csv_report(rows, columns, f"{name}_{kind}.csv")
+
+@admin_bp.route("/stats")
+@login_required
+def admin_stats():
+    return jsonify({"db_pool": pool_stats(), "wal_checkpoint": checkpoint_stats(), "cache": cache_stats(),
+                    "report_cache": report_cache_stats(), "auth": auth_stats(),
+                    "sessions": session_stats()})
@@ -0,0 +1,276 @@
+import argparse
+import json
+import sqlite3
+import archive
+
+# Materialized attendance counts read by the reports.
+#
+#   attendance_stats      (mis_no, subject_id, year, semester, section) -> present, marked
+#   class_session_counts  (subject_id, year, semester, section) -> sessions
+#
+# save_bulk_attendance keeps both up to date in its own transaction:
+# read_marks() captures the session's marks before the upsert, only the
+# marks that differ are written, and apply_marks() folds in just those, so a
+# status flip moves one count instead of re-aggregating history. A class session is recorded in
+# class_sessions the first time a class is marked for a (subject, date,
+# period); only then does its session count move. Each attendance row
+# records the class session it was taken in, and the mark counts towards
+# that class: after a move (move_class, update_student) the new class's
+# reports start from the sessions it holds.
+# rebuild()/verify() recompute the counts from the raw attendance and
+# class_sessions rows, adding the marks moved to the archive (see archive.py).
+#
+#   class_data_versions   (year, semester, section) -> version, roster_version
+#
+# Every write that can change a class's reports (marks, roster changes,
+# subject removal) bumps the class's version in the same transaction; cached
+# reports are keyed by it. Writes to the class's students (add, update,
+# remove, move) also bump roster_version, which keys the cached roster, so
+# saving marks leaves the roster cached.
+
+# --- QUERIES (also checked by migrations.explain_queries) ---
+READ_MARKS = """
+    SELECT mis_no, status FROM attendance
+    WHERE subject_id = ? AND date = ? AND period = ?
+"""
+CURRENT_CLASSES = """
+    SELECT mis_no, year, semester, section FROM students
+    WHERE mis_no IN (SELECT value FROM json_each(?))
+"""
+SAVED_CLASSES = """
+    SELECT a.mis_no, cs.year, cs.semester, cs.section
+    FROM attendance a
+    JOIN class_sessions cs ON cs.session_id = a.session_id
+    WHERE a.subject_id = ? AND a.date = ? AND a.period = ?
+"""
+RECORD_SESSION = """
+    INSERT OR IGNORE INTO class_sessions
+        (subject_id, year, semester, section, date, period, alloc_id, marked_by_teacher)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+"""
+SESSION_ID = """
+    SELECT session_id FROM class_sessions
+    WHERE subject_id = ? AND year = ? AND semester = ? AND section = ? AND date = ? AND period = ?
+"""
+
+def read_marks(cur, subject_id, date, period=1):
+    """Return {mis_no: status} for a subject session before it is saved."""
+    cur.execute(READ_MARKS, (subject_id, date, period))
+    return dict(cur.fetchall())
+
+def marked_in(cur, subject_id, date, period, mis_nos, previous):
+    """{mis_no: (year, semester, section)} of the class each student's mark in a session counts towards.
+
+    A new mark counts towards the student's current class; one already
+    saved stays with the class session recorded on its row, even if the
+    student has moved since.
+    """
+    cur.execute(CURRENT_CLASSES, (json.dumps(list(mis_nos)),))
+    classes = {mis_no: tuple(cls) for mis_no, *cls in cur.fetchall()}
+    if any(mis_no in previous for mis_no in classes):
+        cur.execute(SAVED_CLASSES, (subject_id, date, period))
+        for mis_no, *cls in cur.fetchall():
+            if mis_no in classes:
+                classes[mis_no] = tuple(cls)
+    return classes
+
+def apply_marks(cur, subject_id, date, attendance_data, previous, period=1,
+                alloc_id=None, teacher_username=None):
+    """Fold a saved batch into the aggregates given the marks before the save.
+
+    Returns {mis_no: session_id} of the class session each mark belongs to,
+    for the attendance rows.
+    """
+    classes = marked_in(cur, subject_id, date, period, attendance_data, previous)
+    deltas = []
+    for mis_no, status in attendance_data.items():
+        old = previous.get(mis_no)
+        present = int(status == "Present") - int(old == "Present")
+        marked = 1 if old is None else 0
+        if (present or marked) and mis_no in classes:
+            deltas.append((mis_no, subject_id, *classes[mis_no], present, marked))
+    cur.executemany("""
+        INSERT INTO attendance_stats (mis_no, subject_id, year, semester, section, present, marked)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT(mis_no, subject_id, year, semester, section) DO UPDATE SET
+            present = present + excluded.present,
+            marked = marked + excluded.marked
+    """, deltas)
+
+    session_ids = {}
+    bump_class_versions(cur, sorted(set(classes.values())))
+    for year, semester, section in sorted(set(classes.values())):
+        cur.execute(RECORD_SESSION, (subject_id, year, semester, section, date, period, alloc_id, teacher_username))
+        if cur.rowcount:
+            cur.execute("""
+                INSERT INTO class_session_counts (subject_id, year, semester, section, sessions)
+                VALUES (?, ?, ?, ?, 1)
+                ON CONFLICT(subject_id, year, semester, section) DO UPDATE SET
+                    sessions = sessions + 1
+            """, (subject_id, year, semester, section))
+        cur.execute(SESSION_ID, (subject_id, year, semester, section, date, period))
+        session_ids[(year, semester, section)] = cur.fetchone()[0]
+    return {mis_no: session_ids[cls] for mis_no, cls in classes.items()}
+
+def forget_student(cur, mis_no):
+    bump_student_class(cur, mis_no, roster=True)
+    cur.execute("DELETE FROM attendance_stats WHERE mis_no=?", (mis_no,))
+
+def forget_subject(cur, subject_id):
+    cur.execute("SELECT year, semester, section FROM class_session_counts WHERE subject_id=?", (subject_id,))
+    bump_class_versions(cur, cur.fetchall())
+    cur.execute("DELETE FROM attendance_stats WHERE subject_id=?", (subject_id,))
+    cur.execute("DELETE FROM class_sessions WHERE subject_id=?", (subject_id,))
+    cur.execute("DELETE FROM class_session_counts WHERE subject_id=?", (subject_id,))
+
+def bump_class_versions(cur, classes, roster=False):
+    """Bump the data version of each class, and with roster its roster version too."""
+    cur.executemany("""
+        INSERT INTO class_data_versions (year, semester, section, version, roster_version) VALUES (?, ?, ?, 1, ?)
+        ON CONFLICT(year, semester, section) DO UPDATE SET
+            version = version + 1,
+            roster_version = roster_version + excluded.roster_version
+    """, [(*cls, int(roster)) for cls in classes])
+
+def bump_student_class(cur, mis_no, roster=False):
+    """Bump the version of the class mis_no is currently in."""
+    cur.execute("SELECT year, semester, section FROM students WHERE mis_no=?", (mis_no,))
+    bump_class_versions(cur, cur.fetchall(), roster)
+
+def class_version(cur, year, semester, section):
+    cur.execute("SELECT version FROM class_data_versions WHERE year=? AND semester=? AND section=?",
+                (year, semester, section))
+    row = cur.fetchone()
+    return row[0] if row else 0
+
+def roster_version(cur, year, semester, section):
+    cur.execute("SELECT roster_version FROM class_data_versions WHERE year=? AND semester=? AND section=?",
+                (year, semester, section))
+    row = cur.fetchone()
+    return row[0] if row else 0
+
+# A mark saved before attendance rows recorded their class session counts
+# towards the student's current class.
+_EXPECTED_STATS = """
+    SELECT a.mis_no, a.subject_id,
+           COALESCE(cs.year, st.year), COALESCE(cs.semester, st.semester), COALESCE(cs.section, st.section),
+           SUM(CASE WHEN a.status='Present' THEN 1 ELSE 0 END), COUNT(*)
+    FROM attendance a
+    JOIN students st ON st.mis_no = a.mis_no
+    LEFT JOIN class_sessions cs ON cs.session_id = a.session_id
+    GROUP BY 1, 2, 3, 4, 5
+"""
+
+_EXPECTED_SESSIONS = """
+    SELECT subject_id, year, semester, section, COUNT(*)
+    FROM class_sessions
+    GROUP BY subject_id, year, semester, section
+"""
+
+def backfill_sessions(cur):
+    """Record class sessions for attendance saved before class_sessions existed.
+
+    The class is taken from each student's current year/semester/section.
+    """
+    cur.execute("""
+        INSERT OR IGNORE INTO class_sessions
+            (subject_id, year, semester, section, date, period, alloc_id, marked_by_teacher)
+        SELECT a.subject_id, st.year, st.semester, st.section, a.date, a.period,
+               (SELECT MIN(ta.alloc_id) FROM teacher_allocations ta
+                WHERE ta.subject_id = a.subject_id AND ta.year = st.year
+                  AND ta.semester = st.semester AND ta.section = st.section),
+               MAX(a.marked_by_teacher)
+        FROM attendance a
+        JOIN students st ON st.mis_no = a.mis_no
+        GROUP BY a.subject_id, st.year, st.semester, st.section, a.date, a.period
+    """)
+
+def backfill_session_ids(cur):
+    """Record the class session of attendance rows saved before rows carried one.
+
+    A row takes the session its student's current class held, else the
+    first class session for its subject, date and period.
+    """
+    cur.execute("""
+        UPDATE attendance SET session_id = COALESCE(
+            (SELECT cs.session_id FROM class_sessions cs
+             JOIN students st ON st.mis_no = attendance.mis_no
+             WHERE cs.subject_id = attendance.subject_id AND cs.year = st.year AND cs.semester = st.semester
+               AND cs.section = st.section AND cs.date = attendance.date AND cs.period = attendance.period),
+            (SELECT MIN(cs.session_id) FROM class_sessions cs
+             WHERE cs.subject_id = attendance.subject_id AND cs.date = attendance.date
+               AND cs.period = attendance.period))
+        WHERE session_id IS NULL
+    """)
+
+def rebuild_stats(cur):
+    cur.execute("DELETE FROM attendance_stats")
+    cur.execute("INSERT INTO attendance_stats (mis_no, subject_id, year, semester, section, present, marked) "
+                + _EXPECTED_STATS)
+    cur.executemany("""
+        INSERT INTO attendance_stats (mis_no, subject_id, year, semester, section, present, marked)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT(mis_no, subject_id, year, semester, section) DO UPDATE SET
+            present = present + excluded.present,
+            marked = marked + excluded.marked
+    """, [(*key, *counts) for key, counts in archive.member_counts(cur).items()])
+
+def rebuild(cur):
+    rebuild_stats(cur)
+    cur.execute("DELETE FROM class_session_counts")
+    cur.execute("INSERT INTO class_session_counts (subject_id, year, semester, section, sessions) "
+                + _EXPECTED_SESSIONS)
+    cur.execute("UPDATE class_data_versions SET version = version + 1")
+
+def _diff(table, expected, actual):
+    drift = []
+    for key in expected.keys() | actual.keys():
+        if expected.get(key) != actual.get(key):
+            drift.append((table, key, expected.get(key), actual.get(key)))
+    return drift
+
+def verify(cur):
+    """Compare the aggregates with the raw rows.
+
+    Returns a list of (table, key, expected, actual) for every mismatch.
+    """
+    def load(sql, key_len):
+        return {tuple(row[:key_len]): tuple(row[key_len:]) for row in cur.execute(sql).fetchall()}
+
+    expected = load(_EXPECTED_STATS, 5)
+    for key, (present, marked) in archive.member_counts(cur).items():
+        live = expected.get(key, (0, 0))
+        expected[key] = (live[0] + present, live[1] + marked)
+    drift = _diff("attendance_stats", expected,
+                  load("SELECT mis_no, subject_id, year, semester, section, present, marked FROM attendance_stats", 5))
+    drift += _diff("class_session_counts",
+                   load(_EXPECTED_SESSIONS, 4),
+                   load("SELECT subject_id, year, semester, section, sessions FROM class_session_counts", 4))
+    return sorted(drift, key=repr)
+
+def main(argv=None):
+    import db
+
+    parser = argparse.ArgumentParser(description="Verify or rebuild the attendance aggregate tables.")
+    parser.add_argument("--db", default=db.DB_NAME, help="database file (default: %(default)s)")
+    parser.add_argument("--rebuild", action="store_true", help="recompute the aggregates from raw rows")
+    args = parser.parse_args(argv)
+
+    conn = sqlite3.connect(args.db)
+    try:
+        drift = verify(conn.cursor())
+        for table, key, expected, actual in drift:
+            print(f"{table} {key}: expected {expected}, found {actual}")
+        print(f"{len(drift)} aggregate row(s) out of date")
+        if args.rebuild and drift:
+            conn.execute("BEGIN IMMEDIATE")
+            rebuild(conn.cursor())
+            conn.commit()
+            print("Aggregates rebuilt")
+            return 0
+        return 1 if drift else 0
+    finally:
+        conn.close()
+
+if __name__ == "__main__":
+    raise SystemExit(main())
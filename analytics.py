@@ -0,0 +1,263 @@
+import json
+import numpy as np
+
+# Term-wide attendance analytics on NumPy arrays.
+#
+# load_term() reads every mark of the selected classes once, live rows and
+# archived bitmaps alike, into parallel arrays with one element per mark
+# (student, subject, day, period, present). Every statistic below is then a
+# handful of array operations over all classes at once rather than a Python
+# loop per class and student.
+#
+# Students are counted per class: a student archived in one class and now in
+# another appears once for each. Percentages are taken against the class's
+# sessions, as in the class reports. Only marks for the sessions of the
+# student's own class are loaded.
+#
+# The admin pages import this module on first use, so NumPy is not loaded at
+# startup.
+
+WEEKDAYS = ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday"]
+DETENTION_THRESHOLD = 75.0
+MIN_STREAK = 3
+
+class Term:
+    """One or more classes' marks as parallel arrays.
+
+    students: [(mis_no, name, class index)]; classes: [(year, semester,
+    section)]; subjects: [(subject_id, subject_code)]; sessions: classes x
+    subjects array of session counts. student, subject, day (days since
+    1970-01-01), period and present hold one element per mark.
+    """
+    def __init__(self, students, classes, subjects, sessions, student, subject, day, period, present):
+        self.students, self.classes, self.subjects, self.sessions = students, classes, subjects, sessions
+        self.student, self.subject, self.day, self.period, self.present = student, subject, day, period, present
+        self.student_class = np.array([s[2] for s in students], dtype=np.int64)
+
+    def __len__(self):
+        return len(self.student)
+
+def _class_filter(alias, year, semester, section):
+    sql, params = "", []
+    for column, value in (("year", year), ("semester", semester), ("section", section)):
+        if value:
+            sql += f" AND {alias}.{column} = ?"
+            params.append(value)
+    return sql, params
+
+def _session_key(cls, subject, day, period):
+    return (cls * 4096 + subject) << 40 | day << 16 | period
+
+def load_term(cur, year=None, semester=None, section=None):
+    """Load the marks of every class matching the filter (all classes when empty)."""
+    where, params = _class_filter("st", year, semester, section)
+    cur.execute("SELECT mis_no, name, year, semester, section FROM students st WHERE 1=1" + where
+                + " ORDER BY year, semester, section, name", params)
+    live = cur.fetchall()
+
+    classes, students, index = {}, [], {}
+    def student_index(mis_no, name, cls):
+        c = classes.setdefault(cls, len(classes))
+        if (mis_no, c) not in index:
+            index[(mis_no, c)] = len(students)
+            students.append((mis_no, name, c))
+        return index[(mis_no, c)]
+    live_index = {mis_no: student_index(mis_no, name, tuple(cls)) for mis_no, name, *cls in live}
+
+    cur.execute("SELECT subject_id, subject_code FROM subjects ORDER BY subject_code")
+    subjects = [tuple(row) for row in cur.fetchall()]
+    subject_index = {subject_id: i for i, (subject_id, _) in enumerate(subjects)}
+    lookup = np.zeros(max(subject_index, default=0) + 1, dtype=np.int64)
+    lookup[list(subject_index)] = list(subject_index.values())
+
+    # Archived marks, unpacked a whole term at a time
+    parts = []
+    where, params = _class_filter("a", year, semester, section)
+    cur.execute("SELECT year, semester, section, subject_id, sessions, calendar, students, present, marked "
+                "FROM attendance_archive a WHERE 1=1" + where, params)
+    for year_, semester_, section_, subject_id, sessions, calendar, members, present, marked in cur.fetchall():
+        members = json.loads(members)
+        cls = (year_, semester_, section_)
+        rows = np.array([student_index(mis_no, name, cls) for mis_no, name in members], dtype=np.int64)
+        shape = (len(members), (sessions + 7) // 8)
+        marked = np.unpackbits(np.frombuffer(marked, np.uint8).reshape(shape), axis=1, bitorder="little")
+        present = np.unpackbits(np.frombuffer(present, np.uint8).reshape(shape), axis=1, bitorder="little")
+        position, session = np.nonzero(marked[:, :sessions])
+        calendar = json.loads(calendar)
+        days = np.array([date for date, _ in calendar], dtype="datetime64[D]").astype(np.int64)
+        periods = np.array([period for _, period in calendar], dtype=np.int64)
+        parts.append([rows[position], np.full(len(position), subject_index[subject_id], dtype=np.int64),
+                      days[session], periods[session], present[position, session].astype(bool)])
+    student_class = np.array([s[2] for s in students], dtype=np.int64)
+
+    # Live marks. Each row is one session off the covering attendance index,
+    # its students and statuses packed into two strings; a mark is kept when
+    # the student's own class met for that session.
+    where, params = _class_filter("cs", year, semester, section)
+    cur.execute("SELECT year, semester, section, subject_id, date, period FROM class_sessions cs WHERE 1=1"
+                + where, params)
+    met = [(classes[tuple(row[:3])], row[3], row[4], row[5]) for row in cur.fetchall() if tuple(row[:3]) in classes]
+    if met:
+        cur.execute("""
+            SELECT subject_id, CAST(julianday(date) - 2440587.5 AS INTEGER), period, COUNT(*),
+                   group_concat(mis_no, char(31)), group_concat(status = 'Present', '')
+            FROM attendance
+            WHERE subject_id IN (SELECT value FROM json_each(?)) AND date BETWEEN ? AND ?
+            GROUP BY subject_id, date, period
+        """, (json.dumps(sorted({m[1] for m in met})), min(m[2] for m in met), max(m[2] for m in met)))
+        rows = cur.fetchall()
+        head = np.array([row[:4] for row in rows], dtype=np.int64).reshape(-1, 4)
+        student = np.array([live_index.get(mis_no, -1) for mis_no in
+                            "\x1f".join(row[4] for row in rows).split("\x1f")], dtype=np.int64)
+        present = np.frombuffer("".join(row[5] for row in rows).encode(), np.uint8) == ord("1")
+        subject, day, period = (np.repeat(column, head[:, 3]) for column in
+                                (lookup[head[:, 0]], head[:, 1], head[:, 2]))
+        keep = np.flatnonzero(student >= 0)
+        student, subject, day, period, present = student[keep], subject[keep], day[keep], period[keep], present[keep]
+        met_class, met_subject, met_date, met_period = zip(*met)
+        met_keys = _session_key(np.array(met_class, dtype=np.int64), lookup[np.array(met_subject, dtype=np.int64)],
+                                np.array(met_date, dtype="datetime64[D]").astype(np.int64),
+                                np.array(met_period, dtype=np.int64))
+        keep = np.isin(_session_key(student_class[student], subject, day, period), met_keys)
+        parts.append([student[keep], subject[keep], day[keep], period[keep], present[keep]])
+
+    sessions = np.zeros((len(classes), len(subjects)), dtype=np.int64)
+    where, params = _class_filter("c", year, semester, section)
+    cur.execute("SELECT year, semester, section, subject_id, sessions FROM class_session_counts c WHERE 1=1"
+                + where, params)
+    for *cls, subject_id, count in cur.fetchall():
+        if tuple(cls) in classes:
+            sessions[classes[tuple(cls)], subject_index[subject_id]] = count
+
+    empty = np.zeros(0, dtype=np.int64)
+    parts = parts or [[empty, empty, empty, empty, empty.astype(bool)]]
+    return Term(students, list(classes), subjects, sessions,
+                *(np.concatenate([part[i] for part in parts]) for i in range(5)))
+
+# --- STATISTICS ---
+def percentages(term):
+    """(present, percent) arrays of students x subjects; percent is NaN where the class has not met."""
+    size = len(term.students) * len(term.subjects)
+    present = np.bincount(term.student * len(term.subjects) + term.subject, weights=term.present,
+                          minlength=size).reshape(len(term.students), len(term.subjects))
+    sessions = term.sessions[term.student_class]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        percent = np.where(sessions > 0, 100.0 * present / sessions, np.nan)
+    return present, percent
+
+def _class_label(cls):
+    return " / ".join(cls)
+
+def distributions(term, threshold=DETENTION_THRESHOLD):
+    """Spread of subject percentages for every class and subject, then per subject over all classes."""
+    _, percent = percentages(term)
+    groups = [(_class_label(cls), term.student_class == c, term.sessions[c]) for c, cls in enumerate(term.classes)]
+    # Classes meet different numbers of times, so the all-classes rows have no session count
+    groups.append(("All classes", np.ones(len(term.students), dtype=bool), [None] * len(term.subjects)))
+    rows = []
+    for label, members, sessions in groups:
+        block = percent[members]
+        counts = (~np.isnan(block)).sum(axis=0)
+        met = np.flatnonzero(counts > 0)
+        if not len(met):
+            continue
+        q = np.nanpercentile(block[:, met], [0, 25, 50, 75, 100], axis=0)
+        mean = np.nanmean(block[:, met], axis=0)
+        below = (np.nan_to_num(block, nan=np.inf) < threshold).sum(axis=0)
+        for k, s in enumerate(met):
+            rows.append({"class": label, "subject_code": term.subjects[s][1], "students": int(counts[s]),
+                         "sessions": sessions[s] and int(sessions[s]), "mean": round(float(mean[k]), 2),
+                         "min": round(float(q[0, k]), 2), "p25": round(float(q[1, k]), 2),
+                         "median": round(float(q[2, k]), 2), "p75": round(float(q[3, k]), 2),
+                         "max": round(float(q[4, k]), 2), "below": int(below[s])})
+    return rows
+
+def detention_list(term, threshold=DETENTION_THRESHOLD):
+    """Students below the threshold in any subject, lowest overall attendance first."""
+    present, percent = percentages(term)
+    sessions = term.sessions[term.student_class]
+    total = sessions.sum(axis=1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        overall = np.where(total > 0, 100.0 * present.sum(axis=1) / total, np.nan)
+    below = np.nan_to_num(percent, nan=np.inf) < threshold
+    flagged = np.flatnonzero(below.any(axis=1))
+    rows = []
+    for i in flagged[np.argsort(overall[flagged], kind="stable")]:
+        mis_no, name, c = term.students[i]
+        rows.append({"mis_no": mis_no, "name": name, "class": _class_label(term.classes[c]),
+                     "overall": round(float(overall[i]), 2),
+                     "subjects": [(term.subjects[s][1], round(float(percent[i, s]), 2))
+                                  for s in np.flatnonzero(below[i])]})
+    return rows
+
+def absence_streaks(term, min_length=MIN_STREAK):
+    """Longest and current runs of consecutive absences per student and subject.
+
+    Runs count marked sessions in date and period order. Returns the pairs
+    whose longest run is at least min_length, longest first.
+    """
+    if not len(term):
+        return []
+    order = np.lexsort((term.period, term.day, term.subject, term.student))
+    student, subject = term.student[order], term.subject[order]
+    absent = ~term.present[order]
+    n = len(order)
+    starts = np.flatnonzero(np.r_[True, (student[1:] != student[:-1]) | (subject[1:] != subject[:-1])])
+    first = np.zeros(n, dtype=bool)
+    first[starts] = True
+    # A run ends at every present mark and just before every group's first mark
+    idx = np.arange(n)
+    breaks = np.where(~absent, idx, np.where(first, idx - 1, -1))
+    run = np.where(absent, idx - np.maximum.accumulate(breaks), 0)
+    longest = np.maximum.reduceat(run, starts)
+    current = run[np.r_[starts[1:], n] - 1]
+    rows = []
+    for g in np.flatnonzero(longest >= min_length)[np.argsort(-longest[longest >= min_length], kind="stable")]:
+        mis_no, name, c = term.students[student[starts[g]]]
+        rows.append({"mis_no": mis_no, "name": name, "class": _class_label(term.classes[c]),
+                     "subject_code": term.subjects[subject[starts[g]]][1],
+                     "longest": int(longest[g]), "current": int(current[g])})
+    return rows
+
+def weekday_trend(term):
+    """Attendance rate per weekday: [(weekday, marks, percent)] for days with marks."""
+    weekday = (term.day + 3) % 7  # 1970-01-01 was a Thursday
+    marks = np.bincount(weekday, minlength=7)
+    present = np.bincount(weekday, weights=term.present, minlength=7)
+    return [(WEEKDAYS[d], int(marks[d]), round(float(100.0 * present[d] / marks[d]), 2)) for d in range(7) if marks[d]]
+
+def term_trend(term):
+    """Attendance rate per week of term, counted from each class's first session: [(week, marks, percent)]."""
+    if not len(term):
+        return []
+    cls = term.student_class[term.student]
+    start = np.full(len(term.classes), np.iinfo(np.int64).max)
+    np.minimum.at(start, cls, term.day)
+    week = (term.day - start[cls]) // 7
+    marks = np.bincount(week)
+    present = np.bincount(week, weights=term.present)
+    return [(w + 1, int(marks[w]), round(float(100.0 * present[w] / marks[w]), 2)) for w in range(len(marks)) if marks[w]]
+
+# --- EXPORTS ---
+EXPORTS = {
+    "distributions": (["Class", "Subject", "Students", "Sessions", "Mean %", "Min %", "25th %", "Median %",
+                       "75th %", "Max %", "Below Threshold"],
+                      lambda r: [r["class"], r["subject_code"], r["students"], r["sessions"], r["mean"], r["min"],
+                                 r["p25"], r["median"], r["p75"], r["max"], r["below"]]),
+    "detention": (["MIS Number", "Name", "Class", "Overall %", "Subjects Below Threshold"],
+                  lambda r: [r["mis_no"], r["name"], r["class"], r["overall"],
+                             "; ".join(f"{code} {percent}%" for code, percent in r["subjects"])]),
+    "streaks": (["MIS Number", "Name", "Class", "Subject", "Longest Absence Streak", "Current Absence Streak"],
+                lambda r: [r["mis_no"], r["name"], r["class"], r["subject_code"], r["longest"], r["current"]]),
+}
+
+def export_rows(term, kind, threshold=DETENTION_THRESHOLD, min_length=MIN_STREAK):
+    """(columns, rows) of one analytics table for the CSV export."""
+    columns, to_row = EXPORTS[kind]
+    if kind == "distributions":
+        rows = distributions(term, threshold)
+    elif kind == "detention":
+        rows = detention_list(term, threshold)
+    else:
+        rows = absence_streaks(term, min_length)
+    return columns, [to_row(r) for r in rows]
@@ -1,5 +1,7 @@
 from flask import Flask
-from db import init_db
+from db import init_db, init_app
+from jobs import resume_pending
+from session_store import init_sessions
 from auth import auth_bp
 from admin import admin_bp
 from teacher import teacher_bp
@@ -10,6 +12,9 @@ app.secret_key = "attendance_secret"
 
 
 init_db()
+init_app(app)
+init_sessions(app)
+resume_pending()
 
 
 app.register_blueprint(auth_bp)
@@ -0,0 +1,337 @@
+import argparse
+import datetime
+import heapq
+import json
+import sqlite3
+import time
+
+# Bit-packed archive of closed terms.
+#
+#   attendance_archive          (year, semester, section, subject_id) -> one term
+#   attendance_archive_members  (mis_no, year, semester, section, subject_id) -> position
+#
+# A term row holds the class's session calendar ([date, period] in date
+# order), its students ([mis_no, name]), and two bitmaps per student packed
+# back to back in the present and marked BLOBs: bit i of a student's bitmaps
+# is session i of the calendar. A mark costs two bits instead of an
+# attendance row and its index entries.
+#
+# archive_class() moves the attendance rows taken in a class's own sessions
+# (attendance.session_id) into the archive, every subject at once, in one
+# transaction. The aggregates (attendance_stats, class_sessions,
+# class_session_counts) keep counting archived marks, so reports read the
+# same before and after; aggregates.verify()/rebuild() add the archived bits
+# to the raw rows. A student who has left the class since is archived with it,
+# and marks a newcomer brought from another class stay with that class. An
+# archived session is closed: saving it again leaves archived students' marks
+# as they are.
+
+def row_bytes(sessions):
+    return (sessions + 7) // 8
+
+def _bits(blob, position, sessions):
+    size = row_bytes(sessions)
+    return int.from_bytes(blob[position * size:(position + 1) * size], "little")
+
+def _decode(row):
+    """(calendar, students, {(mis_no, (date, period)): status}) of an archive row."""
+    calendar = [tuple(session) for session in json.loads(row[0])]
+    students = [tuple(student) for student in json.loads(row[1])]
+    marks = {}
+    for position, (mis_no, _) in enumerate(students):
+        present = _bits(row[2], position, len(calendar))
+        marked = _bits(row[3], position, len(calendar))
+        for i, session in enumerate(calendar):
+            if marked >> i & 1:
+                marks[(mis_no, session)] = "Present" if present >> i & 1 else "Absent"
+    return calendar, students, marks
+
+def _encode(calendar, students, marks):
+    size = row_bytes(len(calendar))
+    present, marked = bytearray(), bytearray()
+    for mis_no, _ in students:
+        p = m = 0
+        for i, session in enumerate(calendar):
+            status = marks.get((mis_no, session))
+            if status is not None:
+                m |= 1 << i
+                if status == "Present":
+                    p |= 1 << i
+        present += p.to_bytes(size, "little")
+        marked += m.to_bytes(size, "little")
+    return bytes(present), bytes(marked)
+
+def _load(cur, year, semester, section, subject_id):
+    cur.execute("""
+        SELECT calendar, students, present, marked FROM attendance_archive
+        WHERE year=? AND semester=? AND section=? AND subject_id=?
+    """, (year, semester, section, subject_id))
+    row = cur.fetchone()
+    return _decode(row) if row else ([], [], {})
+
+def _store(cur, year, semester, section, subject_id, calendar, students, marks):
+    cur.execute("DELETE FROM attendance_archive_members WHERE subject_id=? AND year=? AND semester=? AND section=?",
+                (subject_id, year, semester, section))
+    if not calendar or not students:
+        cur.execute("DELETE FROM attendance_archive WHERE year=? AND semester=? AND section=? AND subject_id=?",
+                    (year, semester, section, subject_id))
+        return
+    present, marked = _encode(calendar, students, marks)
+    cur.execute("""
+        INSERT OR REPLACE INTO attendance_archive
+            (year, semester, section, subject_id, date_from, date_to, sessions,
+             calendar, students, present, marked, archived_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    """, (year, semester, section, subject_id, calendar[0][0], calendar[-1][0], len(calendar),
+          json.dumps(calendar, separators=(",", ":")), json.dumps(students, separators=(",", ":")),
+          present, marked, time.time()))
+    cur.executemany("""
+        INSERT INTO attendance_archive_members (mis_no, year, semester, section, subject_id, position)
+        VALUES (?, ?, ?, ?, ?, ?)
+    """, [(mis_no, year, semester, section, subject_id, position) for position, (mis_no, _) in enumerate(students)])
+
+# The live marks taken in one class's sessions of a subject
+CLASS_MARKS = """
+    SELECT a.id, a.mis_no, a.date, a.period, a.status
+    FROM class_sessions cs
+    JOIN attendance a ON a.session_id = cs.session_id
+    WHERE cs.subject_id = ? AND cs.year = ? AND cs.semester = ? AND cs.section = ?
+"""
+
+def archive_class(cur, year, semester, section):
+    """Move a class's marks into the archive for every subject it has met for.
+
+    Returns {"subjects", "sessions", "marks"} moved.
+    """
+    cur.execute("SELECT mis_no, name FROM students WHERE year=? AND semester=? AND section=? ORDER BY name",
+                (year, semester, section))
+    roster = [tuple(row) for row in cur.fetchall()]
+    cur.execute("SELECT subject_id FROM class_session_counts WHERE year=? AND semester=? AND section=?",
+                (year, semester, section))
+    subject_ids = [row[0] for row in cur.fetchall()]
+    moved = {"subjects": 0, "sessions": 0, "marks": 0}
+
+    for subject_id in subject_ids:
+        cur.execute("""
+            SELECT date, period FROM class_sessions
+            WHERE subject_id=? AND year=? AND semester=? AND section=?
+            ORDER BY date, period
+        """, (subject_id, year, semester, section))
+        calendar = [tuple(row) for row in cur.fetchall()]
+        cur.execute(CLASS_MARKS, (subject_id, year, semester, section))
+        live = cur.fetchall()
+        if not live:
+            continue
+
+        archived_calendar, students, marks = _load(cur, year, semester, section, subject_id)
+        marks.update({(mis_no, (date, period)): status for _, mis_no, date, period, status in live})
+        calendar = sorted(set(calendar) | set(archived_calendar))
+        # Students archived earlier keep their place; the rest of the roster and
+        # anyone marked here who has left the class since are appended
+        known = {mis_no for mis_no, _ in students}
+        students += [student for student in roster if student[0] not in known]
+        known.update(mis_no for mis_no, _ in roster)
+        cur.execute("SELECT mis_no, name FROM students WHERE mis_no IN (SELECT value FROM json_each(?)) ORDER BY name",
+                    (json.dumps(sorted({row[1] for row in live} - known)),))
+        students += [tuple(row) for row in cur.fetchall()]
+        _store(cur, year, semester, section, subject_id, calendar, students, marks)
+        cur.execute("DELETE FROM attendance WHERE id IN (SELECT value FROM json_each(?))",
+                    (json.dumps([row[0] for row in live]),))
+        moved["subjects"] += 1
+        moved["sessions"] += len({(row[2], row[3]) for row in live})
+        moved["marks"] += len(live)
+    return moved
+
+# --- READS ---
+_MEMBER_BITS = """
+    SELECT m.mis_no, m.subject_id, m.year, m.semester, m.section, a.sessions, a.date_from, a.date_to, a.calendar,
+           substr(a.present, m.position * ((a.sessions + 7) / 8) + 1, (a.sessions + 7) / 8) AS present,
+           substr(a.marked, m.position * ((a.sessions + 7) / 8) + 1, (a.sessions + 7) / 8) AS marked
+    FROM attendance_archive_members m
+    JOIN attendance_archive a ON a.year = m.year AND a.semester = m.semester
+     AND a.section = m.section AND a.subject_id = m.subject_id
+"""
+
+# The unary + keeps the lookup on the members' primary key, one probe per student
+SESSION_MARKS = _MEMBER_BITS + """
+    WHERE m.mis_no IN (SELECT value FROM json_each(?)) AND +m.subject_id = ?
+      AND a.date_from <= ? AND a.date_to >= ?
+"""
+
+def session_marks(cur, subject_id, date, period, mis_nos):
+    """{mis_no: status} of the archived marks among mis_nos for one session."""
+    # Form values arrive as strings; the calendar and the members' key hold integers
+    subject_id, period = int(subject_id), int(period)
+    cur.execute(SESSION_MARKS, (json.dumps(list(mis_nos)), subject_id, date, date))
+    marks = {}
+    for mis_no, _, _, _, _, _, _, _, calendar, present, marked in cur.fetchall():
+        calendar = [tuple(session) for session in json.loads(calendar)]
+        if (date, period) not in calendar:
+            continue
+        i = calendar.index((date, period))
+        if int.from_bytes(marked, "little") >> i & 1:
+            marks[mis_no] = "Present" if int.from_bytes(present, "little") >> i & 1 else "Absent"
+    return marks
+
+STUDENT_TERMS = """
+    SELECT b.subject_id, s.subject_name, b.date_from, b.date_to, b.calendar, b.present, b.marked
+    FROM (""" + _MEMBER_BITS + """ WHERE m.mis_no = ?) b
+    JOIN subjects s ON s.subject_id = b.subject_id
+"""
+
+def student_marks(cur, mis_no):
+    """A student's archived marks as dicts with date, subject_id, subject_name, period and status.
+
+    Unpacks every archived term the student is in; student_page() reads one page.
+    """
+    cur.execute(STUDENT_TERMS, (mis_no,))
+    marks = []
+    for subject_id, subject_name, _, _, calendar, present, marked in cur.fetchall():
+        present = int.from_bytes(present, "little")
+        marked = int.from_bytes(marked, "little")
+        for i, (date, period) in enumerate(json.loads(calendar)):
+            if marked >> i & 1:
+                marks.append({"date": date, "subject_id": subject_id, "subject_name": subject_name,
+                              "period": period, "status": "Present" if present >> i & 1 else "Absent"})
+    return marks
+
+def _term_marks(term, date_from, date_to, before):
+    """A term's marks for one student in history order: date DESC, then period."""
+    subject_id, subject_name, _, _, calendar, present, marked = term
+    calendar = json.loads(calendar)
+    present = int.from_bytes(present, "little")
+    marked = int.from_bytes(marked, "little")
+    # The calendar runs (date, period) ascending: walk it backwards a date at a time
+    end = len(calendar)
+    while end:
+        start = end - 1
+        while start and calendar[start - 1][0] == calendar[end - 1][0]:
+            start -= 1
+        date = calendar[start][0]
+        if date_from and date < date_from:
+            return
+        if not date_to or date <= date_to:
+            for i in range(start, end):
+                period = calendar[i][1]
+                if marked >> i & 1 and (before is None or date < before[0]
+                                        or (date == before[0] and (subject_name, period, subject_id) > before[1])):
+                    yield {"date": date, "subject_id": subject_id, "subject_name": subject_name,
+                           "period": period, "status": "Present" if present >> i & 1 else "Absent"}
+        end = start
+
+def _history_order(mark):
+    return (-datetime.date.fromisoformat(mark["date"]).toordinal(),
+            mark["subject_name"], mark["period"], mark["subject_id"])
+
+def student_page(cur, mis_no, limit, before=None, date_from=None, date_to=None, subject_id=None):
+    """Up to limit of a student's archived marks in history order (date DESC,
+    subject_name, period, subject_id), as student_marks() dicts.
+
+    before is a history cursor, (date, (subject_name, period, subject_id));
+    only marks after it are returned. Terms are opened newest first, and
+    only while they can still hold a mark for this page, so a page unpacks
+    about limit marks however long the archived history is.
+    """
+    sql = STUDENT_TERMS + " WHERE 1=1"
+    params = [mis_no]
+    if date_from:
+        sql += " AND b.date_to >= ?"
+        params.append(date_from)
+    if date_to or before:
+        sql += " AND b.date_from <= ?"
+        params.append(min(d for d in (date_to, before and before[0]) if d))
+    if subject_id:
+        sql += " AND b.subject_id = ?"
+        params.append(int(subject_id))
+    sql += " ORDER BY b.date_to DESC"
+    terms = iter(cur.execute(sql, params).fetchall())
+
+    page, heap, pending = [], [], next(terms, None)
+    while len(page) < limit:
+        # Open every term that may hold a mark as new as the newest one found so far
+        while pending is not None and (not heap or pending[3] >= heap[0][2]["date"]):
+            marks = _term_marks(pending, date_from, date_to, before)
+            mark = next(marks, None)
+            if mark is not None:
+                heapq.heappush(heap, (_history_order(mark), id(marks), mark, marks))
+            pending = next(terms, None)
+        if not heap:
+            break
+        _, _, mark, marks = heapq.heappop(heap)
+        page.append(mark)
+        mark = next(marks, None)
+        if mark is not None:
+            heapq.heappush(heap, (_history_order(mark), id(marks), mark, marks))
+    return page
+
+def member_counts(cur):
+    """{(mis_no, subject_id, year, semester, section): (present, marked)} over every archived term."""
+    counts = {}
+    for mis_no, subject_id, year, semester, section, *_, present, marked in cur.execute(_MEMBER_BITS).fetchall():
+        marked = int.from_bytes(marked, "little").bit_count()
+        if marked:
+            counts[(mis_no, subject_id, year, semester, section)] = (
+                int.from_bytes(present, "little").bit_count(), marked)
+    return counts
+
+# --- REMOVALS ---
+def forget_student(cur, mis_no):
+    """Drop a student's bits from every archived term they are in."""
+    cur.execute("SELECT year, semester, section, subject_id FROM attendance_archive_members WHERE mis_no=?",
+                (mis_no,))
+    for year, semester, section, subject_id in cur.fetchall():
+        calendar, students, marks = _load(cur, year, semester, section, subject_id)
+        students = [student for student in students if student[0] != mis_no]
+        _store(cur, year, semester, section, subject_id, calendar, students, marks)
+
+def forget_subject(cur, subject_id):
+    cur.execute("DELETE FROM attendance_archive_members WHERE subject_id=?", (subject_id,))
+    cur.execute("DELETE FROM attendance_archive WHERE subject_id=?", (subject_id,))
+
+def list_terms(cur):
+    cur.execute("""
+        SELECT year, semester, section, COUNT(*), MIN(date_from), MAX(date_to), SUM(sessions),
+               SUM(length(present) + length(marked) + length(calendar) + length(students))
+        FROM attendance_archive
+        GROUP BY year, semester, section
+        ORDER BY year, semester, section
+    """)
+    return cur.fetchall()
+
+def main(argv=None):
+    import db
+
+    parser = argparse.ArgumentParser(description="Move a closed term's attendance into the bit-packed archive.")
+    parser.add_argument("--db", default=db.DB_NAME, help="database file (default: %(default)s)")
+    parser.add_argument("--vacuum", action="store_true", help="give the freed pages back to the filesystem")
+    parser.add_argument("term", nargs="*", metavar="CLASS",
+                        help="year, semester and section of the class to archive; without one, list archived terms")
+    args = parser.parse_args(argv)
+    if args.term and len(args.term) != 3:
+        parser.error("give the class as YEAR SEMESTER SECTION")
+
+    conn = sqlite3.connect(args.db, isolation_level=None)
+    try:
+        conn.execute(f"PRAGMA busy_timeout={db.get_profile()['busy_timeout']}")
+        if args.term:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                moved = archive_class(conn.cursor(), *args.term)
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+            print(f"Archived {moved['marks']} mark(s) over {moved['sessions']} session(s) "
+                  f"in {moved['subjects']} subject(s)")
+            if args.vacuum:
+                conn.execute("VACUUM")
+                conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        for year, semester, section, subjects, date_from, date_to, sessions, size in list_terms(conn.cursor()):
+            print(f"{year} / {semester} / {section}: {subjects} subject(s), {sessions} session(s) "
+                  f"from {date_from} to {date_to}, {size} bytes")
+        return 0
+    finally:
+        conn.close()
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -1,35 +1,79 @@
-from flask import Blueprint, render_template, request, redirect, url_for, flash, session
-from models import verify_teacher, verify_student, get_teacher_name
+from functools import wraps
+from flask import Blueprint, render_template, request, redirect, url_for, flash, session, jsonify
+from models import verify_teacher, verify_student
+from passwords import HashPoolBusy, login_throttle, record_login
 
 auth_bp = Blueprint("auth", __name__)
 
+def role_required(*user_types, api=False):
+    """Decorator factory for views open to the given user types.
+
+    Identity is resolved once at login and kept in the server-side session,
+    so the check reads the session only and makes no database query. API
+    views answer 401 instead of redirecting to the login page.
+    """
+    def decorate(f):
+        @wraps(f)
+        def decorated(*args, **kwargs):
+            if session.get("user_type") not in user_types:
+                if api:
+                    return jsonify({"error": "login required"}), 401
+                return redirect(url_for("auth.login"))
+            return f(*args, **kwargs)
+        return decorated
+    return decorate
+
 @auth_bp.route("/", methods=["GET", "POST"])
 def login():
     if request.method == "POST":
         user_type = request.form["user_type"]
         username = request.form["username"]
         password = request.form["password"]
+        account = f"{user_type}:{username}"
+
+        # Refused before any password hashing is spent on it
+        retry_after = login_throttle.retry_after(account, request.remote_addr)
+        if retry_after:
+            flash(f"Too many failed attempts. Try again in {retry_after} seconds.", "danger")
+            return render_template("login.html"), 429, {"Retry-After": str(retry_after)}
+
+        try:
+            if user_type == "admin":
+                ok = username == "admin" and verify_teacher(username, password)
+            elif user_type == "teacher":
+                ok = verify_teacher(username, password)
+            elif user_type == "student":
+                ok = verify_student(username, password)
+            else:
+                ok = False
+        except HashPoolBusy:
+            flash("The server is busy. Please try again in a moment.", "warning")
+            return render_template("login.html"), 503, {"Retry-After": "5"}
 
-        if user_type == "admin" and verify_teacher(username, password) and username=="admin":
+        record_login(ok)
+        if not ok:
+            login_throttle.failed(account, request.remote_addr)
+            flash("Invalid credentials!", "danger")
+            return render_template("login.html")
+        login_throttle.succeeded(account)
+        # A fresh session id on every login, so an id seen before login is worthless
+        session.clear()
+        session.regenerate()
+
+        if user_type == "admin":
             session["user_type"] = "admin"
             session["username"] = username
             return redirect(url_for("admin.admin_dashboard"))
 
-        elif user_type == "teacher" and verify_teacher(username, password):
+        elif user_type == "teacher":
             session["user_type"] = "teacher"
             session["username"] = username
-
-           
-            session["teacher_name"] = get_teacher_name(username)
-
+            session["teacher_name"] = username
             return redirect(url_for("teacher.teacher_dashboard"))
 
-        elif user_type == "student" and verify_student(username, password):
-            session["user_type"] = "student"
-            session["mis_no"] = username
-            return redirect(url_for("student.student_dashboard"))
-
-        flash("Invalid credentials!", "danger")
+        session["user_type"] = "student"
+        session["mis_no"] = username
+        return redirect(url_for("student.student_dashboard"))
 
     return render_template("login.html")
 
@@ -0,0 +1,464 @@
+"""Benchmarks for the attendance system.
+
+Each benchmark runs in its own process against a throwaway database, so this
+never touches attendance_system.db:
+
+    python bench.py                 # run everything
+    python bench.py dashboard       # run one benchmark
+"""
+import argparse
+import io
+import os
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCHMARKS = {}
+
+def benchmark(fn):
+    BENCHMARKS[fn.__name__] = fn
+    return fn
+
+def _measure(fn, repeat=20):
+    """Median wall time of fn() in milliseconds."""
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings)
+
+def _setup_db():
+    """Point the app at a fresh temporary database and create the schema."""
+    os.environ["ATTENDANCE_DB"] = os.path.join(tempfile.mkdtemp(prefix="attendance-bench-"), "bench.db")
+    import db
+    db.init_db()
+    return db
+
+CLASSES = [("3", "5", "A"), ("3", "5", "B"), ("2", "3", "A"), ("2", "3", "B")]
+SUBJECTS = 6
+
+def _populate_roster(conn, students_per_class=60):
+    cur = conn.cursor()
+    cur.executemany("INSERT INTO subjects (subject_code, subject_name) VALUES (?, ?)",
+                    [(f"BT{n:03d}", f"Subject {n}") for n in range(1, SUBJECTS + 1)])
+    students = []
+    for c, (year, semester, section) in enumerate(CLASSES):
+        for n in range(students_per_class):
+            students.append((f"{c}{n:05d}", f"Student {c}-{n}", "x", year, semester, section))
+    cur.executemany("INSERT INTO students (mis_no, name, password, year, semester, section) "
+                    "VALUES (?, ?, ?, ?, ?, ?)", students)
+    cur.executemany("INSERT INTO teachers (username, password) VALUES (?, 'x')",
+                    [(f"teacher{s}",) for s in range(1, SUBJECTS + 1)])
+    cur.executemany("INSERT INTO teacher_allocations (teacher_username, subject_id, year, semester, section) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    [(f"teacher{s}", s, *cls) for cls in CLASSES for s in range(1, SUBJECTS + 1)])
+    conn.commit()
+    return students
+
+def _add_history(conn, students, first_day, days):
+    """Mark every student in every subject for `days` more days."""
+    import datetime
+    import aggregates
+
+    start = datetime.date(2020, 1, 1)
+    cur = conn.cursor()
+    for day in range(first_day, first_day + days):
+        date = (start + datetime.timedelta(days=day)).isoformat()
+        cur.executemany(
+            "INSERT INTO attendance (mis_no, date, subject_id, status, marked_by_teacher) VALUES (?, ?, ?, ?, 'bench')",
+            [(s[0], date, subject, "Present" if random.random() < 0.8 else "Absent")
+             for s in students for subject in range(1, SUBJECTS + 1)],
+        )
+    aggregates.backfill_sessions(cur)
+    aggregates.backfill_session_ids(cur)
+    aggregates.rebuild(cur)
+    conn.commit()
+
+def _legacy_summary(conn, mis_no):
+    # The three-pass summary fetch_student_attendance_summary used to run.
+    cur = conn.cursor()
+    cur.execute("SELECT name FROM students WHERE mis_no=?", (mis_no,))
+    cur.fetchone()
+    cur.execute("""
+        SELECT a.subject_id, s.subject_name, s.subject_code, COUNT(DISTINCT a.date) as total_classes
+        FROM attendance a
+        JOIN subjects s ON a.subject_id = s.subject_id
+        JOIN students st ON a.mis_no = st.mis_no
+        WHERE st.year = (SELECT year FROM students WHERE mis_no = ?)
+          AND st.semester = (SELECT semester FROM students WHERE mis_no = ?)
+          AND st.section = (SELECT section FROM students WHERE mis_no = ?)
+        GROUP BY a.subject_id, s.subject_name, s.subject_code
+    """, (mis_no, mis_no, mis_no))
+    cur.fetchall()
+    cur.execute("""
+        SELECT subject_id, COUNT(*) as present_count
+        FROM attendance
+        WHERE mis_no = ? AND status = 'Present'
+        GROUP BY subject_id
+    """, (mis_no,))
+    cur.fetchall()
+
+@benchmark
+def dashboard():
+    """Student dashboard summary latency as the cohort's history grows."""
+    db = _setup_db()
+    import models
+
+    conn = db.get_db_connection()
+    students = _populate_roster(conn)
+    mis_no = students[0][0]
+    print(f"{'marks':>10} {'summary ms':>12} {'legacy ms':>12}")
+    done = 0
+    for days in (20, 100, 400):
+        _add_history(conn, students, done, days - done)
+        done = days
+        marks = conn.execute("SELECT COUNT(*) FROM attendance").fetchone()[0]
+        summary = _measure(lambda: models.fetch_student_attendance_summary(mis_no))
+        legacy = _measure(lambda: _legacy_summary(conn, mis_no), repeat=5)
+        print(f"{marks:>10} {summary:>12.3f} {legacy:>12.3f}")
+    conn.close()
+
+def _peak_memory(fn):
+    """(result, peak traced allocation in MB) of fn()."""
+    import tracemalloc
+
+    tracemalloc.start()
+    try:
+        result = fn()
+        return result, tracemalloc.get_traced_memory()[1] / 1e6
+    finally:
+        tracemalloc.stop()
+
+@benchmark
+def csv_export():
+    """Streaming CSV export vs the DataFrame + BytesIO path: peak memory and first byte."""
+    from io import BytesIO
+    import pandas as pd
+    import utils
+
+    columns = ["MIS Number", "Name", "Classes Attended", "Total Classes", "Attendance %"]
+
+    def rows(n):
+        for i in range(n):
+            yield (f"{i:09d}", f"Student {i}", i % 90, 90, round((i % 90) / 90 * 100, 2))
+
+    def legacy(n):
+        buffer = BytesIO()
+        pd.DataFrame(list(rows(n)), columns=columns).to_csv(buffer, index=False)
+        return buffer.getbuffer().nbytes
+
+    def streamed(n):
+        return sum(len(chunk) for chunk in utils.iter_csv(rows(n), columns))
+
+    print(f"{'rows':>8} {'stream MB':>10} {'legacy MB':>10} {'stream ms':>10} {'legacy ms':>10} {'1st byte ms':>12}")
+    for n in (10_000, 100_000, 500_000):
+        _, stream_mb = _peak_memory(lambda: streamed(n))
+        _, legacy_mb = _peak_memory(lambda: legacy(n))
+        stream_ms = _measure(lambda: streamed(n), repeat=3)
+        legacy_ms = _measure(lambda: legacy(n), repeat=3)
+        first_byte = _measure(lambda: next(utils.iter_csv(rows(n), columns)), repeat=3)
+        print(f"{n:>8} {stream_mb:>10.2f} {legacy_mb:>10.2f} {stream_ms:>10.1f} {legacy_ms:>10.1f} {first_byte:>12.3f}")
+
+def _legacy_xlsx(data, columns):
+    # The DataFrame + ExcelWriter path ExcelEngine replaced.
+    from io import BytesIO
+    import pandas as pd
+
+    buffer = BytesIO()
+    with pd.ExcelWriter(buffer, engine="openpyxl") as writer:
+        pd.DataFrame(data, columns=columns).to_excel(writer, index=False, sheet_name="Attendance Report")
+    return buffer.getvalue()
+
+@benchmark
+def xlsx_export():
+    """Write-only XLSX from a row generator vs DataFrame + ExcelWriter: peak memory and time."""
+    import utils
+
+    columns = utils.CLASS_REPORT_COLUMNS
+    engine = utils.get_engine("xlsx")
+
+    def rows(n):
+        for i in range(n):
+            yield (f"{i:09d}", f"Student {i}", i % 90, 90, round((i % 90) / 90 * 100, 2))
+
+    _legacy_xlsx(list(rows(10)), columns)  # keep library imports out of the peaks
+    print(f"{'rows':>8} {'engine MB':>10} {'legacy MB':>10} {'engine ms':>10} {'legacy ms':>10}")
+    for n in (1_000, 20_000, 100_000):
+        _, engine_mb = _peak_memory(lambda: engine.render(rows(n), columns))
+        _, legacy_mb = _peak_memory(lambda: _legacy_xlsx(list(rows(n)), columns))
+        engine_ms = _measure(lambda: engine.render(rows(n), columns), repeat=3)
+        legacy_ms = _measure(lambda: _legacy_xlsx(list(rows(n)), columns), repeat=3)
+        print(f"{n:>8} {engine_mb:>10.2f} {legacy_mb:>10.2f} {engine_ms:>10.1f} {legacy_ms:>10.1f}")
+
+    # A department workbook: one sheet per class, all rows streamed
+    sheets = lambda: ((f"Class {c}", rows(2_000)) for c in range(10))
+    _, book_mb = _peak_memory(lambda: engine.render_sheets(sheets(), columns))
+    print(f"10 sheets x 2000 rows: {_measure(lambda: engine.render_sheets(sheets(), columns), repeat=3):.1f} ms, "
+          f"{book_mb:.2f} MB peak")
+
+def _legacy_pdf(data, columns, chart_title="Attendance Chart"):
+    # The drawString + pyplot renderer PdfEngine replaced.
+    from io import BytesIO
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+    import pandas as pd
+    from reportlab.lib.pagesizes import letter
+    from reportlab.lib.utils import ImageReader
+    from reportlab.pdfgen import canvas
+
+    buffer = BytesIO()
+    c = canvas.Canvas(buffer, pagesize=letter)
+    width, height = letter
+    y = height - 50
+    c.setFont("Helvetica-Bold", 14)
+    c.drawString(50, y, "Attendance Report")
+    y -= 30
+    c.setFont("Helvetica", 10)
+    for i, col in enumerate(columns):
+        c.drawString(50 + i * 100, y, str(col))
+    y -= 20
+    for row in data:
+        for i, item in enumerate(row):
+            c.drawString(50 + i * 100, y, str(item))
+        y -= 20
+        if y < 150:
+            c.showPage()
+            y = height - 50
+    df = pd.DataFrame(data, columns=columns)
+    plt.figure(figsize=(5, 3))
+    df.plot(kind="bar", x="Name", y="Attendance %", legend=False)
+    plt.title(chart_title)
+    img_buffer = BytesIO()
+    plt.tight_layout()
+    plt.savefig(img_buffer, format="PNG")
+    plt.close("all")
+    img_buffer.seek(0)
+    c.drawImage(ImageReader(img_buffer), 50, 50, width=400, height=200)
+    c.save()
+    return buffer.getvalue()
+
+@benchmark
+def pdf_report():
+    """Class report PDF: reportlab table flow + vector chart vs drawString + pyplot."""
+    from concurrent.futures import ThreadPoolExecutor
+    import utils
+
+    columns = ["MIS Number", "Name", "Classes Attended", "Total Classes", "Attendance %"]
+    engine = utils.get_engine("pdf")
+    print(f"{'rows':>6} {'engine ms':>10} {'legacy ms':>10} {'8 threads ms':>13}")
+    for n in (50, 500, 5000):
+        data = [(f"{i:09d}", f"Student {i}", i % 90, 90, round((i % 90) / 90 * 100, 2)) for i in range(n)]
+        engine_ms = _measure(lambda: engine.render(data, columns), repeat=3)
+        legacy_ms = _measure(lambda: _legacy_pdf(data, columns), repeat=1)
+
+        def parallel():
+            with ThreadPoolExecutor(8) as pool:
+                outputs = list(pool.map(lambda _: engine.render(data, columns), range(8)))
+            assert all(out.startswith(b"%PDF") for out in outputs)
+
+        parallel_ms = _measure(parallel, repeat=1)
+        print(f"{n:>6} {engine_ms:>10.1f} {legacy_ms:>10.1f} {parallel_ms:>13.1f}")
+
+@benchmark
+def bulk_export():
+    """Term-end export of every class: one report call per class vs one grouped pass + worker pool."""
+    db = _setup_db()
+    import jobs
+    import models
+    import utils
+
+    conn = db.get_db_connection()
+    students = _populate_roster(conn)
+    _add_history(conn, students, 0, 60)
+    classes = conn.execute(
+        "SELECT subject_id, year, semester, section FROM class_session_counts WHERE sessions > 0"
+    ).fetchall()
+    conn.close()
+
+    def per_class(file_type):
+        engine = utils.get_engine(file_type)
+        for subject_id, year, semester, section in classes:
+            rows, _ = models.get_class_report(year, semester, section, subject_id)
+            engine.render(rows, utils.CLASS_REPORT_COLUMNS)
+
+    def bulk(file_type):
+        tasks = ((f"{year}_{semester}_{section}_{code}", rows, {})
+                 for year, semester, section, _, code, rows in models.iter_class_reports())
+        if file_type == "csv":
+            engine = utils.get_engine("csv")
+            members = ((name, engine.render(rows, utils.CLASS_REPORT_COLUMNS)) for name, rows, _ in tasks)
+        else:
+            members = jobs.render_many(file_type, tasks)
+        for _ in utils.iter_zip(members):
+            pass
+
+    jobs.get_executor().submit(int).result()  # start the workers outside the timings
+    print(f"{len(classes)} classes, {jobs.REPORT_WORKERS} workers")
+    print(f"{'format':>6} {'per-class ms':>13} {'bulk zip ms':>12}")
+    for file_type in ("csv", "xlsx", "pdf"):
+        print(f"{file_type:>6} {_measure(lambda: per_class(file_type), repeat=3):>13.1f} "
+              f"{_measure(lambda: bulk(file_type), repeat=3):>12.1f}")
+    jobs.get_executor().shutdown()
+
+@benchmark
+def archive():
+    """Database size and student history latency before and after archiving every class."""
+    db = _setup_db()
+    import archive as archive_store
+    import models
+
+    conn = db.get_db_connection()
+    students = _populate_roster(conn)
+    _add_history(conn, students, 0, 200)
+    mis_no = students[0][0]
+
+    def size():
+        conn.execute("VACUUM")
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        return os.path.getsize(os.environ["ATTENDANCE_DB"]) / 1e6
+
+    marks = conn.execute("SELECT COUNT(*) FROM attendance").fetchone()[0]
+    print(f"{marks} marks")
+    print(f"{'store':>8} {'db MB':>8} {'history ms':>11} {'page ms':>8} {'summary ms':>11}")
+    print(f"{'rows':>8} {size():>8.1f} {_measure(lambda: models.get_student_detailed_report(mis_no)):>11.3f} "
+          f"{_measure(lambda: models.get_student_attendance_page(mis_no)):>8.3f} "
+          f"{_measure(lambda: models.fetch_student_attendance_summary(mis_no)):>11.3f}")
+    start = time.perf_counter()
+    conn.execute("BEGIN IMMEDIATE")
+    for cls in CLASSES:
+        archive_store.archive_class(conn.cursor(), *cls)
+    conn.commit()
+    elapsed = time.perf_counter() - start
+    print(f"{'archive':>8} {size():>8.1f} {_measure(lambda: models.get_student_detailed_report(mis_no)):>11.3f} "
+          f"{_measure(lambda: models.get_student_attendance_page(mis_no)):>8.3f} "
+          f"{_measure(lambda: models.fetch_student_attendance_summary(mis_no)):>11.3f}")
+    print(f"archived in {elapsed:.1f} s")
+    conn.close()
+
+@benchmark
+def student_import():
+    """Roster import time with the default import hash vs hashing with the login method."""
+    _setup_db()
+    import importer
+    import jobs
+    import passwords
+
+    rows = 500
+    executor = jobs.get_executor()
+    executor.submit(int).result()  # start the workers outside the timings
+    print(f"{rows} rows, {jobs.REPORT_WORKERS} workers")
+    print(f"{'hash':<22} {'import s':>9} {'ms/row':>7}")
+    for n, method in enumerate((importer.IMPORT_HASH_METHOD, passwords.HASH_METHOD)):
+        roster = "mis_no,name,year,semester,section,password\n" + "".join(
+            f"{n}{i:06d},Student {i},1,1,A,pw{i}\n" for i in range(rows))
+        importer.IMPORT_HASH_METHOD = method
+        start = time.perf_counter()
+        result = importer.import_students(io.BytesIO(roster.encode()), "roster.csv", executor)
+        elapsed = time.perf_counter() - start
+        assert result["imported"] == rows, result["errors"][:3]
+        print(f"{method:<22} {elapsed:>9.2f} {elapsed / rows * 1000:>7.2f}")
+    executor.shutdown()
+
+def _python_analytics(conn, threshold=75.0):
+    # The same percentages, detention list and streaks as a row-by-row loop.
+    sessions = {(y, s, sec, subject): n for y, s, sec, subject, n in
+                conn.execute("SELECT year, semester, section, subject_id, sessions FROM class_session_counts")}
+    classes = {mis_no: (y, s, sec) for mis_no, y, s, sec in
+               conn.execute("SELECT mis_no, year, semester, section FROM students")}
+    present, streaks, run = {}, {}, {}
+    for mis_no, subject, status in conn.execute(
+            "SELECT mis_no, subject_id, status FROM attendance ORDER BY mis_no, subject_id, date, period"):
+        key = (mis_no, subject)
+        present[key] = present.get(key, 0) + (status == "Present")
+        run[key] = run.get(key, 0) + 1 if status == "Absent" else 0
+        streaks[key] = max(streaks.get(key, 0), run[key])
+    below = {mis_no for (mis_no, subject), count in present.items()
+             if 100.0 * count / sessions[(*classes[mis_no], subject)] < threshold}
+    return below, streaks
+
+@benchmark
+def analytics():
+    """Term analytics over 1M marks: NumPy arrays against a row-by-row Python loop."""
+    db = _setup_db()
+    import analytics as term_analytics
+
+    conn = db.get_db_connection()
+    students = _populate_roster(conn)
+    _add_history(conn, students, 0, 700)
+    print(f"{conn.execute('SELECT COUNT(*) FROM attendance').fetchone()[0]} marks")
+
+    term = None
+    def load():
+        nonlocal term
+        term = term_analytics.load_term(conn.cursor())
+    steps = [
+        ("load", load),
+        ("distributions", lambda: term_analytics.distributions(term)),
+        ("detention list", lambda: term_analytics.detention_list(term)),
+        ("absence streaks", lambda: term_analytics.absence_streaks(term)),
+        ("weekday + week trends", lambda: (term_analytics.weekday_trend(term), term_analytics.term_trend(term))),
+    ]
+    print(f"{'step':<24} {'ms':>10}")
+    for label, fn in steps:
+        print(f"{label:<24} {_measure(fn, repeat=3):>10.1f}")
+    print(f"{'python loop (no trends)':<24} {_measure(lambda: _python_analytics(conn), repeat=3):>10.1f}")
+    conn.close()
+
+_STARTUP_PROBE = """
+import resource, sys, time
+start = time.perf_counter()
+import app
+{extra}
+elapsed = (time.perf_counter() - start) * 1000
+heavy = [m for m in ("pandas", "matplotlib", "reportlab", "openpyxl") if m in sys.modules]
+print(elapsed, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, ",".join(heavy) or "-")
+"""
+
+@benchmark
+def startup():
+    """Cold import time and peak RSS of the app module, with and without the reporting stack."""
+    env = dict(os.environ, ATTENDANCE_DB=os.path.join(tempfile.mkdtemp(prefix="attendance-bench-"), "bench.db"))
+    root = os.path.dirname(os.path.abspath(__file__))
+    cases = [
+        ("app", ""),
+        ("app + reports", "import pandas, matplotlib.pyplot, reportlab.pdfgen.canvas"),
+    ]
+    print(f"{'import':<16} {'ms':>8} {'RSS MB':>8}  heavy modules loaded")
+    for label, extra in cases:
+        runs = []
+        for _ in range(5):
+            out = subprocess.run([sys.executable, "-c", _STARTUP_PROBE.format(extra=extra)],
+                                 cwd=root, env=env, capture_output=True, text=True, check=True).stdout
+            ms, rss, heavy = out.split()
+            runs.append((float(ms), float(rss), heavy))
+        ms = statistics.median(r[0] for r in runs)
+        rss = statistics.median(r[1] for r in runs)
+        print(f"{label:<16} {ms:>8.1f} {rss:>8.1f}  {runs[0][2]}")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run attendance system benchmarks.")
+    parser.add_argument("names", nargs="*", metavar="name",
+                        help=f"benchmarks to run ({', '.join(sorted(BENCHMARKS))}); default all")
+    args = parser.parse_args(argv)
+    unknown = set(args.names) - set(BENCHMARKS)
+    if unknown:
+        parser.error(f"unknown benchmark(s): {', '.join(sorted(unknown))}")
+
+    if len(args.names) == 1:
+        name = args.names[0]
+        print(f"== {name}: {BENCHMARKS[name].__doc__}", flush=True)
+        BENCHMARKS[name]()
+        return 0
+    status = 0
+    for name in args.names or sorted(BENCHMARKS):
+        status |= subprocess.call([sys.executable, os.path.abspath(__file__), name])
+    return status
+
+if __name__ == "__main__":
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    raise SystemExit(main())
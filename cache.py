@@ -0,0 +1,153 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+
+# In-process read-through cache for reference data (years, sections, subjects,
+# allocations). Entries live for CACHE_TTL seconds; the models that change the
+# underlying tables also drop them explicitly through invalidate(). Each worker
+# process has its own cache, so a write made in another process is picked up
+# here at the latest when the entry expires.
+
+CACHE_TTL = float(os.environ.get("ATTENDANCE_CACHE_TTL", "300"))
+REPORT_CACHE_BYTES = int(float(os.environ.get("ATTENDANCE_REPORT_CACHE_MB", "64")) * 1024 * 1024)
+
+class TTLCache:
+    def __init__(self, ttl=CACHE_TTL):
+        self.ttl = ttl
+        self._entries = {}
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._invalidations = 0
+
+    def get(self, key, loader):
+        """Cached value for key, calling loader() to fill it on a miss or expiry."""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > now:
+                self._hits += 1
+                return entry[1]
+            self._misses += 1
+            generation = self._invalidations
+        value = loader()
+        with self._lock:
+            # Don't store a value loaded before an invalidation that raced it
+            if generation == self._invalidations:
+                self._entries[key] = (now + self.ttl, value)
+        return value
+
+    def invalidate(self, *namespaces):
+        """Drop every entry whose key starts with one of the namespaces."""
+        with self._lock:
+            self._invalidations += 1
+            for key in [k for k in self._entries if k[0] in namespaces]:
+                del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._invalidations += 1
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                "entries": len(self._entries),
+                "hits": self._hits,
+                "misses": self._misses,
+                "hit_rate": round(self._hits / lookups, 3) if lookups else None,
+                "invalidations": self._invalidations,
+                "ttl": self.ttl,
+            }
+
+_cache = TTLCache()
+
+def cached(namespace):
+    """Cache a function's result per positional arguments under namespace."""
+    def decorate(fn):
+        @wraps(fn)
+        def wrapper(*args):
+            return _cache.get((namespace, *args), lambda: fn(*args))
+        wrapper.uncached = fn
+        return wrapper
+    return decorate
+
+def invalidate(*namespaces):
+    _cache.invalidate(*namespaces)
+
+def clear_cache():
+    _cache.clear()
+
+def cache_stats():
+    return _cache.stats()
+
+# --- REPORT CACHE ---
+# Class reports and rendered exports, keyed by the class's data version (see
+# aggregates.bump_class_versions). A write bumps the version in the same
+# transaction, so an entry is only ever found by readers that saw the data it
+# was built from; superseded versions are never looked up again and age out.
+
+class LRUCache:
+    """Least-recently-used cache bounded by the total size of its values."""
+
+    def __init__(self, budget):
+        self.budget = budget
+        # No single entry may take more than a quarter of the budget
+        self.max_entry = budget // 4
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self._hits += 1
+            return entry[0]
+
+    def put(self, key, value, size):
+        if size > self.max_entry:
+            return False
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= old[1]
+            self._entries[key] = (value, size)
+            self._bytes += size
+            while self._bytes > self.budget:
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self._bytes -= evicted
+                self._evictions += 1
+        return True
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "budget": self.budget,
+                "hits": self._hits,
+                "misses": self._misses,
+                "hit_rate": round(self._hits / lookups, 3) if lookups else None,
+                "evictions": self._evictions,
+            }
+
+report_cache = LRUCache(REPORT_CACHE_BYTES)
+
+def report_cache_stats():
+    return report_cache.stats()
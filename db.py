@@ -1,10 +1,65 @@
+import os
+import random
 import sqlite3
+import threading
+import time
+from flask import g, has_app_context
 from werkzeug.security import generate_password_hash
+from migrations import migrate
 
-DB_NAME = "attendance_system.db"
+DB_NAME = os.environ.get("ATTENDANCE_DB", "attendance_system.db")
+POOL_SIZE = int(os.environ.get("ATTENDANCE_DB_POOL_SIZE", "8"))
+POOL_TIMEOUT = float(os.environ.get("ATTENDANCE_DB_POOL_TIMEOUT", "10"))
 
-def init_db():
-    conn = sqlite3.connect(DB_NAME)
+DB_PROFILE = os.environ.get("ATTENDANCE_DB_PROFILE", "concurrent")
+
+# Concurrency profiles. journal_mode is persistent and set by init_db(); the
+# rest are per-connection and applied once when a pooled connection is opened.
+# "concurrent" uses WAL so readers never wait on the attendance writer.
+PROFILES = {
+    "default": {
+        "journal_mode": "DELETE",
+        "synchronous": "FULL",
+        "cache_size": -2000,
+        "mmap_size": 0,
+        "temp_store": "DEFAULT",
+        "busy_timeout": 5000,
+        "checkpoint_interval": 0,
+    },
+    "concurrent": {
+        "journal_mode": "WAL",
+        "synchronous": "NORMAL",
+        "cache_size": -16000,
+        "mmap_size": 256 * 1024 * 1024,
+        "temp_store": "MEMORY",
+        "busy_timeout": 5000,
+        "checkpoint_interval": 300,
+    },
+}
+
+WRITE_RETRIES = int(os.environ.get("ATTENDANCE_DB_WRITE_RETRIES", "5"))
+WRITE_BACKOFF = float(os.environ.get("ATTENDANCE_DB_WRITE_BACKOFF", "0.05"))
+
+def get_profile(name=None):
+    name = name or DB_PROFILE
+    if name not in PROFILES:
+        raise ValueError(f"Unknown database profile: {name}")
+    return PROFILES[name]
+
+def connection_pragmas(profile):
+    return [
+        f"PRAGMA synchronous={profile['synchronous']}",
+        f"PRAGMA cache_size={profile['cache_size']}",
+        f"PRAGMA mmap_size={profile['mmap_size']}",
+        f"PRAGMA temp_store={profile['temp_store']}",
+        f"PRAGMA busy_timeout={profile['busy_timeout']}",
+    ]
+
+def init_db(profile=None, database=None):
+    profile = get_profile(profile)
+    conn = sqlite3.connect(database or DB_NAME)
+    conn.execute(f"PRAGMA busy_timeout={profile['busy_timeout']}")
+    conn.execute(f"PRAGMA journal_mode={profile['journal_mode']}")
     cur = conn.cursor()
 
     # 1. Students Table (Added semester)
@@ -54,7 +109,7 @@ def init_db():
         date TEXT NOT NULL,
         subject_id INTEGER NOT NULL,
         status TEXT NOT NULL,
-        marked_by_teacher TEXT, 
+        marked_by_teacher TEXT,
         FOREIGN KEY(mis_no) REFERENCES students(mis_no),
         FOREIGN KEY(subject_id) REFERENCES subjects(subject_id),
         UNIQUE(mis_no, date, subject_id)
@@ -67,9 +122,189 @@ def init_db():
                     ("admin", generate_password_hash("admin123")))
 
     conn.commit()
+
+    # Indexes and later schema changes are versioned in migrations.py
+    migrate(conn)
     conn.close()
 
+# --- CONNECTION POOL ---
+class PooledConnection(sqlite3.Connection):
+    """A sqlite3 connection whose close() hands it back to its pool."""
+    pool = None
+    scoped = False
+
+    def close(self):
+        if self.in_transaction:
+            self.rollback()
+        if self.scoped:
+            # Owned by the app context; released in close_db().
+            return
+        if self.pool is not None:
+            self.pool.release(self)
+        else:
+            super().close()
+
+    def discard(self):
+        sqlite3.Connection.close(self)
+
+class ConnectionPool:
+    """Bounded LIFO pool of warm connections shared by worker threads."""
+
+    def __init__(self, database, size=POOL_SIZE, timeout=POOL_TIMEOUT, profile=None):
+        self.database = database
+        self.profile = get_profile(profile)
+        self.size = size
+        self.timeout = timeout
+        self._idle = []
+        self._cond = threading.Condition()
+        self._created = 0
+        self._stats = {"acquired": 0, "reused": 0, "waits": 0, "timeouts": 0}
+
+    def _connect(self):
+        conn = sqlite3.connect(self.database, factory=PooledConnection, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        for pragma in connection_pragmas(self.profile):
+            conn.execute(pragma)
+        conn.pool = self
+        return conn
+
+    def acquire(self):
+        with self._cond:
+            while not self._idle and self._created >= self.size:
+                self._stats["waits"] += 1
+                if not self._cond.wait(self.timeout):
+                    self._stats["timeouts"] += 1
+                    raise sqlite3.OperationalError("database connection pool exhausted")
+            self._stats["acquired"] += 1
+            if self._idle:
+                self._stats["reused"] += 1
+                return self._idle.pop()
+            self._created += 1
+        try:
+            return self._connect()
+        except Exception:
+            with self._cond:
+                self._created -= 1
+                self._cond.notify()
+            raise
+
+    def release(self, conn):
+        with self._cond:
+            self._idle.append(conn)
+            self._cond.notify()
+
+    def clear(self):
+        with self._cond:
+            while self._idle:
+                self._idle.pop().discard()
+                self._created -= 1
+
+    def stats(self):
+        with self._cond:
+            return dict(
+                self._stats,
+                size=self.size,
+                created=self._created,
+                idle=len(self._idle),
+                in_use=self._created - len(self._idle),
+            )
+
+_pool = ConnectionPool(DB_NAME, profile=DB_PROFILE)
+
 def get_db_connection():
+    """Return the connection for the current app context, or a pooled one.
+
+    Inside a request every caller shares one connection, released back to
+    the pool at teardown; outside an app context the caller's close()
+    releases it.
+    """
+    if has_app_context():
+        if "db" not in g:
+            conn = _pool.acquire()
+            conn.scoped = True
+            g.db = conn
+        return g.db
+    return _pool.acquire()
+
+def close_db(exc=None):
+    conn = g.pop("db", None)
+    if conn is not None:
+        conn.scoped = False
+        conn.close()
+
+def pool_stats():
+    return _pool.stats()
+
+# --- WRITES ---
+def is_busy_error(exc):
+    message = str(exc).lower()
+    return "locked" in message or "busy" in message
+
+def run_write(conn, fn):
+    """Run fn(cursor) in an IMMEDIATE transaction and commit it.
+
+    busy_timeout already makes SQLite wait for the writer lock; if that still
+    runs out the transaction is retried with jittered exponential backoff.
+    """
+    for attempt in range(WRITE_RETRIES + 1):
+        try:
+            if not conn.in_transaction:
+                conn.execute("BEGIN IMMEDIATE")
+            result = fn(conn.cursor())
+            conn.commit()
+            return result
+        except sqlite3.OperationalError as e:
+            conn.rollback()
+            if not is_busy_error(e) or attempt == WRITE_RETRIES:
+                raise
+            time.sleep(WRITE_BACKOFF * (2 ** attempt) * (1 + random.random()))
+
+# --- WAL CHECKPOINTS ---
+_checkpoint = {"runs": 0, "last_run": None, "last_result": None, "errors": 0}
+_checkpoint_stop = threading.Event()
+_checkpoint_thread = None
+
+def checkpoint(mode="PASSIVE"):
+    """Fold the WAL back into the main database file without blocking readers."""
     conn = sqlite3.connect(DB_NAME)
-    conn.row_factory = sqlite3.Row
-    return conn
\ No newline at end of file
+    try:
+        conn.execute(f"PRAGMA busy_timeout={_pool.profile['busy_timeout']}")
+        busy, log_frames, checkpointed = conn.execute(f"PRAGMA wal_checkpoint({mode})").fetchone()
+        _checkpoint["runs"] += 1
+        _checkpoint["last_run"] = time.time()
+        _checkpoint["last_result"] = {"busy": busy, "log_frames": log_frames, "checkpointed": checkpointed}
+        return _checkpoint["last_result"]
+    finally:
+        conn.close()
+
+def _checkpoint_loop(interval):
+    while not _checkpoint_stop.wait(interval):
+        try:
+            checkpoint()
+        except sqlite3.Error as e:
+            _checkpoint["errors"] += 1
+            print(f"Error in WAL checkpoint: {e}")
+
+def start_checkpointer(interval=None):
+    global _checkpoint_thread
+    profile = _pool.profile
+    interval = interval or profile["checkpoint_interval"]
+    if profile["journal_mode"] != "WAL" or not interval:
+        return None
+    if _checkpoint_thread is None or not _checkpoint_thread.is_alive():
+        _checkpoint_stop.clear()
+        _checkpoint_thread = threading.Thread(
+            target=_checkpoint_loop, args=(interval,), name="wal-checkpoint", daemon=True
+        )
+        _checkpoint_thread.start()
+    return _checkpoint_thread
+
+def stop_checkpointer():
+    _checkpoint_stop.set()
+
+def checkpoint_stats():
+    return dict(_checkpoint)
+
+def init_app(app):
+    app.teardown_appcontext(close_db)
+    start_checkpointer()
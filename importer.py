@@ -0,0 +1,159 @@
+import argparse
+import csv
+import io
+import os
+import sqlite3
+import time
+from itertools import repeat
+from werkzeug.security import generate_password_hash
+from models import get_existing_students, add_students_bulk
+
+# Bulk student import from a CSV or XLSX roster with the columns
+# mis_no, name, year, semester, section, password (header names are matched
+# case-insensitively; "MIS Number" and "Sem" are accepted too).
+#
+# The roster is read as a stream and handled IMPORT_CHUNK rows at a time:
+# the chunk's rows are validated, the initial passwords hashed across the
+# process pool, and the chunk inserted with one executemany in one
+# transaction. A bad row is reported with its line number and skipped; it
+# never aborts the rest of the import.
+
+IMPORT_CHUNK = int(os.environ.get("ATTENDANCE_IMPORT_CHUNK", "500"))
+# Initial passwords are hashed cheaply (a few ms each instead of ~150 ms for
+# scrypt), so an import does not hold the admin request and the shared worker
+# pool for minutes; each is upgraded to passwords.HASH_METHOD when its
+# student first logs in.
+IMPORT_HASH_METHOD = os.environ.get("ATTENDANCE_IMPORT_HASH", "pbkdf2:sha256:10000")
+
+IMPORT_COLUMNS = ("mis_no", "name", "year", "semester", "section", "password")
+HEADER_ALIASES = {"mis_number": "mis_no", "mis": "mis_no", "sem": "semester"}
+SEMESTERS = {str(n) for n in range(1, 9)}
+
+def _cell(value):
+    if value is None:
+        return ""
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    return str(value).strip()
+
+def _header(names):
+    header = []
+    for name in names:
+        key = _cell(name).lower().replace(" ", "_")
+        header.append(HEADER_ALIASES.get(key, key))
+    missing = [c for c in IMPORT_COLUMNS if c not in header]
+    if missing:
+        raise ValueError(f"Missing column(s): {', '.join(missing)}")
+    return [header.index(c) for c in IMPORT_COLUMNS]
+
+def iter_roster(stream, filename):
+    """Yield (line_no, values) for each data row of a CSV or XLSX roster."""
+    if filename.lower().endswith(".xlsx"):
+        from openpyxl import load_workbook
+        workbook = load_workbook(stream, read_only=True, data_only=True)
+        try:
+            rows = workbook.active.iter_rows(values_only=True)
+            yield from _iter_rows(rows)
+        finally:
+            workbook.close()
+    elif filename.lower().endswith(".csv"):
+        text = io.TextIOWrapper(stream, encoding="utf-8-sig", newline="")
+        yield from _iter_rows(csv.reader(text))
+    else:
+        raise ValueError("Upload a .csv or .xlsx file")
+
+def _iter_rows(rows):
+    positions = None
+    for line_no, row in enumerate(rows, start=1):
+        if positions is None:
+            positions = _header(row)
+            continue
+        values = [_cell(row[i]) if i < len(row) else "" for i in positions]
+        if any(values):
+            yield line_no, values
+
+def validate(values):
+    """The row as a dict, or raise ValueError saying what is wrong with it."""
+    student = dict(zip(IMPORT_COLUMNS, values))
+    empty = [c for c in IMPORT_COLUMNS if not student[c]]
+    if empty:
+        raise ValueError(f"empty {', '.join(empty)}")
+    if student["semester"] not in SEMESTERS:
+        raise ValueError(f"semester must be 1-8, got {student['semester']!r}")
+    return student
+
+def hash_passwords(passwords, executor=None):
+    """Hash passwords with IMPORT_HASH_METHOD, across executor's processes if given."""
+    if executor is None:
+        return [generate_password_hash(p, IMPORT_HASH_METHOD) for p in passwords]
+    chunksize = max(1, len(passwords) // (4 * (os.cpu_count() or 1)))
+    return list(executor.map(generate_password_hash, passwords, repeat(IMPORT_HASH_METHOD), chunksize=chunksize))
+
+def import_students(stream, filename, executor=None, chunk_size=IMPORT_CHUNK):
+    """Import a roster; returns {"imported", "errors": [(line_no, mis_no, message)], "seconds"}."""
+    started = time.perf_counter()
+    result = {"imported": 0, "errors": []}
+    errors = result["errors"]
+    seen = set()
+
+    def flush(chunk):
+        # Checked before hashing so re-running an import costs no hashes for rows already in
+        existing = get_existing_students(s["mis_no"] for _, s in chunk)
+        errors.extend((line_no, s["mis_no"], "already registered") for line_no, s in chunk if s["mis_no"] in existing)
+        chunk = [(line_no, s) for line_no, s in chunk if s["mis_no"] not in existing]
+        if not chunk:
+            return
+        hashes = hash_passwords([s["password"] for _, s in chunk], executor)
+        rows = [(s["mis_no"], s["name"], h, s["year"], s["semester"], s["section"])
+                for (_, s), h in zip(chunk, hashes)]
+        try:
+            skipped = add_students_bulk(rows)
+        except sqlite3.Error as e:
+            print(f"Error in import_students: {e}")
+            errors.extend((line_no, s["mis_no"], "not saved, database error") for line_no, s in chunk)
+            return
+        errors.extend((line_no, s["mis_no"], "already registered") for line_no, s in chunk if s["mis_no"] in skipped)
+        result["imported"] += len(chunk) - len(skipped)
+
+    try:
+        chunk = []
+        for line_no, values in iter_roster(stream, filename):
+            try:
+                student = validate(values)
+            except ValueError as e:
+                errors.append((line_no, values[0], str(e)))
+                continue
+            if student["mis_no"] in seen:
+                errors.append((line_no, student["mis_no"], "duplicate MIS number in file"))
+                continue
+            seen.add(student["mis_no"])
+            chunk.append((line_no, student))
+            if len(chunk) >= chunk_size:
+                flush(chunk)
+                chunk = []
+        if chunk:
+            flush(chunk)
+    except (ValueError, csv.Error) as e:
+        errors.append((None, "", str(e)))
+    result["errors"].sort(key=lambda e: e[0] or 0)
+    result["seconds"] = round(time.perf_counter() - started, 2)
+    return result
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Import students from a CSV or XLSX roster.")
+    parser.add_argument("roster", help="roster file (.csv or .xlsx)")
+    parser.add_argument("--chunk-size", type=int, default=IMPORT_CHUNK, help="rows per transaction (default: %(default)s)")
+    args = parser.parse_args(argv)
+
+    import db
+    from jobs import get_executor
+    db.init_db()
+    with open(args.roster, "rb") as stream:
+        result = import_students(stream, args.roster, get_executor(), args.chunk_size)
+    for line_no, mis_no, message in result["errors"]:
+        print(f"line {line_no or '-'}: {mis_no or '-'}: {message}")
+    print(f"Imported {result['imported']} students in {result['seconds']}s, {len(result['errors'])} rows skipped")
+    return 1 if result["errors"] else 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())
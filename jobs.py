@@ -0,0 +1,216 @@
+import json
+import multiprocessing
+import os
+import threading
+import time
+import uuid
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from cache import report_cache
+from db import get_db_connection
+
+# Background report jobs. The report_jobs table stands in for a broker: the
+# web process records a job and hands its id to a local process pool; the
+# worker claims the row, renders the file into EXPORT_DIR and marks it done.
+# Artifacts and rows are purged once they pass their TTL.
+
+REPORT_WORKERS = int(os.environ.get("ATTENDANCE_REPORT_WORKERS", "2"))
+EXPORT_DIR = os.path.abspath(os.environ.get("ATTENDANCE_EXPORT_DIR", "exports"))
+EXPORT_TTL = int(os.environ.get("ATTENDANCE_EXPORT_TTL", "3600"))
+# Queued jobs older than this are assumed orphaned by a restart and re-dispatched;
+# running jobs older than JOB_TIMEOUT are marked failed.
+ORPHAN_AFTER = 60
+JOB_TIMEOUT = int(os.environ.get("ATTENDANCE_JOB_TIMEOUT", "1800"))
+
+JOB_KINDS = {}
+
+def job_kind(name):
+    def register(fn):
+        JOB_KINDS[name] = fn
+        return fn
+    return register
+
+_executor = None
+_executor_lock = threading.Lock()
+
+def get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            # spawn, not fork: children must not inherit the web process's
+            # open SQLite connections or its threads.
+            _executor = ProcessPoolExecutor(
+                max_workers=REPORT_WORKERS, mp_context=multiprocessing.get_context("spawn")
+            )
+        return _executor
+
+def render_report(file_type, rows, options):
+    """Render class report rows to bytes; runs in a worker process."""
+    from utils import CLASS_REPORT_COLUMNS, get_engine
+    return get_engine(file_type).render(rows, CLASS_REPORT_COLUMNS, **options)
+
+def render_many(file_type, tasks):
+    """Render (name, rows, options) tasks across the pool, yielding (name, content) in order.
+
+    At most two tasks per worker are in flight, so a long task list never has
+    more than that many reports' rows or files in memory at once.
+    """
+    executor = get_executor()
+    pending = deque()
+    for name, rows, options in tasks:
+        pending.append((name, executor.submit(render_report, file_type, rows, options)))
+        if len(pending) >= 2 * REPORT_WORKERS:
+            name, future = pending.popleft()
+            yield name, future.result()
+    while pending:
+        name, future = pending.popleft()
+        yield name, future.result()
+
+def enqueue(kind, params, owner, filename):
+    """Record a job and dispatch it to the pool. Returns the job id."""
+    if kind not in JOB_KINDS:
+        raise ValueError(f"Unknown job kind: {kind}")
+    purge_expired()
+    job_id = uuid.uuid4().hex
+    conn = get_db_connection()
+    conn.execute("""
+        INSERT INTO report_jobs (job_id, kind, params, owner, filename, status, progress, created_at)
+        VALUES (?, ?, ?, ?, ?, 'queued', 0, ?)
+    """, (job_id, kind, json.dumps(params), owner, filename, time.time()))
+    conn.commit()
+    conn.close()
+    get_executor().submit(run_job, job_id)
+    return job_id
+
+def get_job(job_id, owner):
+    conn = get_db_connection()
+    row = conn.execute("SELECT * FROM report_jobs WHERE job_id=? AND owner=?", (job_id, owner)).fetchone()
+    conn.close()
+    return row
+
+def job_status(job):
+    return {
+        "job_id": job["job_id"],
+        "status": job["status"],
+        "progress": job["progress"],
+        "message": job["message"],
+        "filename": job["filename"],
+    }
+
+def class_report_key(params):
+    """Report cache key of a class report export; params as for the class_report job."""
+    return ("class_export", params["year"], params["semester"], params["section"], str(params["subject_id"]),
+            params["version"], params["file_type"], params.get("chart_title"))
+
+def cache_artifact(job, path):
+    """Keep a finished class report in this process's report cache for repeat downloads."""
+    params = json.loads(job["params"])
+    if job["kind"] != "class_report" or "version" not in params:
+        return
+    if os.path.getsize(path) <= report_cache.max_entry:
+        with open(path, "rb") as f:
+            content = f.read()
+        report_cache.put(class_report_key(params), content, len(content))
+
+def artifact_path(job):
+    """Path of a finished job's file, or None if it is not (or no longer) available."""
+    path = job["artifact_path"]
+    if job["status"] != "done" or not path or not os.path.exists(path):
+        return None
+    return path
+
+def _update(conn, job_id, **fields):
+    assignments = ", ".join(f"{name}=?" for name in fields)
+    conn.execute(f"UPDATE report_jobs SET {assignments} WHERE job_id=?", (*fields.values(), job_id))
+    conn.commit()
+
+def run_job(job_id):
+    """Entry point in the worker process."""
+    conn = get_db_connection()
+    try:
+        cur = conn.execute("""
+            UPDATE report_jobs SET status='running', started_at=?
+            WHERE job_id=? AND status='queued'
+        """, (time.time(), job_id))
+        conn.commit()
+        if cur.rowcount == 0:
+            return  # already claimed by another worker
+        job = conn.execute("SELECT kind, params FROM report_jobs WHERE job_id=?", (job_id,)).fetchone()
+
+        def progress(percent, message=None):
+            _update(conn, job_id, progress=percent, message=message)
+
+        try:
+            content, mimetype = JOB_KINDS[job["kind"]](json.loads(job["params"]), progress)
+            os.makedirs(EXPORT_DIR, exist_ok=True)
+            path = os.path.join(EXPORT_DIR, job_id)
+            with open(path + ".part", "wb") as f:
+                f.write(content)
+            os.replace(path + ".part", path)
+        except Exception as e:
+            _update(conn, job_id, status="failed", message=str(e), finished_at=time.time(),
+                    expires_at=time.time() + EXPORT_TTL)
+            return
+        now = time.time()
+        _update(conn, job_id, status="done", progress=100, message=None, artifact_path=path,
+                mimetype=mimetype, finished_at=now, expires_at=now + EXPORT_TTL)
+    finally:
+        conn.close()
+
+def purge_expired():
+    now = time.time()
+    conn = get_db_connection()
+    expired = conn.execute(
+        "SELECT job_id, artifact_path FROM report_jobs WHERE expires_at < ?", (now,)
+    ).fetchall()
+    for job in expired:
+        if job["artifact_path"] and os.path.exists(job["artifact_path"]):
+            os.remove(job["artifact_path"])
+    conn.executemany("DELETE FROM report_jobs WHERE job_id=?", [(job["job_id"],) for job in expired])
+    conn.commit()
+    conn.close()
+    return len(expired)
+
+def resume_pending():
+    """Re-dispatch jobs orphaned by a restart and fail jobs that never finished."""
+    if multiprocessing.parent_process() is not None:
+        return 0  # a spawned worker re-importing app.py, not the web process
+    now = time.time()
+    conn = get_db_connection()
+    conn.execute("""
+        UPDATE report_jobs SET status='failed', message='Timed out', finished_at=?, expires_at=?
+        WHERE status='running' AND started_at < ?
+    """, (now, now + EXPORT_TTL, now - JOB_TIMEOUT))
+    conn.commit()
+    orphans = conn.execute(
+        "SELECT job_id FROM report_jobs WHERE status='queued' AND created_at < ?", (now - ORPHAN_AFTER,)
+    ).fetchall()
+    conn.close()
+    for job in orphans:
+        get_executor().submit(run_job, job["job_id"])
+    return len(orphans)
+
+# --- JOB KINDS ---
+@job_kind("class_report")
+def class_report_job(params, progress):
+    from models import iter_class_report
+    from utils import CLASS_REPORT_COLUMNS, get_engine
+
+    progress(10, "Rendering")
+    rows = iter_class_report(params["year"], params["semester"], params["section"], params["subject_id"])
+    engine = get_engine(params["file_type"])
+    content = engine.render(rows, CLASS_REPORT_COLUMNS, chart_title=params.get("chart_title", "Attendance Chart"))
+    return content, engine.mimetype
+
+@job_kind("class_workbook")
+def class_workbook_job(params, progress):
+    """Every matching class report in one XLSX, a sheet per class."""
+    from models import iter_class_reports
+    from utils import CLASS_REPORT_COLUMNS, get_engine
+
+    progress(10, "Rendering")
+    classes = iter_class_reports(params.get("year"), params.get("semester"), params.get("section"),
+                                 params.get("allocated_only", False))
+    sheets = ((f"{year}-{semester}{section} {code}", rows) for year, semester, section, _, code, rows in classes)
+    engine = get_engine("xlsx")
+    return engine.render_sheets(sheets, CLASS_REPORT_COLUMNS), engine.mimetype
@@ -0,0 +1,201 @@
+import argparse
+import datetime
+import heapq
+import json
+import sqlite3
+import time
+import zlib
+
+# Append-only journal of attendance changes, for settling disputes.
+#
+#   attendance_journal           (subject_id, teacher_username, date_from..date_to) -> packed saves
+#   attendance_journal_students  (mis_no, entry_id) -> the rows holding a student's changes
+#
+# Every attendance save that changes something appends one row in its own
+# transaction. The row's payload is a zlib-compressed JSON list of saves,
+#
+#   [saved_at, date, period, ["<old><new><mis_no>", ...]]
+#
+# where old/new are P (Present), A (Absent) or - (not marked). compact()
+# later merges a teacher's rows for one subject and month into a single row,
+# so the journal ends up with a few rows per teacher and subject per month
+# rather than one per change. forget_before() drops rows past retention.
+# The students index is kept with the rows, so a student's changes are found
+# without unpacking anyone else's, even after the student is removed.
+
+CODES = {"Present": "P", "Absent": "A", None: "-"}
+STATUSES = {code: status for status, code in CODES.items()}
+
+def pack(saves):
+    return zlib.compress(json.dumps(saves, separators=(",", ":")).encode(), 9)
+
+def unpack(payload):
+    return json.loads(zlib.decompress(payload))
+
+def record(cur, subject_id, date, period, teacher_username, changes):
+    """Append one save's changes, a list of (mis_no, old_status, new_status)."""
+    packed = [f"{CODES[old]}{CODES[new]}{mis_no}" for mis_no, old, new in changes]
+    cur.execute("""
+        INSERT INTO attendance_journal
+            (subject_id, teacher_username, date_from, date_to, saves, changes, payload)
+        VALUES (?, ?, ?, ?, 1, ?, ?)
+    """, (subject_id, teacher_username, date, date, len(changes),
+          pack([[round(time.time(), 3), date, period, packed]])))
+    _index_students(cur, cur.lastrowid, {mis_no for mis_no, _, _ in changes})
+
+def _index_students(cur, entry_id, mis_nos):
+    cur.executemany("INSERT OR IGNORE INTO attendance_journal_students (mis_no, entry_id) VALUES (?, ?)",
+                    [(mis_no, entry_id) for mis_no in sorted(mis_nos)])
+
+def backfill_students(cur):
+    """Index the students of rows written before attendance_journal_students existed."""
+    for entry_id, payload in cur.execute("SELECT entry_id, payload FROM attendance_journal").fetchall():
+        _index_students(cur, entry_id, {change[2:] for save in unpack(payload) for change in save[3]})
+
+def history(cur, subject_ids=None, teacher_username=None, mis_no=None, date_from=None, date_to=None, limit=None):
+    """Recorded changes, newest save first, as dicts; at most limit of them.
+
+    Rows are found through the subject, teacher or student indexes.
+    """
+    sql = """
+        SELECT j.subject_id, s.subject_code, j.teacher_username, j.payload
+        FROM attendance_journal j
+        LEFT JOIN subjects s ON s.subject_id = j.subject_id
+        WHERE j.date_from <= ? AND j.date_to >= ?
+    """
+    params = [date_to or "9999-12-31", date_from or ""]
+    if subject_ids is not None:
+        sql += " AND j.subject_id IN (SELECT value FROM json_each(?))"
+        params.append(json.dumps(list(subject_ids)))
+    if teacher_username is not None:
+        sql += " AND j.teacher_username = ?"
+        params.append(teacher_username)
+    if mis_no is not None:
+        sql += " AND j.entry_id IN (SELECT entry_id FROM attendance_journal_students WHERE mis_no = ?)"
+        params.append(mis_no)
+    cur.execute(sql, params)
+
+    def changes():
+        for subject_id, subject_code, teacher, payload in cur:
+            for saved_at, date, period, packed in unpack(payload):
+                if (date_from and date < date_from) or (date_to and date > date_to):
+                    continue
+                for change in packed:
+                    old, new, student = change[0], change[1], change[2:]
+                    if mis_no is None or student == mis_no:
+                        yield saved_at, student, date, period, subject_id, subject_code, teacher, old, new
+
+    def newest(change):
+        return change[0], change[1]
+
+    if limit is None:
+        found = sorted(changes(), key=newest, reverse=True)
+    else:
+        # Only the newest `limit` changes are kept while the rows are unpacked
+        found = heapq.nlargest(limit, changes(), key=newest)
+    return [{
+        "saved_at": saved_at,
+        "saved": datetime.datetime.fromtimestamp(saved_at).strftime("%Y-%m-%d %H:%M:%S"),
+        "date": date, "period": period,
+        "subject_id": subject_id, "subject_code": subject_code, "teacher": teacher,
+        "mis_no": student, "old": STATUSES[old], "new": STATUSES[new],
+    } for saved_at, student, date, period, subject_id, subject_code, teacher, old, new in found]
+
+def compact(conn, before):
+    """Merge each teacher's rows per subject and month for dates before `before`.
+
+    Each group is merged in its own short transaction. Returns (groups merged,
+    rows before, rows after), counting only the groups actually merged.
+    """
+    groups = conn.execute("""
+        SELECT subject_id, teacher_username, substr(date_from, 1, 7) AS month, COUNT(*)
+        FROM attendance_journal
+        WHERE date_to < ? AND substr(date_from, 1, 7) = substr(date_to, 1, 7)
+        GROUP BY subject_id, teacher_username, month
+        HAVING COUNT(*) > 1
+    """, (before,)).fetchall()
+    merged = rows_before = 0
+    for subject_id, teacher_username, month, _ in groups:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            cur = conn.execute("""
+                SELECT entry_id, date_from, date_to, saves, changes, payload FROM attendance_journal
+                WHERE subject_id = ? AND teacher_username IS ? AND date_from >= ? AND date_to < ?
+                  AND substr(date_from, 1, 7) = ? AND substr(date_to, 1, 7) = ?
+            """, (subject_id, teacher_username, month, before, month, month))
+            rows = cur.fetchall()
+            if len(rows) < 2:
+                conn.rollback()
+                continue
+            saves = sorted((save for row in rows for save in unpack(row[5])), key=lambda s: s[0])
+            entry_ids = json.dumps([row[0] for row in rows])
+            conn.execute("DELETE FROM attendance_journal WHERE entry_id IN (SELECT value FROM json_each(?))",
+                         (entry_ids,))
+            conn.execute("DELETE FROM attendance_journal_students WHERE entry_id IN (SELECT value FROM json_each(?))",
+                         (entry_ids,))
+            cur = conn.execute("""
+                INSERT INTO attendance_journal
+                    (subject_id, teacher_username, date_from, date_to, saves, changes, payload)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            """, (subject_id, teacher_username, min(row[1] for row in rows), max(row[2] for row in rows),
+                  sum(row[3] for row in rows), sum(row[4] for row in rows), pack(saves)))
+            _index_students(cur, cur.lastrowid, {change[2:] for save in saves for change in save[3]})
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        merged += 1
+        rows_before += len(rows)
+    return merged, rows_before, merged
+
+def forget_before(conn, before):
+    """Drop journal rows whose dates all fall before `before`; returns how many."""
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        conn.execute("""
+            DELETE FROM attendance_journal_students
+            WHERE entry_id IN (SELECT entry_id FROM attendance_journal WHERE date_to < ?)
+        """, (before,))
+        count = conn.execute("DELETE FROM attendance_journal WHERE date_to < ?", (before,)).rowcount
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return count
+
+def stats(cur):
+    cur.execute("""
+        SELECT COUNT(*), COALESCE(SUM(saves), 0), COALESCE(SUM(changes), 0), COALESCE(SUM(length(payload)), 0)
+        FROM attendance_journal
+    """)
+    rows, saves, changes, size = cur.fetchone()
+    return {"rows": rows, "saves": saves, "changes": changes, "payload_bytes": size}
+
+def main(argv=None):
+    import db
+
+    parser = argparse.ArgumentParser(description="Compact or trim the attendance change journal.")
+    parser.add_argument("--db", default=db.DB_NAME, help="database file (default: %(default)s)")
+    parser.add_argument("--compact-after", type=int, default=31, metavar="DAYS",
+                        help="merge rows for dates older than this many days (default: %(default)s)")
+    parser.add_argument("--retain", type=int, default=0, metavar="DAYS",
+                        help="drop rows for dates older than this many days (default: keep everything)")
+    args = parser.parse_args(argv)
+
+    today = datetime.date.today()
+    conn = sqlite3.connect(args.db, isolation_level=None)
+    try:
+        conn.execute(f"PRAGMA busy_timeout={db.get_profile()['busy_timeout']}")
+        if args.retain:
+            cutoff = (today - datetime.timedelta(days=args.retain)).isoformat()
+            print(f"Dropped {forget_before(conn, cutoff)} journal row(s) before {cutoff}")
+        cutoff = (today - datetime.timedelta(days=args.compact_after)).isoformat()
+        groups, before, after = compact(conn, cutoff)
+        print(f"Merged {before} journal row(s) into {after} in {groups} group(s)")
+        print(stats(conn.cursor()))
+        return 0
+    finally:
+        conn.close()
+
+if __name__ == "__main__":
+    raise SystemExit(main())
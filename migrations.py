@@ -0,0 +1,536 @@
+import argparse
+import sqlite3
+import time
+import aggregates
+import archive
+import journal
+
+# Versioned schema changes applied on top of the base tables created by
+# db.init_db(). Each entry is (version, description, steps); a step is either
+# an SQL string or a callable taking the cursor. Versions are applied in order
+# and never edited once released -- add a new one instead.
+
+def _rebuild_v5_aggregates(cur):
+    # aggregates.rebuild() as migration 5 shipped with it. The function has
+    # since moved on to tables later migrations add, so its released body is
+    # kept here; migration 17 rebuilds with the current one.
+    cur.execute("DELETE FROM attendance_stats")
+    cur.execute("""
+        INSERT INTO attendance_stats (mis_no, subject_id, present, marked)
+        SELECT mis_no, subject_id, SUM(CASE WHEN status='Present' THEN 1 ELSE 0 END), COUNT(*)
+        FROM attendance
+        GROUP BY mis_no, subject_id
+    """)
+    cur.execute("DELETE FROM class_session_counts")
+    cur.execute("""
+        INSERT INTO class_session_counts (subject_id, year, semester, section, sessions)
+        SELECT a.subject_id, st.year, st.semester, st.section, COUNT(DISTINCT a.date)
+        FROM attendance a
+        JOIN students st ON st.mis_no = a.mis_no
+        GROUP BY a.subject_id, st.year, st.semester, st.section
+    """)
+
+MIGRATIONS = [
+    (1, "Index attendance by subject and date", [
+        "CREATE INDEX IF NOT EXISTS idx_attendance_subject_date "
+        "ON attendance(subject_id, date, mis_no, status)",
+    ]),
+    (2, "Index attendance by student and subject", [
+        "CREATE INDEX IF NOT EXISTS idx_attendance_student_subject "
+        "ON attendance(mis_no, subject_id, status)",
+    ]),
+    (3, "Index students by class", [
+        "CREATE INDEX IF NOT EXISTS idx_students_class "
+        "ON students(year, semester, section, name, mis_no)",
+    ]),
+    (4, "Index allocations by teacher and subject", [
+        "CREATE INDEX IF NOT EXISTS idx_allocations_teacher "
+        "ON teacher_allocations(teacher_username, year, semester, section)",
+        "CREATE INDEX IF NOT EXISTS idx_allocations_subject "
+        "ON teacher_allocations(subject_id)",
+    ]),
+    (5, "Add materialized attendance aggregates", [
+        '''CREATE TABLE IF NOT EXISTS attendance_stats (
+            mis_no TEXT NOT NULL,
+            subject_id INTEGER NOT NULL,
+            present INTEGER NOT NULL DEFAULT 0,
+            marked INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (mis_no, subject_id)
+        ) WITHOUT ROWID''',
+        '''CREATE TABLE IF NOT EXISTS class_session_counts (
+            subject_id INTEGER NOT NULL,
+            year TEXT NOT NULL,
+            semester TEXT NOT NULL,
+            section TEXT NOT NULL,
+            sessions INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (subject_id, year, semester, section)
+        ) WITHOUT ROWID''',
+        "CREATE INDEX IF NOT EXISTS idx_attendance_stats_subject ON attendance_stats(subject_id)",
+        _rebuild_v5_aggregates,
+    ]),
+    (6, "Record class sessions and allow several periods per day", [
+        '''CREATE TABLE attendance_new (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            mis_no TEXT NOT NULL,
+            date TEXT NOT NULL,
+            subject_id INTEGER NOT NULL,
+            status TEXT NOT NULL,
+            marked_by_teacher TEXT,
+            period INTEGER NOT NULL DEFAULT 1,
+            FOREIGN KEY(mis_no) REFERENCES students(mis_no),
+            FOREIGN KEY(subject_id) REFERENCES subjects(subject_id),
+            UNIQUE(mis_no, date, subject_id, period)
+        )''',
+        """INSERT INTO attendance_new (id, mis_no, date, subject_id, status, marked_by_teacher)
+           SELECT id, mis_no, date, subject_id, status, marked_by_teacher FROM attendance""",
+        "DROP TABLE attendance",
+        "ALTER TABLE attendance_new RENAME TO attendance",
+        "CREATE INDEX idx_attendance_subject_date ON attendance(subject_id, date, period, mis_no, status)",
+        "CREATE INDEX idx_attendance_student_subject ON attendance(mis_no, subject_id, status)",
+        '''CREATE TABLE IF NOT EXISTS class_sessions (
+            session_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            subject_id INTEGER NOT NULL,
+            year TEXT NOT NULL,
+            semester TEXT NOT NULL,
+            section TEXT NOT NULL,
+            date TEXT NOT NULL,
+            period INTEGER NOT NULL DEFAULT 1,
+            alloc_id INTEGER,
+            marked_by_teacher TEXT,
+            FOREIGN KEY(subject_id) REFERENCES subjects(subject_id),
+            UNIQUE(subject_id, year, semester, section, date, period)
+        )''',
+        "CREATE INDEX IF NOT EXISTS idx_class_sessions_alloc ON class_sessions(alloc_id, date)",
+        "CREATE INDEX IF NOT EXISTS idx_class_session_counts_class "
+        "ON class_session_counts(year, semester, section, subject_id, sessions)",
+        aggregates.backfill_sessions,
+        "DELETE FROM class_session_counts",
+        """INSERT INTO class_session_counts (subject_id, year, semester, section, sessions)
+           SELECT subject_id, year, semester, section, COUNT(*) FROM class_sessions
+           GROUP BY subject_id, year, semester, section""",
+    ]),
+    (7, "Add background report jobs", [
+        '''CREATE TABLE IF NOT EXISTS report_jobs (
+            job_id TEXT PRIMARY KEY,
+            kind TEXT NOT NULL,
+            params TEXT NOT NULL,
+            owner TEXT NOT NULL,
+            filename TEXT NOT NULL,
+            status TEXT NOT NULL,
+            progress INTEGER NOT NULL DEFAULT 0,
+            message TEXT,
+            artifact_path TEXT,
+            mimetype TEXT,
+            created_at REAL NOT NULL,
+            started_at REAL,
+            finished_at REAL,
+            expires_at REAL
+        )''',
+        "CREATE INDEX IF NOT EXISTS idx_report_jobs_status ON report_jobs(status, created_at)",
+        "CREATE INDEX IF NOT EXISTS idx_report_jobs_expiry ON report_jobs(expires_at)",
+    ]),
+    (8, "Track per-class data versions for the report cache", [
+        '''CREATE TABLE IF NOT EXISTS class_data_versions (
+            year TEXT NOT NULL,
+            semester TEXT NOT NULL,
+            section TEXT NOT NULL,
+            version INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (year, semester, section)
+        ) WITHOUT ROWID''',
+    ]),
+    (9, "Add server-side sessions", [
+        '''CREATE TABLE IF NOT EXISTS sessions (
+            sid TEXT PRIMARY KEY,
+            user_key TEXT,
+            data TEXT NOT NULL,
+            expires_at REAL NOT NULL
+        )''',
+        "CREATE INDEX IF NOT EXISTS idx_sessions_user ON sessions(user_key)",
+        "CREATE INDEX IF NOT EXISTS idx_sessions_expiry ON sessions(expires_at)",
+    ]),
+    (10, "Remember applied attendance API batches", [
+        '''CREATE TABLE IF NOT EXISTS attendance_batches (
+            teacher_username TEXT NOT NULL,
+            idempotency_key TEXT NOT NULL,
+            result TEXT NOT NULL,
+            created_at REAL NOT NULL,
+            PRIMARY KEY (teacher_username, idempotency_key)
+        ) WITHOUT ROWID''',
+        "CREATE INDEX IF NOT EXISTS idx_attendance_batches_created ON attendance_batches(created_at)",
+    ]),
+    (11, "Add the attendance change journal", [
+        '''CREATE TABLE IF NOT EXISTS attendance_journal (
+            entry_id INTEGER PRIMARY KEY,
+            subject_id INTEGER NOT NULL,
+            teacher_username TEXT,
+            date_from TEXT NOT NULL,
+            date_to TEXT NOT NULL,
+            saves INTEGER NOT NULL,
+            changes INTEGER NOT NULL,
+            payload BLOB NOT NULL
+        )''',
+        "CREATE INDEX IF NOT EXISTS idx_journal_subject ON attendance_journal(subject_id, date_from)",
+        "CREATE INDEX IF NOT EXISTS idx_journal_teacher ON attendance_journal(teacher_username, date_from)",
+    ]),
+    (12, "Add the bit-packed archive of closed terms", [
+        '''CREATE TABLE IF NOT EXISTS attendance_archive (
+            year TEXT NOT NULL,
+            semester TEXT NOT NULL,
+            section TEXT NOT NULL,
+            subject_id INTEGER NOT NULL,
+            date_from TEXT NOT NULL,
+            date_to TEXT NOT NULL,
+            sessions INTEGER NOT NULL,
+            calendar TEXT NOT NULL,
+            students TEXT NOT NULL,
+            present BLOB NOT NULL,
+            marked BLOB NOT NULL,
+            archived_at REAL NOT NULL,
+            PRIMARY KEY (year, semester, section, subject_id)
+        ) WITHOUT ROWID''',
+        "CREATE INDEX IF NOT EXISTS idx_archive_subject ON attendance_archive(subject_id)",
+        '''CREATE TABLE IF NOT EXISTS attendance_archive_members (
+            mis_no TEXT NOT NULL,
+            year TEXT NOT NULL,
+            semester TEXT NOT NULL,
+            section TEXT NOT NULL,
+            subject_id INTEGER NOT NULL,
+            position INTEGER NOT NULL,
+            PRIMARY KEY (mis_no, year, semester, section, subject_id)
+        ) WITHOUT ROWID''',
+        "CREATE INDEX IF NOT EXISTS idx_archive_members_term ON attendance_archive_members(subject_id, year, semester, section)",
+    ]),
+    (13, "Count each student's attendance towards the class it was marked in", [
+        '''CREATE TABLE attendance_stats_new (
+            mis_no TEXT NOT NULL,
+            subject_id INTEGER NOT NULL,
+            year TEXT NOT NULL,
+            semester TEXT NOT NULL,
+            section TEXT NOT NULL,
+            present INTEGER NOT NULL DEFAULT 0,
+            marked INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (mis_no, subject_id, year, semester, section)
+        ) WITHOUT ROWID''',
+        "DROP TABLE attendance_stats",
+        "ALTER TABLE attendance_stats_new RENAME TO attendance_stats",
+        "CREATE INDEX idx_attendance_stats_subject ON attendance_stats(subject_id)",
+        "CREATE INDEX IF NOT EXISTS idx_class_sessions_slot ON class_sessions(subject_id, date, period)",
+        "ALTER TABLE attendance ADD COLUMN session_id INTEGER REFERENCES class_sessions(session_id)",
+        aggregates.backfill_session_ids,
+        aggregates.rebuild_stats,
+        "UPDATE class_data_versions SET version = version + 1",
+    ]),
+    (14, "Index the attendance journal by student", [
+        '''CREATE TABLE IF NOT EXISTS attendance_journal_students (
+            mis_no TEXT NOT NULL,
+            entry_id INTEGER NOT NULL,
+            PRIMARY KEY (mis_no, entry_id)
+        ) WITHOUT ROWID''',
+        "CREATE INDEX IF NOT EXISTS idx_journal_students_entry ON attendance_journal_students(entry_id)",
+        journal.backfill_students,
+    ]),
+    (15, "Index attendance by class session", [
+        "CREATE INDEX IF NOT EXISTS idx_attendance_session ON attendance(session_id)",
+    ]),
+    (16, "Version class rosters apart from their marks", [
+        "ALTER TABLE class_data_versions ADD COLUMN roster_version INTEGER NOT NULL DEFAULT 0",
+    ]),
+    (17, "Rebuild the attendance aggregates", [
+        aggregates.rebuild,
+    ]),
+]
+
+# Representative statements for every query in models.py, checked with
+# EXPLAIN QUERY PLAN. allow_scan marks queries that list a whole table on
+# purpose. Queries kept as constants in aggregates.py and archive.py are
+# checked through those constants; models.py cannot be imported here (it
+# imports db, which imports this module), so its queries are copied.
+QUERY_PLAN_CHECKS = [
+    ("verify_teacher", "SELECT password FROM teachers WHERE username=?", ("admin",), False),
+    ("verify_student", "SELECT password FROM students WHERE mis_no=?", ("1",), False),
+    ("remove_student", "DELETE FROM attendance WHERE mis_no=?", ("1",), False),
+    ("remove_subject", "DELETE FROM teacher_allocations WHERE subject_id=?", (1,), False),
+    ("remove_subject", "DELETE FROM attendance WHERE subject_id=?", (1,), False),
+    ("get_all_subjects", "SELECT * FROM subjects ORDER BY subject_name", (), True),
+    ("get_all_allocations", """
+        SELECT ta.alloc_id, t.username, s.subject_code, s.subject_name, ta.year, ta.semester, ta.section
+        FROM teacher_allocations ta
+        JOIN teachers t ON ta.teacher_username = t.username
+        JOIN subjects s ON ta.subject_id = s.subject_id
+        ORDER BY t.username, ta.year, ta.semester, ta.section, s.subject_name
+    """, (), True),
+    ("get_teacher_subjects", """
+        SELECT ta.alloc_id, s.subject_id, s.subject_code, s.subject_name, ta.year, ta.semester, ta.section
+        FROM teacher_allocations ta
+        JOIN subjects s ON ta.subject_id = s.subject_id
+        WHERE ta.teacher_username = ?
+        ORDER BY ta.year, ta.semester, ta.section, s.subject_name
+    """, ("t",), False),
+    ("get_student_years", "SELECT DISTINCT year FROM students ORDER BY year", (), True),
+    ("get_student_sections", "SELECT DISTINCT section FROM students WHERE year=? ORDER BY section", ("1",), False),
+    ("get_student_sections", "SELECT DISTINCT section FROM students ORDER BY section", (), True),
+    ("get_class_roster",
+     "SELECT mis_no, name FROM students WHERE year=? AND semester=? AND section=? ORDER BY name",
+     ("1", "1", "A"), False),
+    ("get_existing_attendance",
+     "SELECT mis_no, status FROM attendance WHERE subject_id=? AND date=? AND period=?",
+     (1, "2025-01-01", 1), False),
+    ("get_class_report", """
+        SELECT sessions FROM class_session_counts
+        WHERE subject_id=? AND year=? AND semester=? AND section=?
+    """, (1, "1", "1", "A"), False),
+    ("get_class_report", """
+        SELECT s.mis_no, s.name, COALESCE(st.present, 0) as attended
+        FROM students s
+        LEFT JOIN attendance_stats st ON st.mis_no = s.mis_no AND st.subject_id = ?
+         AND st.year = s.year AND st.semester = s.semester AND st.section = s.section
+        WHERE s.year=? AND s.semester=? AND s.section=?
+        ORDER BY s.name
+    """, (1, "1", "1", "A"), False),
+    ("session_load", "SELECT data FROM sessions WHERE sid=? AND expires_at > ?", ("s", 0), False),
+    ("revoke_user", "DELETE FROM sessions WHERE user_key=?", ("teacher:t",), False),
+    ("remove_allocation", "SELECT teacher_username FROM teacher_allocations WHERE alloc_id=?", (1,), False),
+    ("class_version",
+     "SELECT version FROM class_data_versions WHERE year=? AND semester=? AND section=?",
+     ("1", "1", "A"), False),
+    ("roster_version",
+     "SELECT roster_version FROM class_data_versions WHERE year=? AND semester=? AND section=?",
+     ("1", "1", "A"), False),
+    ("bump_student_class", "SELECT year, semester, section FROM students WHERE mis_no=?", ("1",), False),
+    ("forget_subject", "SELECT year, semester, section FROM class_session_counts WHERE subject_id=?", (1,), False),
+    ("iter_class_report", """
+        SELECT s.mis_no, s.name, COALESCE(st.present, 0), c.sessions,
+               ROUND(100.0 * COALESCE(st.present, 0) / c.sessions, 2)
+        FROM class_session_counts c
+        JOIN students s ON s.year = c.year AND s.semester = c.semester AND s.section = c.section
+        LEFT JOIN attendance_stats st ON st.mis_no = s.mis_no AND st.subject_id = c.subject_id
+         AND st.year = c.year AND st.semester = c.semester AND st.section = c.section
+        WHERE c.subject_id=? AND c.year=? AND c.semester=? AND c.section=? AND c.sessions > 0
+        ORDER BY s.name
+    """, (1, "1", "1", "A"), False),
+    ("iter_class_reports", """
+        SELECT c.year, c.semester, c.section, c.subject_id, sub.subject_code,
+               s.mis_no, s.name, COALESCE(st.present, 0), c.sessions,
+               ROUND(100.0 * COALESCE(st.present, 0) / c.sessions, 2)
+        FROM class_session_counts c
+        JOIN subjects sub ON sub.subject_id = c.subject_id
+        JOIN students s ON s.year = c.year AND s.semester = c.semester AND s.section = c.section
+        LEFT JOIN attendance_stats st ON st.mis_no = s.mis_no AND st.subject_id = c.subject_id
+         AND st.year = c.year AND st.semester = c.semester AND st.section = c.section
+        WHERE c.sessions > 0
+        ORDER BY c.year, c.semester, c.section, sub.subject_code, s.name
+    """, (), True),
+    ("save_bulk_attendance", aggregates.READ_MARKS, (1, "2025-01-01", 1), False),
+    ("save_bulk_attendance", aggregates.RECORD_SESSION, (1, "1", "1", "A", "2025-01-01", 1, None, None), False),
+    ("move_class", "SELECT COUNT(*) FROM students WHERE year=? AND semester=? AND section=?", ("1", "1", "A"), False),
+    ("move_class", """
+        SELECT ta.teacher_username, ta.subject_id, s.subject_code,
+               EXISTS (SELECT 1 FROM teacher_allocations t2
+                       WHERE t2.teacher_username = ta.teacher_username AND t2.subject_id = ta.subject_id
+                         AND t2.year = ? AND t2.semester = ? AND t2.section = ?) AS at_target
+        FROM teacher_allocations ta
+        JOIN subjects s ON ta.subject_id = s.subject_id
+        WHERE ta.year = ? AND ta.semester = ? AND ta.section = ?
+        ORDER BY ta.teacher_username, s.subject_code
+    """, ("1", "2", "A", "1", "1", "A"), False),
+    ("move_class", "UPDATE students SET year=?, semester=?, section=? WHERE year=? AND semester=? AND section=?",
+     ("1", "2", "A", "1", "1", "A"), False),
+    ("save_attendance_batches", """
+        SELECT idempotency_key, result FROM attendance_batches
+        WHERE teacher_username = ? AND idempotency_key IN (SELECT value FROM json_each(?))
+    """, ("t", "[]"), False),
+    ("save_attendance_batches", """
+        SELECT value FROM json_each(?)
+        WHERE value NOT IN (SELECT mis_no FROM students WHERE year=? AND semester=? AND section=?)
+    """, ("[]", "1", "1", "A"), False),
+    ("save_attendance_batches", "DELETE FROM attendance_batches WHERE created_at < ?", (0,), False),
+    ("attendance_history", """
+        SELECT j.subject_id, s.subject_code, j.teacher_username, j.payload
+        FROM attendance_journal j
+        LEFT JOIN subjects s ON s.subject_id = j.subject_id
+        WHERE j.date_from <= ? AND j.date_to >= ? AND j.subject_id IN (SELECT value FROM json_each(?))
+    """, ("9999-12-31", "", "[1]"), False),
+    ("attendance_history", """
+        SELECT j.subject_id, s.subject_code, j.teacher_username, j.payload
+        FROM attendance_journal j
+        LEFT JOIN subjects s ON s.subject_id = j.subject_id
+        WHERE j.date_from <= ? AND j.date_to >= ? AND j.teacher_username = ?
+    """, ("9999-12-31", "", "t"), False),
+    ("attendance_history", """
+        SELECT j.subject_id, s.subject_code, j.teacher_username, j.payload
+        FROM attendance_journal j
+        LEFT JOIN subjects s ON s.subject_id = j.subject_id
+        WHERE j.date_from <= ? AND j.date_to >= ?
+          AND j.entry_id IN (SELECT entry_id FROM attendance_journal_students WHERE mis_no = ?)
+    """, ("9999-12-31", "", "1"), False),
+    ("compact_journal",
+     "DELETE FROM attendance_journal_students WHERE entry_id IN (SELECT value FROM json_each(?))", ("[]",), False),
+    ("get_existing_students",
+     "SELECT mis_no FROM students WHERE mis_no IN (SELECT value FROM json_each(?))", ("[]",), False),
+    ("remove_subject", "DELETE FROM class_session_counts WHERE subject_id=?", (1,), False),
+    ("remove_subject", "DELETE FROM class_sessions WHERE subject_id=?", (1,), False),
+    ("remove_subject", "DELETE FROM attendance_stats WHERE subject_id=?", (1,), False),
+    ("save_bulk_attendance", aggregates.CURRENT_CLASSES, ("[]",), False),
+    ("save_bulk_attendance", aggregates.SAVED_CLASSES, (1, "2025-01-01", 1), False),
+    ("save_bulk_attendance", aggregates.SESSION_ID, (1, "1", "1", "A", "2025-01-01", 1), False),
+    ("fetch_student_attendance_summary", """
+        SELECT st.name, c.subject_id, s.subject_code, s.subject_name,
+               COALESCE(a.present, 0) as present, c.sessions as total,
+               ROUND(100.0 * COALESCE(a.present, 0) / c.sessions, 2) as percent
+        FROM students st
+        LEFT JOIN class_session_counts c
+          ON c.year = st.year AND c.semester = st.semester AND c.section = st.section
+         AND c.sessions > 0
+        LEFT JOIN subjects s ON s.subject_id = c.subject_id
+        LEFT JOIN attendance_stats a ON a.mis_no = st.mis_no AND a.subject_id = c.subject_id
+         AND a.year = c.year AND a.semester = c.semester AND a.section = c.section
+        WHERE st.mis_no = ?
+        ORDER BY s.subject_name
+    """, ("1",), False),
+    ("get_student_detailed_report", """
+        SELECT a.date, s.subject_name, a.status, a.period, a.subject_id
+        FROM attendance a
+        JOIN subjects s ON a.subject_id = s.subject_id
+        WHERE a.mis_no = ?
+        ORDER BY a.date DESC, s.subject_name, a.period, a.subject_id
+    """, ("1",), False),
+    ("get_student_attendance_page", """
+        SELECT a.date, s.subject_name, a.status, a.period, a.subject_id
+        FROM attendance a
+        JOIN subjects s ON a.subject_id = s.subject_id
+        WHERE a.mis_no = ? AND a.date >= ? AND a.date <= ? AND a.subject_id = ?
+          AND a.date <= ? AND (a.date < ? OR (a.date = ? AND (s.subject_name, a.period, a.subject_id) > (?, ?, ?)))
+        ORDER BY a.date DESC, s.subject_name, a.period, a.subject_id LIMIT ?
+    """, ("1", "2025-01-01", "2025-12-31", 1, "2025-06-01", "2025-06-01", "2025-06-01", "A", 1, 1, 51), False),
+    ("archive_class", archive.CLASS_MARKS, (1, "1", "1", "A"), False),
+    ("archive_class", """
+        DELETE FROM attendance_archive_members WHERE subject_id=? AND year=? AND semester=? AND section=?
+    """, (1, "1", "1", "A"), False),
+    ("archive_session_marks", archive.SESSION_MARKS, ("[]", 1, "2025-01-01", "2025-01-01"), False),
+    ("archive_student_marks", archive.STUDENT_TERMS, ("1",), False),
+    ("remove_subject", "DELETE FROM attendance_archive_members WHERE subject_id=?", (1,), False),
+    ("remove_subject", "DELETE FROM attendance_archive WHERE subject_id=?", (1,), False),
+    ("analytics_load_term", """
+        SELECT mis_no, name, year, semester, section FROM students st WHERE 1=1 AND st.year = ?
+        ORDER BY year, semester, section, name
+    """, ("1",), False),
+    ("analytics_load_term", """
+        SELECT year, semester, section, subject_id, date, period FROM class_sessions cs WHERE 1=1 AND cs.year = ?
+    """, ("1",), True),
+    ("analytics_load_term", """
+        SELECT subject_id, CAST(julianday(date) - 2440587.5 AS INTEGER), period, COUNT(*),
+               group_concat(mis_no, char(31)), group_concat(status = 'Present', '')
+        FROM attendance
+        WHERE subject_id IN (SELECT value FROM json_each(?)) AND date BETWEEN ? AND ?
+        GROUP BY subject_id, date, period
+    """, ("[1]", "2025-01-01", "2025-06-01"), False),
+    ("analytics_load_term", """
+        SELECT year, semester, section, subject_id, sessions, calendar, students, present, marked
+        FROM attendance_archive a WHERE 1=1 AND a.year = ?
+    """, ("1",), False),
+    ("analytics_load_term", """
+        SELECT year, semester, section, subject_id, sessions FROM class_session_counts c WHERE 1=1 AND c.year = ?
+    """, ("1",), False),
+]
+
+def _ensure_version_table(cur):
+    cur.execute('''
+    CREATE TABLE IF NOT EXISTS schema_version (
+        version INTEGER PRIMARY KEY,
+        description TEXT NOT NULL,
+        applied_at TEXT NOT NULL
+    )''')
+
+def current_version(conn):
+    _ensure_version_table(conn.cursor())
+    row = conn.execute("SELECT MAX(version) FROM schema_version").fetchone()
+    return row[0] or 0
+
+def migrate(conn, target=None):
+    """Apply pending migrations, one transaction each. Returns the versions applied.
+
+    Safe to call from several workers at startup: each step takes the writer
+    lock and re-checks the version before running.
+    """
+    applied = []
+    isolation_level = conn.isolation_level
+    conn.isolation_level = None
+    try:
+        cur = conn.cursor()
+        _ensure_version_table(cur)
+        for version, description, steps in MIGRATIONS:
+            if target is not None and version > target:
+                break
+            cur.execute("BEGIN IMMEDIATE")
+            try:
+                if cur.execute("SELECT 1 FROM schema_version WHERE version=?", (version,)).fetchone():
+                    cur.execute("COMMIT")
+                    continue
+                for step in steps:
+                    if callable(step):
+                        step(cur)
+                    else:
+                        cur.execute(step)
+                cur.execute(
+                    "INSERT INTO schema_version (version, description, applied_at) VALUES (?, ?, ?)",
+                    (version, description, time.strftime("%Y-%m-%d %H:%M:%S")),
+                )
+                cur.execute("COMMIT")
+            except Exception:
+                cur.execute("ROLLBACK")
+                raise
+            applied.append(version)
+        if applied:
+            cur.execute("PRAGMA optimize")
+    finally:
+        conn.isolation_level = isolation_level
+    return applied
+
+def explain_queries(conn):
+    """Run EXPLAIN QUERY PLAN for QUERY_PLAN_CHECKS.
+
+    Returns (name, plan_lines, full_scan) tuples; full_scan is True when a
+    query that should be indexed still scans a table.
+    """
+    report = []
+    for name, sql, params, allow_scan in QUERY_PLAN_CHECKS:
+        plan = [row[3] for row in conn.execute("EXPLAIN QUERY PLAN " + sql, params)]
+        full_scan = not allow_scan and any(
+            line.startswith("SCAN") and "INDEX" not in line for line in plan
+        )
+        report.append((name, plan, full_scan))
+    return report
+
+def main(argv=None):
+    import db
+
+    parser = argparse.ArgumentParser(description="Bring the attendance database schema up to date.")
+    parser.add_argument("--db", default=db.DB_NAME, help="database file (default: %(default)s)")
+    parser.add_argument("--explain", action="store_true", help="print query plans for models.py queries")
+    args = parser.parse_args(argv)
+
+    conn = sqlite3.connect(args.db)
+    if not conn.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name='attendance'").fetchone():
+        # A new file: the migrations build on the base tables init_db() creates
+        conn.close()
+        db.init_db(database=args.db)
+        print(f"Created the base schema in {args.db}")
+        conn = sqlite3.connect(args.db)
+    try:
+        applied = migrate(conn)
+        print(f"Schema version {current_version(conn)}"
+              + (f" (applied {', '.join(map(str, applied))})" if applied else " (up to date)"))
+        if args.explain:
+            failures = 0
+            for name, plan, full_scan in explain_queries(conn):
+                failures += full_scan
+                print(f"{'SCAN' if full_scan else 'ok  '} {name}")
+                for line in plan:
+                    print(f"       {line}")
+            return 1 if failures else 0
+    finally:
+        conn.close()
+    return 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -1,6 +1,13 @@
+import json
 import sqlite3
-from db import get_db_connection
-from werkzeug.security import generate_password_hash, check_password_hash
+import time
+import aggregates
+import archive
+import journal
+from cache import cached, invalidate, report_cache
+from db import get_db_connection, run_write
+from passwords import hash_password, check_password
+from session_store import revoke_user, forget_cached
 
 # --- TEACHERS ---
 def add_teacher(username, password):
@@ -8,7 +15,7 @@ def add_teacher(username, password):
     cur = conn.cursor()
     try:
         cur.execute("INSERT INTO teachers (username, password) VALUES (?, ?)", 
-                    (username, generate_password_hash(password)))
+                    (username, hash_password(password)))
         conn.commit()
         return True
     except sqlite3.IntegrityError:
@@ -22,6 +29,8 @@ def remove_teacher(username):
     try:
         cur.execute("DELETE FROM teachers WHERE username=?", (username,))
         conn.commit()
+        invalidate("allocations")
+        revoke_user(f"teacher:{username}")
         return True
     except:
         return False
@@ -34,26 +43,21 @@ def verify_teacher(username, password):
     cur.execute("SELECT password FROM teachers WHERE username=?", (username,))
     user = cur.fetchone()
     conn.close()
-    if user:
-        return check_password_hash(user["password"], password)
-    return False
+    if not user:
+        return False
+    ok, new_hash = check_password(user["password"], password)
+    if new_hash:
+        _store_rehash("teachers", "username", username, user["password"], new_hash)
+    return ok
 
 def change_teacher_password(username, new_password):
     conn = get_db_connection()
     cur = conn.cursor()
     cur.execute("UPDATE teachers SET password=? WHERE username=?", 
-                (generate_password_hash(new_password), username))
+                (hash_password(new_password), username))
     conn.commit()
     conn.close()
 
-def get_teacher_name(username):
-    conn = get_db_connection()
-    cur = conn.cursor()
-    cur.execute("SELECT username FROM teachers WHERE username=?", (username,))
-    row = cur.fetchone()
-    conn.close()
-    return row["username"] if row else "Teacher"
-
 # --- STUDENTS (With Semester) ---
 def add_student(mis_no, name, year, semester, section, password):
     conn = get_db_connection()
@@ -61,42 +65,194 @@ def add_student(mis_no, name, year, semester, section, password):
     try:
         cur.execute(
             "INSERT INTO students (mis_no, name, password, year, semester, section) VALUES (?, ?, ?, ?, ?, ?)",
-            (mis_no, name, generate_password_hash(password), year, semester, section)
+            (mis_no, name, hash_password(password), year, semester, section)
         )
+        aggregates.bump_class_versions(cur, [(year, semester, section)], roster=True)
         conn.commit()
+        invalidate("students")
         return True
     except sqlite3.IntegrityError:
         return False 
     finally:
         conn.close()
 
+def get_existing_students(mis_nos):
+    """The subset of mis_nos already registered."""
+    conn = get_db_connection()
+    cur = conn.cursor()
+    cur.execute("SELECT mis_no FROM students WHERE mis_no IN (SELECT value FROM json_each(?))",
+                (json.dumps(list(mis_nos)),))
+    existing = {row["mis_no"] for row in cur.fetchall()}
+    conn.close()
+    return existing
+
+def add_students_bulk(students):
+    """Insert (mis_no, name, password_hash, year, semester, section) rows in one transaction.
+
+    Returns the MIS numbers skipped because they were registered meanwhile.
+    """
+    conn = get_db_connection()
+
+    def write(cur):
+        cur.execute("SELECT mis_no FROM students WHERE mis_no IN (SELECT value FROM json_each(?))",
+                    (json.dumps([s[0] for s in students]),))
+        existing = {row["mis_no"] for row in cur.fetchall()}
+        new = [s for s in students if s[0] not in existing]
+        cur.executemany(
+            "INSERT INTO students (mis_no, name, password, year, semester, section) VALUES (?, ?, ?, ?, ?, ?)",
+            new
+        )
+        aggregates.bump_class_versions(cur, {s[3:] for s in new}, roster=True)
+        return existing
+
+    try:
+        skipped = run_write(conn, write)
+        invalidate("students")
+        return skipped
+    finally:
+        conn.close()
+
 def remove_student(mis_no):
     conn = get_db_connection()
     cur = conn.cursor()
     try:
         cur.execute("DELETE FROM attendance WHERE mis_no=?", (mis_no,))
+        aggregates.forget_student(cur, mis_no)
+        archive.forget_student(cur, mis_no)
         cur.execute("DELETE FROM students WHERE mis_no=?", (mis_no,))
         conn.commit()
+        invalidate("students")
+        revoke_user(f"student:{mis_no}")
         return True
     except:
         return False
     finally:
         conn.close()
 
+def update_student(mis_no, name, year, semester, section, password=None):
+    conn = get_db_connection()
+    cur = conn.cursor()
+    # Both the class the student leaves and the one they join change
+    aggregates.bump_student_class(cur, mis_no, roster=True)
+    aggregates.bump_class_versions(cur, [(year, semester, section)], roster=True)
+    if password:
+        cur.execute(
+            "UPDATE students SET name=?, year=?, semester=?, section=?, password=? WHERE mis_no=?",
+            (name, year, semester, section, hash_password(password), mis_no),
+        )
+    else:
+        cur.execute(
+            "UPDATE students SET name=?, year=?, semester=?, section=? WHERE mis_no=?",
+            (name, year, semester, section, mis_no),
+        )
+    conn.commit()
+    conn.close()
+    invalidate("students")
+
+def _class_move_summary(cur, source, target, carry_allocations):
+    cur.execute("SELECT COUNT(*) FROM students WHERE year=? AND semester=? AND section=?", source)
+    students = cur.fetchone()[0]
+    cur.execute("SELECT COUNT(*) FROM students WHERE year=? AND semester=? AND section=?", target)
+    target_students = cur.fetchone()[0]
+    allocations = []
+    if carry_allocations:
+        cur.execute("""
+            SELECT ta.teacher_username, ta.subject_id, s.subject_code,
+                   EXISTS (SELECT 1 FROM teacher_allocations t2
+                           WHERE t2.teacher_username = ta.teacher_username AND t2.subject_id = ta.subject_id
+                             AND t2.year = ? AND t2.semester = ? AND t2.section = ?) AS at_target
+            FROM teacher_allocations ta
+            JOIN subjects s ON ta.subject_id = s.subject_id
+            WHERE ta.year = ? AND ta.semester = ? AND ta.section = ?
+            ORDER BY ta.teacher_username, s.subject_code
+        """, (*target, *source))
+        allocations = [dict(row) for row in cur.fetchall()]
+    return {"students": students, "target_students": target_students, "allocations": allocations}
+
+def move_class(source, target, carry_allocations=False, dry_run=False):
+    """Move every student of class source (year, semester, section) to class target.
+
+    One UPDATE in one short transaction; marks already taken keep counting
+    towards the source class, so the target's reports cover only the
+    sessions it holds from now on. With carry_allocations
+    the source class's teacher allocations are copied to the target (those
+    already there are left alone); the originals stay for past sessions.
+    Returns what was (or with dry_run, would be) moved.
+    """
+    source, target = tuple(source), tuple(target)
+    conn = get_db_connection()
+
+    def write(cur):
+        summary = _class_move_summary(cur, source, target, carry_allocations)
+        cur.execute("UPDATE students SET year=?, semester=?, section=? WHERE year=? AND semester=? AND section=?",
+                    (*target, *source))
+        cur.executemany(
+            "INSERT INTO teacher_allocations (teacher_username, subject_id, year, semester, section) VALUES (?, ?, ?, ?, ?)",
+            [(a["teacher_username"], a["subject_id"], *target) for a in summary["allocations"] if not a["at_target"]]
+        )
+        aggregates.bump_class_versions(cur, [source, target], roster=True)
+        return summary
+
+    try:
+        if dry_run:
+            return _class_move_summary(conn.cursor(), source, target, carry_allocations)
+        summary = run_write(conn, write)
+    finally:
+        conn.close()
+    invalidate("students")
+    carried = {a["teacher_username"] for a in summary["allocations"] if not a["at_target"]}
+    if carried:
+        invalidate("allocations")
+        for teacher_username in carried:
+            forget_cached("allocations", f"teacher:{teacher_username}")
+    return summary
+
+@cached("students")
+def get_student_years():
+    conn = get_db_connection()
+    cur = conn.cursor()
+    cur.execute("SELECT DISTINCT year FROM students ORDER BY year")
+    years = tuple(row["year"] for row in cur.fetchall())
+    conn.close()
+    return years
+
+@cached("students")
+def get_student_sections(year=None):
+    conn = get_db_connection()
+    cur = conn.cursor()
+    if year:
+        cur.execute("SELECT DISTINCT section FROM students WHERE year=? ORDER BY section", (year,))
+    else:
+        cur.execute("SELECT DISTINCT section FROM students ORDER BY section")
+    sections = tuple(row["section"] for row in cur.fetchall())
+    conn.close()
+    return sections
+
 def verify_student(mis_no, password):
     conn = get_db_connection()
     cur = conn.cursor()
     cur.execute("SELECT password FROM students WHERE mis_no=?", (mis_no,))
     user = cur.fetchone()
     conn.close()
-    if user:
-        return check_password_hash(user["password"], password)
-    return False
+    if not user:
+        return False
+    ok, new_hash = check_password(user["password"], password)
+    if new_hash:
+        _store_rehash("students", "mis_no", mis_no, user["password"], new_hash)
+    return ok
+
+def _store_rehash(table, key_column, key, old_hash, new_hash):
+    # Only replace the hash that was verified, so a password changed in the
+    # meantime is not overwritten.
+    conn = get_db_connection()
+    conn.execute(f"UPDATE {table} SET password=? WHERE {key_column}=? AND password=?", (new_hash, key, old_hash))
+    conn.commit()
+    conn.close()
 
 def change_student_password(mis_no, new_password):
     conn = get_db_connection()
     cur = conn.cursor()
-    hashed_password = generate_password_hash(new_password)
+    hashed_password = hash_password(new_password)
     cur.execute("UPDATE students SET password=? WHERE mis_no=?", (hashed_password, mis_no))
     conn.commit()
     conn.close()
@@ -109,6 +265,7 @@ def add_subject(subject_code, subject_name):
         cur.execute("INSERT INTO subjects (subject_code, subject_name) VALUES (?, ?)", 
                     (subject_code, subject_name))
         conn.commit()
+        invalidate("subjects")
         return True
     except sqlite3.IntegrityError:
         return False 
@@ -121,19 +278,24 @@ def remove_subject(subject_id):
     try:
         cur.execute("DELETE FROM teacher_allocations WHERE subject_id=?", (subject_id,))
         cur.execute("DELETE FROM attendance WHERE subject_id=?", (subject_id,))
+        aggregates.forget_subject(cur, subject_id)
+        archive.forget_subject(cur, subject_id)
         cur.execute("DELETE FROM subjects WHERE subject_id=?", (subject_id,))
         conn.commit()
+        invalidate("subjects", "allocations")
+        forget_cached("allocations")
         return True
     except:
         return False
     finally:
         conn.close()
 
+@cached("subjects")
 def get_all_subjects():
     conn = get_db_connection()
     cur = conn.cursor()
     cur.execute("SELECT * FROM subjects ORDER BY subject_name")
-    subjects = cur.fetchall()
+    subjects = tuple(cur.fetchall())
     conn.close()
     return subjects
 
@@ -145,12 +307,15 @@ def allocate_subject(teacher_username, subject_id, year, semester, section):
         cur.execute("INSERT INTO teacher_allocations (teacher_username, subject_id, year, semester, section) VALUES (?, ?, ?, ?, ?)",
                     (teacher_username, subject_id, year, semester, section))
         conn.commit()
+        invalidate("allocations")
+        forget_cached("allocations", f"teacher:{teacher_username}")
         return True
     except sqlite3.IntegrityError:
         return False
     finally:
         conn.close()
 
+@cached("allocations")
 def get_all_allocations():
     conn = get_db_connection()
     cur = conn.cursor()
@@ -161,7 +326,7 @@ def get_all_allocations():
         JOIN subjects s ON ta.subject_id = s.subject_id
         ORDER BY t.username, ta.year, ta.semester, ta.section, s.subject_name
     """)
-    allocations = cur.fetchall()
+    allocations = tuple(cur.fetchall())
     conn.close()
     return allocations
 
@@ -169,14 +334,20 @@ def remove_allocation(alloc_id):
     conn = get_db_connection()
     cur = conn.cursor()
     try:
+        cur.execute("SELECT teacher_username FROM teacher_allocations WHERE alloc_id=?", (alloc_id,))
+        row = cur.fetchone()
         cur.execute("DELETE FROM teacher_allocations WHERE alloc_id=?", (alloc_id,))
         conn.commit()
+        invalidate("allocations")
+        if row:
+            forget_cached("allocations", f"teacher:{row['teacher_username']}")
         return True
     except:
         return False
     finally:
         conn.close()
 
+@cached("allocations")
 def get_teacher_subjects(teacher_username):
     conn = get_db_connection()
     cur = conn.cursor()
@@ -187,139 +358,421 @@ def get_teacher_subjects(teacher_username):
         WHERE ta.teacher_username = ?
         ORDER BY ta.year, ta.semester, ta.section, s.subject_name
     """, (teacher_username,))
-    subjects = cur.fetchall()
+    subjects = tuple(cur.fetchall())
     conn.close()
     return subjects
 
 # --- ATTENDANCE (With Semester) ---
-def get_students_for_class(year, semester, section):
+def get_class_roster(year, semester, section):
+    """A class's students in name order as (mis_nos, names), cached until its membership changes."""
     conn = get_db_connection()
     cur = conn.cursor()
-    cur.execute("SELECT mis_no, name FROM students WHERE year=? AND semester=? AND section=? ORDER BY name", 
-                (year, semester, section))
-    students = cur.fetchall()
+    # Keyed by the class's roster version, which every change to its students
+    # bumps in its own transaction, so no worker serves a roster another one
+    # changed; saving marks leaves it alone
+    version = aggregates.roster_version(cur, year, semester, section)
+    key = ("class_roster", year, semester, section, version)
+    roster = report_cache.get(key)
+    if roster is None:
+        cur.execute("SELECT mis_no, name FROM students WHERE year=? AND semester=? AND section=? ORDER BY name",
+                    (year, semester, section))
+        rows = cur.fetchall()
+        roster = tuple(row["mis_no"] for row in rows), tuple(row["name"] for row in rows)
+        report_cache.put(key, roster, len(repr(roster)))
     conn.close()
-    return students
+    return roster
+
+def get_roster_statuses(mis_nos, subject_id, date, period=1):
+    """Statuses of a roster's students for one session, in roster order (unmarked is Absent)."""
+    records = get_existing_attendance(subject_id, date, period)
+    conn = get_db_connection()
+    try:
+        records.update(archive.session_marks(conn.cursor(), subject_id, date, period, mis_nos))
+    finally:
+        conn.close()
+    return tuple(records.get(mis_no, "Absent") for mis_no in mis_nos)
 
-def get_existing_attendance(subject_id, date):
+def get_existing_attendance(subject_id, date, period=1):
     conn = get_db_connection()
     cur = conn.cursor()
-    cur.execute("SELECT mis_no, status FROM attendance WHERE subject_id=? AND date=?", (subject_id, date))
+    cur.execute("SELECT mis_no, status FROM attendance WHERE subject_id=? AND date=? AND period=?",
+                (subject_id, date, period))
     records = {row['mis_no']: row['status'] for row in cur.fetchall()}
     conn.close()
     return records
 
-def save_bulk_attendance(subject_id, date, attendance_data, teacher_username):
-    conn = get_db_connection()
-    cur = conn.cursor()
+def _write_marks(cur, subject_id, date, attendance_data, teacher_username, period=1, alloc_id=None):
+    """Save a session's marks, writing only the rows whose status differs from the stored one.
+
+    Marks of archived sessions are closed and left as they are. Returns
+    {"changed", "inserted", "unchanged", "archived"} row counts.
+    """
+    closed = archive.session_marks(cur, subject_id, date, period, attendance_data)
+    if closed:
+        attendance_data = {mis_no: status for mis_no, status in attendance_data.items() if mis_no not in closed}
+    previous = aggregates.read_marks(cur, subject_id, date, period)
+    delta = {mis_no: status for mis_no, status in attendance_data.items() if previous.get(mis_no) != status}
+    counts = {"changed": sum(1 for mis_no in delta if mis_no in previous)}
+    counts["inserted"] = len(delta) - counts["changed"]
+    counts["unchanged"] = len(attendance_data) - len(delta)
+    counts["archived"] = len(closed)
+    if not delta:
+        # Nothing to write, so the aggregates and cached reports stay valid too
+        return counts
+    session_ids = aggregates.apply_marks(cur, subject_id, date, delta, previous,
+                                         period, alloc_id, teacher_username)
     insert_data = []
-    for mis_no, status in attendance_data.items():
-        insert_data.append((mis_no, date, subject_id, status, teacher_username))
+    for mis_no, status in delta.items():
+        insert_data.append((mis_no, date, subject_id, period, status, teacher_username, session_ids.get(mis_no)))
+    cur.executemany("""
+        INSERT INTO attendance (mis_no, date, subject_id, period, status, marked_by_teacher, session_id)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT(mis_no, date, subject_id, period) DO UPDATE SET
+            status = excluded.status,
+            marked_by_teacher = excluded.marked_by_teacher,
+            session_id = COALESCE(session_id, excluded.session_id)
+    """, insert_data)
+    journal.record(cur, subject_id, date, period, teacher_username,
+                   [(mis_no, previous.get(mis_no), status) for mis_no, status in delta.items()])
+    return counts
+
+def save_bulk_attendance(subject_id, date, attendance_data, teacher_username, period=1, alloc_id=None):
+    conn = get_db_connection()
+
+    def write(cur):
+        return _write_marks(cur, subject_id, date, attendance_data, teacher_username, period, alloc_id)
 
     try:
-        cur.executemany("""
-            INSERT INTO attendance (mis_no, date, subject_id, status, marked_by_teacher)
-            VALUES (?, ?, ?, ?, ?)
-            ON CONFLICT(mis_no, date, subject_id) DO UPDATE SET
-                status = excluded.status,
-                marked_by_teacher = excluded.marked_by_teacher
-        """, insert_data)
-        conn.commit()
-        return True
-    except Exception as e:
+        return run_write(conn, write)
+    except sqlite3.Error as e:
         print(f"Error in save_bulk_attendance: {e}")
-        conn.rollback()
         return False
     finally:
         conn.close()
 
+BATCH_KEY_TTL = 7 * 24 * 3600
+
+def save_attendance_batches(teacher_username, batches):
+    """Save several classes' attendance in one transaction, each batch at most once.
+
+    Each batch is a dict with key (the client's idempotency key), alloc (the
+    teacher's allocation), date, period and marks ({mis_no: status}). A key
+    already applied for this teacher is not applied again; its stored result
+    is returned instead. A batch naming a student outside the allocation's
+    class is rejected whole. Returns one result dict per batch, in order.
+    """
+    conn = get_db_connection()
+
+    def write(cur):
+        now = time.time()
+        cur.execute("DELETE FROM attendance_batches WHERE created_at < ?", (now - BATCH_KEY_TTL,))
+        cur.execute("""
+            SELECT idempotency_key, result FROM attendance_batches
+            WHERE teacher_username = ? AND idempotency_key IN (SELECT value FROM json_each(?))
+        """, (teacher_username, json.dumps([b["key"] for b in batches])))
+        applied = {key: json.loads(result) for key, result in cur.fetchall()}
+
+        results = []
+        for batch in batches:
+            if batch["key"] in applied:
+                results.append(dict(applied[batch["key"]], replayed=True))
+                continue
+            alloc = batch["alloc"]
+            cur.execute("""
+                SELECT value FROM json_each(?)
+                WHERE value NOT IN (SELECT mis_no FROM students WHERE year=? AND semester=? AND section=?)
+            """, (json.dumps(list(batch["marks"])), alloc["year"], alloc["semester"], alloc["section"]))
+            outsiders = [row[0] for row in cur.fetchall()]
+            if outsiders:
+                result = {"key": batch["key"], "status": "rejected",
+                          "error": f"not in this class: {', '.join(outsiders[:10])}"}
+            else:
+                counts = _write_marks(cur, alloc["subject_id"], batch["date"], batch["marks"], teacher_username,
+                                      batch["period"], alloc["alloc_id"])
+                result = {"key": batch["key"], "status": "applied", **counts}
+                # Rejections are not recorded, so the batch can be corrected and resent under its key
+                cur.execute("""
+                    INSERT INTO attendance_batches (teacher_username, idempotency_key, result, created_at)
+                    VALUES (?, ?, ?, ?)
+                """, (teacher_username, batch["key"], json.dumps(result), now))
+                applied[batch["key"]] = result
+            results.append(result)
+        return results
+
+    try:
+        return run_write(conn, write)
+    finally:
+        conn.close()
+
+def get_attendance_history(mis_no=None, subject_id=None, teacher_username=None, date_from=None, date_to=None,
+                           limit=None):
+    """Recorded attendance changes matching the filters, newest first (see journal.py)."""
+    conn = get_db_connection()
+    try:
+        subject_ids = [subject_id] if subject_id else None
+        return journal.history(conn.cursor(), subject_ids, teacher_username, mis_no, date_from, date_to, limit)
+    finally:
+        conn.close()
+
 # --- REPORTS (With Semester) ---
+def get_class_data_version(year, semester, section):
+    conn = get_db_connection()
+    version = aggregates.class_version(conn.cursor(), year, semester, section)
+    conn.close()
+    return version
+
 def get_class_report(year, semester, section, subject_id):
     conn = get_db_connection()
     cur = conn.cursor()
 
-    cur.execute("SELECT COUNT(DISTINCT date) FROM attendance WHERE subject_id=?", (subject_id,))
+    # Read the version before the data: a save landing in between leaves
+    # newer rows under the older version, never older rows under the newer.
+    version = aggregates.class_version(cur, year, semester, section)
+    key = ("class_report", year, semester, section, str(subject_id), version)
+    cached_report = report_cache.get(key)
+    if cached_report is not None:
+        conn.close()
+        return cached_report
+
+    # Counts come from the aggregates maintained by save_bulk_attendance
+    cur.execute("""
+        SELECT sessions FROM class_session_counts
+        WHERE subject_id=? AND year=? AND semester=? AND section=?
+    """, (subject_id, year, semester, section))
     total_classes_row = cur.fetchone()
     total_classes = total_classes_row[0] if total_classes_row else 0
 
     if total_classes == 0:
         conn.close()
-        return [], 0  
+        return (), 0
 
     cur.execute("""
-        SELECT s.mis_no, s.name,
-               SUM(CASE WHEN a.status='Present' THEN 1 ELSE 0 END) as attended
+        SELECT s.mis_no, s.name, COALESCE(st.present, 0) as attended
         FROM students s
-        LEFT JOIN attendance a ON s.mis_no = a.mis_no AND a.subject_id = ?
+        LEFT JOIN attendance_stats st ON st.mis_no = s.mis_no AND st.subject_id = ?
+         AND st.year = s.year AND st.semester = s.semester AND st.section = s.section
         WHERE s.year=? AND s.semester=? AND s.section=?
-        GROUP BY s.mis_no, s.name
         ORDER BY s.name
     """, (subject_id, year, semester, section))
 
     results = []
     for mis_no, name, attended in cur.fetchall():
-        attended = attended or 0
         percent = round((attended / total_classes) * 100, 2) if total_classes > 0 else 0
         results.append((mis_no, name, attended, total_classes, percent))
 
     conn.close()
-    return results, total_classes
+    report = (tuple(results), total_classes)
+    report_cache.put(key, report, len(repr(report)))
+    return report
 
-def fetch_student_attendance_summary(mis_no):
+def iter_class_report(year, semester, section, subject_id):
+    """Yield get_class_report() rows straight off the cursor, for streaming exports."""
     conn = get_db_connection()
-    cur = conn.cursor()
+    try:
+        cur = conn.execute("""
+            SELECT s.mis_no, s.name, COALESCE(st.present, 0), c.sessions,
+                   ROUND(100.0 * COALESCE(st.present, 0) / c.sessions, 2)
+            FROM class_session_counts c
+            JOIN students s ON s.year = c.year AND s.semester = c.semester AND s.section = c.section
+            LEFT JOIN attendance_stats st ON st.mis_no = s.mis_no AND st.subject_id = c.subject_id
+         AND st.year = c.year AND st.semester = c.semester AND st.section = c.section
+            WHERE c.subject_id=? AND c.year=? AND c.semester=? AND c.section=? AND c.sessions > 0
+            ORDER BY s.name
+        """, (subject_id, year, semester, section))
+        for row in cur:
+            yield tuple(row)
+    finally:
+        conn.close()
 
-    cur.execute("SELECT name FROM students WHERE mis_no=?", (mis_no,))
-    name_row = cur.fetchone()
-    name = name_row["name"] if name_row else "Student"
+def iter_class_reports(year=None, semester=None, section=None, allocated_only=False):
+    """Every class report matching the filter, from one grouped pass.
+
+    Yields (year, semester, section, subject_id, subject_code, rows) per class
+    that has met at least once; rows are as in get_class_report(). Only one
+    class's rows are held at a time.
+    """
+    query = """
+        SELECT c.year, c.semester, c.section, c.subject_id, sub.subject_code,
+               s.mis_no, s.name, COALESCE(st.present, 0), c.sessions,
+               ROUND(100.0 * COALESCE(st.present, 0) / c.sessions, 2)
+        FROM class_session_counts c
+        JOIN subjects sub ON sub.subject_id = c.subject_id
+        JOIN students s ON s.year = c.year AND s.semester = c.semester AND s.section = c.section
+        LEFT JOIN attendance_stats st ON st.mis_no = s.mis_no AND st.subject_id = c.subject_id
+         AND st.year = c.year AND st.semester = c.semester AND st.section = c.section
+        WHERE c.sessions > 0
+    """
+    params = []
+    for column, value in (("year", year), ("semester", semester), ("section", section)):
+        if value:
+            query += f" AND c.{column} = ?"
+            params.append(value)
+    if allocated_only:
+        query += """ AND EXISTS (
+            SELECT 1 FROM teacher_allocations ta
+            WHERE ta.subject_id = c.subject_id AND ta.year = c.year
+              AND ta.semester = c.semester AND ta.section = c.section)"""
+    query += " ORDER BY c.year, c.semester, c.section, sub.subject_code, s.name"
 
-    # Updated to verify semester alignment
-    cur.execute("""
-        SELECT a.subject_id, s.subject_name, s.subject_code, COUNT(DISTINCT a.date) as total_classes
-        FROM attendance a
-        JOIN subjects s ON a.subject_id = s.subject_id
-        JOIN students st ON a.mis_no = st.mis_no
-        WHERE st.year = (SELECT year FROM students WHERE mis_no = ?)
-          AND st.semester = (SELECT semester FROM students WHERE mis_no = ?)
-          AND st.section = (SELECT section FROM students WHERE mis_no = ?)
-        GROUP BY a.subject_id, s.subject_name, s.subject_code
-    """, (mis_no, mis_no, mis_no))
-    total_classes_map = {row['subject_id']: row for row in cur.fetchall()}
+    conn = get_db_connection()
+    try:
+        key, rows = None, []
+        for row in conn.execute(query, params):
+            if row[:5] != key:
+                if rows:
+                    yield (*key, rows)
+                key, rows = tuple(row[:5]), []
+            rows.append(tuple(row[5:]))
+        if rows:
+            yield (*key, rows)
+    finally:
+        conn.close()
+
+def fetch_student_attendance_summary(mis_no):
+    conn = get_db_connection()
+    cur = conn.cursor()
 
+    # One pass over the precomputed counts: the student's row, one index probe
+    # per subject their class has met for, and one stats probe per subject.
     cur.execute("""
-        SELECT subject_id, COUNT(*) as present_count
-        FROM attendance
-        WHERE mis_no = ? AND status = 'Present'
-        GROUP BY subject_id
+        SELECT st.name, c.subject_id, s.subject_code, s.subject_name,
+               COALESCE(a.present, 0) as present, c.sessions as total,
+               ROUND(100.0 * COALESCE(a.present, 0) / c.sessions, 2) as percent
+        FROM students st
+        LEFT JOIN class_session_counts c
+          ON c.year = st.year AND c.semester = st.semester AND c.section = st.section
+         AND c.sessions > 0
+        LEFT JOIN subjects s ON s.subject_id = c.subject_id
+        LEFT JOIN attendance_stats a ON a.mis_no = st.mis_no AND a.subject_id = c.subject_id
+         AND a.year = c.year AND a.semester = c.semester AND a.section = c.section
+        WHERE st.mis_no = ?
+        ORDER BY s.subject_name
     """, (mis_no,))
-    present_classes_map = {row['subject_id']: row['present_count'] for row in cur.fetchall()}
-
-    summary = []
-    for subject_id, subject_data in total_classes_map.items():
-        present = present_classes_map.get(subject_id, 0)
-        total = subject_data['total_classes']
-        percent = round((present / total) * 100, 2) if total > 0 else 0
-        summary.append({
-            'subject_code': subject_data['subject_code'],
-            'subject_name': subject_data['subject_name'],
-            'present': present,
-            'total': total,
-            'percent': percent
-        })
-
+    rows = cur.fetchall()
     conn.close()
+
+    name = rows[0]["name"] if rows else "Student"
+    summary = [{
+        'subject_id': row['subject_id'],
+        'subject_code': row['subject_code'],
+        'subject_name': row['subject_name'],
+        'present': row['present'],
+        'total': row['total'],
+        'percent': row['percent']
+    } for row in rows if row['total']]
     return name, summary
 
 def get_student_detailed_report(mis_no):
     conn = get_db_connection()
     cur = conn.cursor()
     cur.execute("""
-        SELECT a.date, s.subject_name, a.status
+        SELECT a.date, s.subject_name, a.status, a.period, a.subject_id
         FROM attendance a
         JOIN subjects s ON a.subject_id = s.subject_id
         WHERE a.mis_no = ?
-        ORDER BY a.date DESC, s.subject_name
+        ORDER BY a.date DESC, s.subject_name, a.period, a.subject_id
     """, (mis_no,))
+    # The whole archived history is unpacked: this report returns all of it anyway
+    records = cur.fetchall() + archive.student_marks(cur, mis_no)
+    conn.close()
+    return _newest_first(records)
+
+def _history_key(record):
+    # Subject names need not be unique, so the subject id settles ties
+    return record["subject_name"], record["period"], record["subject_id"]
+
+def _newest_first(records):
+    """Sort history records by date DESC, subject_name, period, subject_id, like the history queries."""
+    records.sort(key=_history_key)
+    records.sort(key=lambda r: r["date"], reverse=True)
+    return records
+
+def _merge_history(live, archived):
+    """Merge two record streams each already in history order."""
+    archived = iter(archived)
+    pending = next(archived, None)
+    for record in live:
+        while pending is not None and (pending["date"] > record["date"] or (
+                pending["date"] == record["date"] and _history_key(pending) < _history_key(record))):
+            yield pending
+            pending = next(archived, None)
+        yield record
+    if pending is not None:
+        yield pending
+        yield from archived
+
+def iter_student_history(mis_no):
+    """Yield (date, subject_name, status) for a student's full history, newest first."""
+    conn = get_db_connection()
+    try:
+        # Held in memory whole, like the export it feeds; live rows still stream
+        archived = _newest_first(archive.student_marks(conn.cursor(), mis_no))
+        cur = conn.execute("""
+            SELECT a.date, s.subject_name, a.status, a.period, a.subject_id
+            FROM attendance a
+            JOIN subjects s ON a.subject_id = s.subject_id
+            WHERE a.mis_no = ?
+            ORDER BY a.date DESC, s.subject_name, a.period, a.subject_id
+        """, (mis_no,))
+        for row in _merge_history(cur, archived):
+            yield row["date"], row["subject_name"], row["status"]
+    finally:
+        conn.close()
+
+HISTORY_PAGE_SIZE = 50
+
+def encode_history_cursor(row):
+    return f"{row['date']}|{row['period']}|{row['subject_id']}|{row['subject_name']}"
+
+def decode_history_cursor(cursor):
+    date, period, subject_id, subject_name = cursor.split("|", 3)
+    return date, (subject_name, int(period), int(subject_id))
+
+def get_student_attendance_page(mis_no, cursor=None, limit=HISTORY_PAGE_SIZE,
+                                date_from=None, date_to=None, subject_id=None):
+    """One page of a student's history, newest first.
+
+    Keyset pagination on (date DESC, subject_name, period, subject_id): pass the returned
+    cursor back to get the next page. Returns (records, next_cursor), with
+    next_cursor None on the last page.
+    """
+    query = """
+        SELECT a.date, s.subject_name, a.status, a.period, a.subject_id
+        FROM attendance a
+        JOIN subjects s ON a.subject_id = s.subject_id
+        WHERE a.mis_no = ?
+    """
+    params = [mis_no]
+    if date_from:
+        query += " AND a.date >= ?"
+        params.append(date_from)
+    if date_to:
+        query += " AND a.date <= ?"
+        params.append(date_to)
+    if subject_id:
+        query += " AND a.subject_id = ?"
+        params.append(subject_id)
+    if cursor:
+        date, after = decode_history_cursor(cursor)
+        # The redundant date bound turns the cursor into an index range seek
+        query += (" AND a.date <= ? AND (a.date < ? OR (a.date = ?"
+                  " AND (s.subject_name, a.period, a.subject_id) > (?, ?, ?)))")
+        params.extend([date, date, date, *after])
+    query += " ORDER BY a.date DESC, s.subject_name, a.period, a.subject_id LIMIT ?"
+    params.append(limit + 1)
+
+    conn = get_db_connection()
+    cur = conn.cursor()
+    cur.execute(query, tuple(params))
     records = cur.fetchall()
+    archived = archive.student_page(cur, mis_no, limit + 1, (date, after) if cursor else None,
+                                    date_from, date_to, subject_id)
     conn.close()
-    return records
\ No newline at end of file
+    if archived:
+        records = list(_merge_history(records, archived))[:limit + 1]
+
+    next_cursor = None
+    if len(records) > limit:
+        records = records[:limit]
+        next_cursor = encode_history_cursor(records[-1])
+    return records, next_cursor
@@ -0,0 +1,167 @@
+import os
+import threading
+import time
+from collections import deque
+from functools import cache
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+from werkzeug.security import check_password_hash, generate_password_hash
+
+# Password hashing for logins and password changes.
+#
+# Hashes run on a small thread pool (hashlib releases the GIL while it works),
+# so at most HASH_WORKERS hashes are burning CPU at once however many logins
+# arrive together; beyond HASH_QUEUE waiting requests, logins are turned away
+# instead of piling up. Stored hashes made with other parameters are upgraded
+# to HASH_METHOD the next time their owner logs in.
+
+# Any werkzeug method string, e.g. "scrypt:32768:8:1" or "pbkdf2:sha256:600000"
+HASH_METHOD = os.environ.get("ATTENDANCE_PASSWORD_HASH", "scrypt:32768:8:1")
+HASH_WORKERS = int(os.environ.get("ATTENDANCE_HASH_WORKERS", str(max(1, (os.cpu_count() or 2) // 2))))
+HASH_QUEUE = int(os.environ.get("ATTENDANCE_HASH_QUEUE", "64"))
+HASH_WAIT = float(os.environ.get("ATTENDANCE_HASH_WAIT", "10"))
+
+class HashPoolBusy(Exception):
+    """More logins are waiting to be hashed than the queue allows."""
+
+_executor = ThreadPoolExecutor(max_workers=HASH_WORKERS, thread_name_prefix="hash")
+_slots = threading.BoundedSemaphore(HASH_WORKERS + HASH_QUEUE)
+
+_metrics_lock = threading.Lock()
+_metrics = {"logins": 0, "failed_logins": 0, "hashes": 0, "hash_seconds": 0.0, "max_hash_ms": 0.0,
+            "rehashes": 0, "rejected": 0}
+
+def _run(fn, *args):
+    if not _slots.acquire(blocking=False):
+        with _metrics_lock:
+            _metrics["rejected"] += 1
+        raise HashPoolBusy()
+    start = time.perf_counter()
+    try:
+        future = _executor.submit(fn, *args)
+    except BaseException:
+        _slots.release()
+        raise
+    # The slot is held until the hash is done or dropped from the queue, not
+    # just until this caller stops waiting, so abandoned hashes still count.
+    future.add_done_callback(lambda _: _slots.release())
+    try:
+        result = future.result(timeout=HASH_WAIT)
+    except TimeoutError:
+        future.cancel()
+        with _metrics_lock:
+            _metrics["rejected"] += 1
+        raise HashPoolBusy() from None
+    elapsed = time.perf_counter() - start
+    with _metrics_lock:
+        _metrics["hashes"] += 1
+        _metrics["hash_seconds"] += elapsed
+        _metrics["max_hash_ms"] = max(_metrics["max_hash_ms"], elapsed * 1000)
+    return result
+
+def hash_password(password):
+    return _run(generate_password_hash, password, HASH_METHOD)
+
+@cache
+def _method_prefix(method):
+    # werkzeug fills in defaults, so "pbkdf2" is stored as "pbkdf2:sha256:<iterations>"
+    return generate_password_hash("", method).split("$", 1)[0]
+
+def needs_rehash(stored_hash):
+    return stored_hash.split("$", 1)[0] != _method_prefix(HASH_METHOD)
+
+def check_password(stored_hash, password):
+    """Verify password against stored_hash.
+
+    Returns (ok, new_hash); new_hash is a replacement made with the current
+    HASH_METHOD when the password is right but the stored hash is outdated.
+    """
+    if not _run(check_password_hash, stored_hash, password):
+        return False, None
+    if needs_rehash(stored_hash):
+        with _metrics_lock:
+            _metrics["rehashes"] += 1
+        return True, hash_password(password)
+    return True, None
+
+def record_login(success):
+    with _metrics_lock:
+        _metrics["logins"] += 1
+        if not success:
+            _metrics["failed_logins"] += 1
+
+# --- LOGIN THROTTLING ---
+LOGIN_WINDOW = float(os.environ.get("ATTENDANCE_LOGIN_WINDOW", "300"))
+LOGIN_USER_LIMIT = int(os.environ.get("ATTENDANCE_LOGIN_USER_LIMIT", "5"))
+LOGIN_IP_LIMIT = int(os.environ.get("ATTENDANCE_LOGIN_IP_LIMIT", "50"))
+
+class LoginThrottle:
+    """Sliding-window count of failed logins per account and per client address.
+
+    Checked before any hashing, so a burst of bad guesses costs a dict lookup
+    each once the limit is hit.
+    """
+
+    def __init__(self, window=LOGIN_WINDOW, user_limit=LOGIN_USER_LIMIT, ip_limit=LOGIN_IP_LIMIT):
+        self.window = window
+        self.limits = {"user": user_limit, "ip": ip_limit}
+        self._failures = {}
+        self._lock = threading.Lock()
+        self._throttled = 0
+
+    def _recent(self, key, now):
+        failures = self._failures.get(key)
+        if failures is None:
+            return None
+        while failures and failures[0] <= now - self.window:
+            failures.popleft()
+        if not failures:
+            del self._failures[key]
+            return None
+        return failures
+
+    def retry_after(self, username, ip):
+        """Seconds until this login may be attempted, or 0 if it may go ahead."""
+        now = time.monotonic()
+        wait = 0
+        with self._lock:
+            for key in (("user", username), ("ip", ip)):
+                failures = self._recent(key, now)
+                if failures and len(failures) >= self.limits[key[0]]:
+                    wait = max(wait, failures[0] + self.window - now)
+            if wait:
+                self._throttled += 1
+        return int(wait) + 1 if wait else 0
+
+    def failed(self, username, ip):
+        now = time.monotonic()
+        with self._lock:
+            for key in (("user", username), ("ip", ip)):
+                self._failures.setdefault(key, deque()).append(now)
+            if len(self._failures) > 10000:
+                for key in list(self._failures):
+                    self._recent(key, now)
+
+    def succeeded(self, username):
+        with self._lock:
+            self._failures.pop(("user", username), None)
+
+    def stats(self):
+        with self._lock:
+            return {"tracked_keys": len(self._failures), "throttled": self._throttled}
+
+login_throttle = LoginThrottle()
+
+def auth_stats():
+    with _metrics_lock:
+        metrics = dict(_metrics)
+    hashes = metrics.pop("hashes")
+    total = metrics.pop("hash_seconds")
+    return {
+        "hash_method": HASH_METHOD,
+        "hash_workers": HASH_WORKERS,
+        "hashes": hashes,
+        "avg_hash_ms": round(total / hashes * 1000, 2) if hashes else None,
+        "max_hash_ms": round(metrics.pop("max_hash_ms"), 2),
+        **metrics,
+        **login_throttle.stats(),
+    }
@@ -0,0 +1,233 @@
+import json
+import os
+import random
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from flask.sessions import SessionInterface, SessionMixin
+from werkzeug.datastructures import CallbackDict
+from db import get_db_connection
+
+# Server-side sessions. The cookie carries only a random session id; the
+# session itself (identity, a teacher's allocations, flashes) lives in a
+# store, so it is resolved once at login and read back without touching the
+# users tables. Sessions are indexed by user so an admin action can revoke
+# them or drop cached data.
+#
+#   ATTENDANCE_SESSION_BACKEND=sqlite   sessions table, shared by every process (default)
+#   ATTENDANCE_SESSION_BACKEND=memory   per-process LRU, for a single-process server
+
+SESSION_BACKEND = os.environ.get("ATTENDANCE_SESSION_BACKEND", "sqlite")
+SESSION_TTL = int(os.environ.get("ATTENDANCE_SESSION_TTL", str(8 * 3600)))
+SESSION_MAX = int(os.environ.get("ATTENDANCE_SESSION_MAX", "10000"))
+
+def user_key(data):
+    """'<user_type>:<id>' for a logged-in session's data, else None."""
+    user_type = data.get("user_type")
+    if not user_type:
+        return None
+    return f"{user_type}:{data.get('mis_no') if user_type == 'student' else data.get('username')}"
+
+def _path(field):
+    return f'$."{field}"'
+
+class SqliteSessionStore:
+    def load(self, sid):
+        conn = get_db_connection()
+        row = conn.execute("SELECT data FROM sessions WHERE sid=? AND expires_at > ?", (sid, time.time())).fetchone()
+        conn.close()
+        return json.loads(row["data"]) if row else None
+
+    def create(self, sid, data, expires_at):
+        conn = get_db_connection()
+        conn.execute("INSERT INTO sessions (sid, user_key, data, expires_at) VALUES (?, ?, ?, ?)",
+                     (sid, user_key(data), json.dumps(data), expires_at))
+        # Sweep expired sessions now and then rather than on a timer
+        if random.random() < 0.01:
+            conn.execute("DELETE FROM sessions WHERE expires_at <= ?", (time.time(),))
+        conn.commit()
+        conn.close()
+
+    def update(self, sid, changed, removed, key, expires_at):
+        """Write only the changed fields of a live session; False if it is gone."""
+        # Fields set and removed in place, so a field another request dropped
+        # (forget_cached) is not written back from this request's stale copy
+        expr, params = "data", []
+        for field, value in changed.items():
+            expr = f"json_set({expr}, ?, json(?))"
+            params += [_path(field), json.dumps(value)]
+        for field in removed:
+            expr = f"json_remove({expr}, ?)"
+            params.append(_path(field))
+        conn = get_db_connection()
+        count = conn.execute(f"UPDATE sessions SET data = {expr}, user_key = ?, expires_at = ? "
+                             "WHERE sid = ? AND expires_at > ?",
+                             params + [key, expires_at, sid, time.time()]).rowcount
+        conn.commit()
+        conn.close()
+        return count > 0
+
+    def delete(self, sid):
+        conn = get_db_connection()
+        conn.execute("DELETE FROM sessions WHERE sid=?", (sid,))
+        conn.commit()
+        conn.close()
+
+    def revoke(self, key):
+        conn = get_db_connection()
+        count = conn.execute("DELETE FROM sessions WHERE user_key=?", (key,)).rowcount
+        conn.commit()
+        conn.close()
+        return count
+
+    def forget(self, field, key=None):
+        conn = get_db_connection()
+        if key is None:
+            conn.execute("UPDATE sessions SET data = json_remove(data, ?)", (f"$.{field}",))
+        else:
+            conn.execute("UPDATE sessions SET data = json_remove(data, ?) WHERE user_key=?", (f"$.{field}", key))
+        conn.commit()
+        conn.close()
+
+    def stats(self):
+        conn = get_db_connection()
+        active = conn.execute("SELECT COUNT(*) FROM sessions WHERE expires_at > ?", (time.time(),)).fetchone()[0]
+        conn.close()
+        return {"backend": "sqlite", "active": active}
+
+class MemorySessionStore:
+    """Sessions in this process only, least recently used dropped past max_sessions."""
+
+    def __init__(self, max_sessions=SESSION_MAX):
+        self.max_sessions = max_sessions
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+
+    def load(self, sid):
+        with self._lock:
+            entry = self._sessions.get(sid)
+            if entry is None or entry[1] <= time.time():
+                return None
+            self._sessions.move_to_end(sid)
+            return json.loads(entry[0])
+
+    def create(self, sid, data, expires_at):
+        with self._lock:
+            self._sessions[sid] = (json.dumps(data), expires_at, user_key(data))
+            self._sessions.move_to_end(sid)
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+
+    def update(self, sid, changed, removed, key, expires_at):
+        with self._lock:
+            entry = self._sessions.get(sid)
+            if entry is None or entry[1] <= time.time():
+                return False
+            data = json.loads(entry[0])
+            data.update(changed)
+            for field in removed:
+                data.pop(field, None)
+            self._sessions[sid] = (json.dumps(data), expires_at, key)
+            self._sessions.move_to_end(sid)
+            return True
+
+    def delete(self, sid):
+        with self._lock:
+            self._sessions.pop(sid, None)
+
+    def revoke(self, key):
+        with self._lock:
+            sids = [sid for sid, entry in self._sessions.items() if entry[2] == key]
+            for sid in sids:
+                del self._sessions[sid]
+        return len(sids)
+
+    def forget(self, field, key=None):
+        with self._lock:
+            for sid, (data, expires_at, owner) in list(self._sessions.items()):
+                if key is None or owner == key:
+                    data = json.loads(data)
+                    data.pop(field, None)
+                    self._sessions[sid] = (json.dumps(data), expires_at, owner)
+
+    def stats(self):
+        with self._lock:
+            now = time.time()
+            return {"backend": "memory", "active": sum(1 for e in self._sessions.values() if e[1] > now),
+                    "max": self.max_sessions}
+
+STORES = {"sqlite": SqliteSessionStore, "memory": MemorySessionStore}
+store = STORES[SESSION_BACKEND]()
+
+class ServerSession(CallbackDict, SessionMixin):
+    def __init__(self, initial=None, sid=None):
+        def on_update(session):
+            session.modified = True
+        super().__init__(initial, on_update)
+        self.sid = sid
+        self.new = sid is None
+        # Each field as loaded, to tell which ones this request changed
+        self.loaded = {field: json.dumps(value) for field, value in (initial or {}).items()}
+        self.modified = False
+        self.rotate = False
+
+    def regenerate(self):
+        """Give the session a fresh id on its next save (call on login)."""
+        self.rotate = True
+        self.modified = True
+
+    def changes(self):
+        """(changed {field: value}, removed fields) since the session was loaded."""
+        changed = {field: value for field, value in self.items() if json.dumps(value) != self.loaded.get(field)}
+        return changed, [field for field in self.loaded if field not in self]
+
+class ServerSessionInterface(SessionInterface):
+    def open_session(self, app, request):
+        sid = request.cookies.get(self.get_cookie_name(app))
+        if sid:
+            data = store.load(sid)
+            if data is not None:
+                return ServerSession(data, sid)
+        return ServerSession()
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+        if not session:
+            if session.sid is not None and session.modified:
+                store.delete(session.sid)
+                response.delete_cookie(name, domain=domain, path=path)
+            return
+        if not session.modified:
+            return
+        if session.rotate and session.sid is not None:
+            store.delete(session.sid)
+        expires_at = time.time() + SESSION_TTL
+        if session.sid is None or session.rotate:
+            session.sid = secrets.token_urlsafe(32)
+            store.create(session.sid, dict(session), expires_at)
+        elif not store.update(session.sid, *session.changes(), user_key(session), expires_at):
+            # Revoked or expired while this request ran: it stays ended
+            response.delete_cookie(name, domain=domain, path=path)
+            return
+        response.set_cookie(
+            name, session.sid, expires=expires_at, httponly=self.get_cookie_httponly(app),
+            domain=domain, path=path, secure=self.get_cookie_secure(app),
+            samesite=self.get_cookie_samesite(app),
+        )
+
+def init_sessions(app):
+    app.session_interface = ServerSessionInterface()
+
+def revoke_user(key):
+    """End every session of a user ('teacher:<username>', 'student:<mis_no>')."""
+    return store.revoke(key)
+
+def forget_cached(field, key=None):
+    """Drop a cached field from a user's sessions (or everyone's) so it is resolved again."""
+    store.forget(field, key)
+
+def session_stats():
+    return store.stats()
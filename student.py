@@ -1,28 +1,34 @@
 from flask import Blueprint, render_template, request, redirect, url_for, flash, session
 from models import (
-    fetch_student_attendance_summary, get_student_detailed_report, 
-    change_student_password
+    fetch_student_attendance_summary, get_student_detailed_report,
+    get_student_attendance_page, iter_student_history, change_student_password
 )
 from utils import generate_pdf_report, generate_csv_report
+from auth import role_required
 
 student_bp = Blueprint("student", __name__, url_prefix="/student")
 
-def login_required(f):
-    from functools import wraps
-    @wraps(f)
-    def decorated(*args, **kwargs):
-        if "user_type" not in session or session["user_type"] != "student":
-            return redirect(url_for("auth.login"))
-        return f(*args, **kwargs)
-    return decorated
+login_required = role_required("student")
 
 @student_bp.route("/dashboard")
 @login_required
 def student_dashboard():
     mis_no = session.get("mis_no")
     name, summary = fetch_student_attendance_summary(mis_no)
-    records = get_student_detailed_report(mis_no)
-    
+
+    # Only the most recent window of the log; older pages follow the cursor
+    before = request.args.get("before")
+    date_from = request.args.get("from") or None
+    date_to = request.args.get("to") or None
+    subject_id = request.args.get("subject_id") or None
+    try:
+        records, next_cursor = get_student_attendance_page(
+            mis_no, cursor=before, date_from=date_from, date_to=date_to, subject_id=subject_id
+        )
+    except ValueError:
+        flash("Invalid page requested.", "danger")
+        return redirect(url_for("student.student_dashboard"))
+
     
     total_present = sum(s['present'] for s in summary)
     total_classes = sum(s['total'] for s in summary)
@@ -34,6 +40,11 @@ def student_dashboard():
         mis_no=mis_no,
         summary=summary,
         records=records,
+        next_cursor=next_cursor,
+        before=before,
+        date_from=date_from,
+        date_to=date_to,
+        subject_id=subject_id,
         total_present=total_present,
         total_classes=total_classes,
         overall_percent=overall_percent
@@ -47,18 +58,15 @@ def download_report(report_type):
         flash("MIS Number not found in session", "danger")
         return redirect(url_for("student.student_dashboard"))
 
-    report_data = get_student_detailed_report(mis_no)
-    
-    
-    data = [(row["date"], row["subject_name"], row["status"]) for row in report_data]
     columns = ["Date", "Subject", "Status"]
     filename = f"{mis_no}_full_attendance.{report_type}"
     chart_title = f"Attendance Report for {mis_no}"
 
     if report_type == "csv":
-        return generate_csv_report(data, columns, filename)
+        return generate_csv_report(iter_student_history(mis_no), columns, filename)
     elif report_type == "pdf":
-       
+        report_data = get_student_detailed_report(mis_no)
+        data = [(row["date"], row["subject_name"], row["status"]) for row in report_data]
         return generate_pdf_report(data, columns, filename, chart_title=chart_title)
     else:
         flash("Invalid report type", "danger")
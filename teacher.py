@@ -1,22 +1,43 @@
-from flask import Blueprint, render_template, request, redirect, url_for, flash, session
+from flask import Blueprint, render_template, request, redirect, url_for, flash, session, jsonify, send_file
 from models import (
-    get_class_report, change_teacher_password, get_teacher_subjects,
-    get_students_for_class, get_existing_attendance, save_bulk_attendance
+    get_class_report, iter_class_report, change_teacher_password, get_teacher_subjects,
+    get_class_data_version,
+    get_class_roster, get_roster_statuses, save_bulk_attendance, save_attendance_batches
 )
-from db import get_db_connection
-from utils import generate_csv_report, generate_pdf_report, generate_excel_report
+from utils import generate_csv_report, send_cached_report, get_engine, CLASS_REPORT_COLUMNS
+from jobs import enqueue, get_job, job_status, artifact_path, class_report_key, cache_artifact
+from auth import role_required
 import datetime
+import sqlite3
 
 teacher_bp = Blueprint("teacher", __name__, url_prefix="/teacher")
 
-def login_required(f):
-    from functools import wraps
-    @wraps(f)
-    def decorated(*args, **kwargs):
-        if "user_type" not in session or session["user_type"] != "teacher":
-            return redirect(url_for("auth.login"))
-        return f(*args, **kwargs)
-    return decorated
+login_required = role_required("teacher")
+api_login_required = role_required("teacher", api=True)
+
+def teacher_allocations():
+    """The logged-in teacher's allocations, kept in their session once looked up."""
+    allocations = session.get("allocations")
+    if allocations is None:
+        allocations = [dict(row) for row in get_teacher_subjects(session["username"])]
+        session["allocations"] = allocations
+    return allocations
+
+def find_allocation(alloc_id):
+    """One of the logged-in teacher's allocations, or None if it isn't theirs."""
+    for alloc in teacher_allocations():
+        if str(alloc["alloc_id"]) == str(alloc_id):
+            return alloc
+    return None
+
+PERIODS = range(1, 9)
+
+def _period(values):
+    """The period in a request's args or form: 1 when missing, None when it isn't one of PERIODS."""
+    if "period" not in values:
+        return 1
+    period = values.get("period", type=int)
+    return period if period in PERIODS else None
 
 @teacher_bp.route("/")
 @login_required
@@ -26,47 +47,36 @@ def teacher_dashboard():
 @teacher_bp.route("/mark_attendance", methods=["GET"])
 @login_required
 def mark_attendance_route():
-    teacher_username = session["username"]
-    teacher_subjects = get_teacher_subjects(teacher_username)
+    teacher_subjects = teacher_allocations()
     
     alloc_id = request.args.get("alloc_id")
     date_str = request.args.get("date", datetime.date.today().isoformat())
-    students_with_status = []
+    period = _period(request.args)
+    if period is None:
+        flash(f"Period must be a number from {PERIODS[0]} to {PERIODS[-1]}.", "danger")
+        return redirect(url_for("teacher.mark_attendance_route", alloc_id=alloc_id, date=date_str))
+    mis_nos, names, statuses = (), (), ()
     selected_allocation = None
     selected_subject_id = None
     
     if alloc_id:
-        conn = get_db_connection()
-        cur = conn.cursor()
-        cur.execute("""
-            SELECT ta.year, ta.semester, ta.section, ta.subject_id, s.subject_name, s.subject_code
-            FROM teacher_allocations ta
-            JOIN subjects s ON ta.subject_id = s.subject_id
-            WHERE ta.alloc_id = ? AND ta.teacher_username = ?
-        """, (alloc_id, teacher_username))
-        selected_allocation = cur.fetchone()
-        conn.close()
-
+        selected_allocation = find_allocation(alloc_id)
         if selected_allocation:
-            students = get_students_for_class(
+            # The roster is cached per class; only the statuses are read per view
+            mis_nos, names = get_class_roster(
                 selected_allocation['year'], 
                 selected_allocation['semester'], 
                 selected_allocation['section']
             )
-            existing_records = get_existing_attendance(selected_allocation['subject_id'], date_str)
             selected_subject_id = selected_allocation['subject_id']
-            for student in students:
-                students_with_status.append({
-                    'mis_no': student['mis_no'],
-                    'name': student['name'],
-                    'status': existing_records.get(student['mis_no'], 'Absent') 
-                })
+            statuses = get_roster_statuses(mis_nos, selected_subject_id, date_str, period)
         else:
             flash("Invalid allocation selected.", "danger")
 
     return render_template(
-        "mark_attendance.html", teacher_subjects=teacher_subjects, students=students_with_status,
-        selected_alloc_id=alloc_id, selected_date=date_str, selected_subject_id=selected_subject_id, selected_allocation=selected_allocation
+        "mark_attendance.html", teacher_subjects=teacher_subjects, mis_nos=mis_nos, names=names, statuses=statuses,
+        selected_alloc_id=alloc_id, selected_date=date_str, selected_period=period,
+        selected_subject_id=selected_subject_id, selected_allocation=selected_allocation, periods=PERIODS
     )
 
 @teacher_bp.route("/save_attendance", methods=["POST"])
@@ -75,6 +85,7 @@ def save_attendance_route():
     teacher_username = session["username"]
     subject_id = request.form.get("subject_id")
     date = request.form.get("date")
+    period = _period(request.form)
     alloc_id = request.form.get("alloc_id")
     attendance_data = {}
     for key, value in request.form.items():
@@ -85,35 +96,94 @@ def save_attendance_route():
     if not all([subject_id, date, attendance_data]):
         flash("Missing data.", "danger")
         return redirect(url_for("teacher.mark_attendance_route"))
+    if period is None:
+        flash(f"Period must be a number from {PERIODS[0]} to {PERIODS[-1]}.", "danger")
+        return redirect(url_for("teacher.mark_attendance_route", alloc_id=alloc_id, date=date))
 
-    if save_bulk_attendance(subject_id, date, attendance_data, teacher_username):
-        flash(f"Attendance for {date} saved/updated successfully!", "success")
+    counts = save_bulk_attendance(subject_id, date, attendance_data, teacher_username, period, alloc_id)
+    if counts:
+        flash(f"Attendance for {date} saved/updated successfully! "
+              f"({counts['changed']} changed, {counts['inserted']} new, {counts['unchanged']} unchanged)", "success")
+        if counts["archived"]:
+            flash(f"{counts['archived']} student(s) were left as they are: this session is in an archived term.",
+                  "warning")
     else:
         flash("Error saving attendance.", "danger")
-    return redirect(url_for("teacher.mark_attendance_route", alloc_id=alloc_id, date=date))
+    return redirect(url_for("teacher.mark_attendance_route", alloc_id=alloc_id, date=date, period=period))
+
+# --- ATTENDANCE API ---
+# POST /teacher/api/attendance with
+#   {"batches": [{"key": "<idempotency key>", "alloc_id": 3, "date": "2025-12-01", "period": 1,
+#                 "marks": [["112315001", "Present"], ["112315002", "Absent"], ...]}, ...]}
+# applies every valid batch in one transaction and answers {"results": [...]}, one
+# result per batch in order. A batch whose key was already applied is not applied
+# again, so a client may resend a whole queue after a dropped connection.
+MAX_API_BATCHES = 50
+STATUSES = ("Present", "Absent")
+
+def _parse_batch(raw):
+    """The batch ready for save_attendance_batches, or an error message."""
+    if not isinstance(raw, dict) or not isinstance(raw.get("key"), str) or not raw["key"]:
+        return "each batch needs a string key"
+    alloc = find_allocation(raw.get("alloc_id"))
+    if not alloc:
+        return "not one of your allocations"
+    try:
+        date = datetime.date.fromisoformat(str(raw.get("date"))).isoformat()
+        period = int(raw.get("period", 1))
+        marks = dict(raw.get("marks") or ())
+    except (TypeError, ValueError):
+        return "date must be YYYY-MM-DD, period a number and marks [mis_no, status] pairs"
+    if period not in PERIODS:
+        return f"period must be from {PERIODS[0]} to {PERIODS[-1]}"
+    if not marks:
+        return "no marks"
+    bad = [mis_no for mis_no, status in marks.items() if status not in STATUSES]
+    if bad:
+        return f"status must be Present or Absent for: {', '.join(map(str, bad[:10]))}"
+    return {"key": raw["key"], "alloc": alloc, "date": date, "period": period,
+            "marks": {str(mis_no): status for mis_no, status in marks.items()}}
+
+@teacher_bp.route("/api/attendance", methods=["POST"])
+@api_login_required
+def attendance_api():
+    body = request.get_json(silent=True)
+    batches = body.get("batches") if isinstance(body, dict) else None
+    if not isinstance(batches, list) or not batches:
+        return jsonify({"error": "expected {\"batches\": [...]}"}), 400
+    if len(batches) > MAX_API_BATCHES:
+        return jsonify({"error": f"at most {MAX_API_BATCHES} batches per request"}), 400
+
+    results = []
+    valid = []
+    for raw in batches:
+        batch = _parse_batch(raw)
+        if isinstance(batch, str):
+            key = raw.get("key") if isinstance(raw, dict) else None
+            results.append({"key": key, "status": "rejected", "error": batch})
+        else:
+            results.append(None)
+            valid.append(batch)
+    if valid:
+        try:
+            saved = iter(save_attendance_batches(session["username"], valid))
+        except sqlite3.Error as e:
+            print(f"Error in attendance_api: {e}")
+            return jsonify({"error": "could not save, try again"}), 503
+        results = [result or next(saved) for result in results]
+    return jsonify({"results": results})
 
 @teacher_bp.route("/view_reports", methods=["GET", "POST"])
 @login_required
 def view_reports():
-    teacher_username = session["username"]
-    teacher_subjects = get_teacher_subjects(teacher_username)
+    teacher_subjects = teacher_allocations()
     reports = []
     selected_alloc_id = request.form.get("alloc_id")
     selected_allocation = None
     total_classes = 0
 
     if request.method == "POST" and selected_alloc_id:
-        conn = get_db_connection()
-        cur = conn.cursor()
-        cur.execute("""
-            SELECT ta.year, ta.semester, ta.section, ta.subject_id, s.subject_name, s.subject_code
-            FROM teacher_allocations ta
-            JOIN subjects s ON ta.subject_id = s.subject_id
-            WHERE ta.alloc_id = ? AND ta.teacher_username = ?
-        """, (selected_alloc_id, teacher_username))
-        selected_allocation = cur.fetchone()
-        conn.close()
-        
+        selected_allocation = find_allocation(selected_alloc_id)
         if selected_allocation:
             reports, total_classes = get_class_report(
                 selected_allocation['year'], selected_allocation['semester'], 
@@ -129,29 +199,60 @@ def view_reports():
 def download_class_report(file_type):
     teacher_username = session["username"]
     alloc_id = request.form.get("alloc_id")
-    conn = get_db_connection()
-    cur = conn.cursor()
-    cur.execute("""
-        SELECT ta.year, ta.semester, ta.section, ta.subject_id, s.subject_code, s.subject_name
-        FROM teacher_allocations ta
-        JOIN subjects s ON ta.subject_id = s.subject_id
-        WHERE ta.alloc_id = ? AND ta.teacher_username = ?
-    """, (alloc_id, teacher_username))
-    alloc = cur.fetchone()
-    conn.close()
+    alloc = find_allocation(alloc_id)
 
     if not alloc: return redirect(url_for("teacher.view_reports"))
 
-    reports, total_classes = get_class_report(alloc['year'], alloc['semester'], alloc['section'], alloc['subject_id'])
-    data = [(mis_no, name, attended, total, percent) for mis_no, name, attended, total, percent in reports]
-    columns = ["MIS Number", "Name", "Classes Attended", "Total Classes", "Attendance %"]
     filename = f"{alloc['year']}_Sem{alloc['semester']}_{alloc['section']}_{alloc['subject_code']}.{file_type}"
     chart_title = f"{alloc['year']} Sem {alloc['semester']} {alloc['section']}"
+    if file_type not in ("csv", "pdf", "xlsx"): return "Invalid file type", 400
+
+    params = {
+        "year": alloc['year'], "semester": alloc['semester'], "section": alloc['section'],
+        "subject_id": alloc['subject_id'], "file_type": file_type, "chart_title": chart_title,
+        "version": get_class_data_version(alloc['year'], alloc['semester'], alloc['section']),
+    }
+    cached_report = send_cached_report(class_report_key(params), filename, get_engine(file_type).mimetype)
+    if cached_report: return cached_report
+
+    if file_type == "csv":
+        rows = iter_class_report(alloc['year'], alloc['semester'], alloc['section'], alloc['subject_id'])
+        return generate_csv_report(rows, CLASS_REPORT_COLUMNS, filename, cache_key=class_report_key(params))
+    job_id = enqueue("class_report", params, owner=teacher_username, filename=filename)
+    return redirect(url_for("teacher.report_job", job_id=job_id))
+
+@teacher_bp.route("/jobs/<job_id>")
+@login_required
+def report_job(job_id):
+    job = get_job(job_id, session["username"])
+    if not job:
+        flash("Report not found or expired.", "danger")
+        return redirect(url_for("teacher.view_reports"))
+    return render_template(
+        "report_job.html", job=job_status(job),
+        status_url=url_for("teacher.report_job_status", job_id=job_id),
+        download_url=url_for("teacher.report_job_download", job_id=job_id),
+        back_url=url_for("teacher.view_reports"),
+    )
 
-    if file_type == "csv": return generate_csv_report(data, columns, filename)
-    elif file_type == "pdf": return generate_pdf_report(data, columns, filename, chart_title)
-    elif file_type == "xlsx": return generate_excel_report(data, columns, filename)
-    else: return "Invalid file type", 400
+@teacher_bp.route("/jobs/<job_id>/status")
+@login_required
+def report_job_status(job_id):
+    job = get_job(job_id, session["username"])
+    if not job:
+        return jsonify({"error": "not found"}), 404
+    return jsonify(job_status(job))
+
+@teacher_bp.route("/jobs/<job_id>/download")
+@login_required
+def report_job_download(job_id):
+    job = get_job(job_id, session["username"])
+    path = artifact_path(job) if job else None
+    if not path:
+        flash("Report is not ready or has expired.", "danger")
+        return redirect(url_for("teacher.view_reports"))
+    cache_artifact(job, path)
+    return send_file(path, as_attachment=True, download_name=job["filename"], mimetype=job["mimetype"])
 
 @teacher_bp.route("/change_password", methods=["GET", "POST"])
 @login_required
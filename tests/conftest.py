@@ -0,0 +1,31 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+# The app reads its settings at import, so point it at a scratch database first
+_scratch = tempfile.mkdtemp(prefix="attendance-tests-")
+os.environ["ATTENDANCE_DB"] = os.path.join(_scratch, "attendance.db")
+os.environ["ATTENDANCE_EXPORT_DIR"] = os.path.join(_scratch, "exports")
+os.environ.setdefault("ATTENDANCE_PASSWORD_HASH", "pbkdf2:sha256:1000")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+@pytest.fixture(scope="session")
+def app():
+    from app import app
+    app.config["TESTING"] = True
+    return app
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+@pytest.fixture
+def school(app):
+    """A teacher and a subject; every test makes its own classes and students."""
+    import models
+    models.add_teacher("t_reports", "pw")
+    models.add_subject("TST101", "Testing")
+    subject_id = next(s["subject_id"] for s in models.get_all_subjects() if s["subject_code"] == "TST101")
+    return {"teacher": "t_reports", "subject_id": subject_id}
@@ -0,0 +1,24 @@
+import models
+
+def test_resending_a_batch_replays_its_result(school, client):
+    cls = ("6", "4", "K")
+    for mis_no in ("k001", "k002"):
+        models.add_student(mis_no, f"Student {mis_no}", *cls, "pw")
+    models.allocate_subject(school["teacher"], school["subject_id"], *cls)
+    alloc_id = next(a["alloc_id"] for a in models.get_teacher_subjects(school["teacher"])
+                    if (a["year"], a["semester"], a["section"]) == cls)
+    client.post("/", data={"user_type": "teacher", "username": school["teacher"], "password": "pw"})
+    batch = {"key": "k-2025-08-01", "alloc_id": alloc_id, "date": "2025-08-01", "period": 1,
+             "marks": [["k001", "Present"], ["k002", "Absent"]]}
+
+    first = client.post("/teacher/api/attendance", json={"batches": [batch]}).get_json()["results"][0]
+    assert first["status"] == "applied" and "replayed" not in first
+    # A resend with different marks under the same key changes nothing
+    batch["marks"] = [["k001", "Absent"], ["k002", "Absent"]]
+    again = client.post("/teacher/api/attendance", json={"batches": [batch]}).get_json()["results"][0]
+    assert again == dict(first, replayed=True)
+
+    assert models.get_existing_attendance(school["subject_id"], "2025-08-01") == {"k001": "Present", "k002": "Absent"}
+    rows, total = models.get_class_report(*cls, school["subject_id"])
+    assert total == 1
+    assert [(mis_no, attended) for mis_no, _, attended, _, _ in rows] == [("k001", 1), ("k002", 0)]
@@ -0,0 +1,61 @@
+import aggregates
+import archive
+import models
+from db import get_db_connection
+
+def test_saving_an_archived_session_keeps_its_marks(school, client):
+    cls = ("4", "7", "R")
+    for mis_no in ("r001", "r002"):
+        models.add_student(mis_no, f"Student {mis_no}", *cls, "pw")
+    models.allocate_subject(school["teacher"], school["subject_id"], *cls)
+    alloc_id = next(a["alloc_id"] for a in models.get_teacher_subjects(school["teacher"])
+                    if (a["year"], a["semester"], a["section"]) == cls)
+    models.save_bulk_attendance(school["subject_id"], "2025-05-01", {"r001": "Present", "r002": "Absent"},
+                                school["teacher"], 1, alloc_id)
+    conn = get_db_connection()
+    try:
+        archive.archive_class(conn.cursor(), *cls)
+        conn.commit()
+    finally:
+        conn.close()
+
+    client.post("/", data={"user_type": "teacher", "username": school["teacher"], "password": "pw"})
+    page = client.get(f"/teacher/mark_attendance?alloc_id={alloc_id}&date=2025-05-01&period=1")
+    assert page.data.count(b'value="Present" checked') == 1
+
+    response = client.post("/teacher/save_attendance", data={
+        "subject_id": str(school["subject_id"]), "date": "2025-05-01", "period": "1", "alloc_id": str(alloc_id),
+        "status_r001": "Absent", "status_r002": "Present"}, follow_redirects=True)
+    assert b"2 student(s) were left as they are" in response.data
+
+    conn = get_db_connection()
+    try:
+        assert archive.session_marks(conn.cursor(), school["subject_id"], "2025-05-01", 1, ["r001", "r002"]) == {
+            "r001": "Present", "r002": "Absent"}
+        assert conn.execute("SELECT COUNT(*) FROM attendance WHERE mis_no IN ('r001', 'r002')").fetchone()[0] == 0
+    finally:
+        conn.close()
+
+def test_archiving_keeps_a_moved_students_marks_with_their_old_class(school):
+    class_a, class_b = ("4", "8", "A"), ("4", "8", "B")
+    models.add_student("a001", "Student a001", *class_a, "pw")
+    models.add_student("b001", "Student b001", *class_b, "pw")
+    # Both classes meet in the same slot
+    models.save_bulk_attendance(school["subject_id"], "2025-06-02", {"a001": "Present"}, school["teacher"])
+    models.save_bulk_attendance(school["subject_id"], "2025-06-02", {"b001": "Absent"}, school["teacher"])
+    models.update_student("a001", "Student a001", *class_b)
+
+    conn = get_db_connection()
+    try:
+        cur = conn.cursor()
+        assert archive.archive_class(cur, *class_b)["marks"] == 1
+        conn.commit()
+        assert aggregates.verify(cur) == []
+        assert archive.archive_class(cur, *class_a)["marks"] == 1
+        conn.commit()
+        assert aggregates.verify(cur) == []
+        assert archive.session_marks(cur, school["subject_id"], "2025-06-02", 1, ["a001", "b001"]) == {
+            "a001": "Present", "b001": "Absent"}
+        assert conn.execute("SELECT COUNT(*) FROM attendance WHERE mis_no IN ('a001', 'b001')").fetchone()[0] == 0
+    finally:
+        conn.close()
@@ -0,0 +1,16 @@
+import models
+
+def _login(client, username):
+    return client.post("/", data={"user_type": "teacher", "username": username, "password": "pw"})
+
+def test_removing_a_teacher_ends_their_sessions(app):
+    models.add_teacher("t_gone", "pw")
+    client = app.test_client()
+    _login(client, "t_gone")
+    assert client.get("/teacher/").status_code == 200
+
+    models.remove_teacher("t_gone")
+    response = client.get("/teacher/")
+    assert response.status_code == 302
+    assert response.headers["Location"].endswith("/")
+    assert client.post("/teacher/api/attendance", json={"batches": []}).status_code == 401
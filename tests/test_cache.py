@@ -0,0 +1,37 @@
+import models
+
+def test_class_roster_stays_cached_across_saves_and_follows_membership(school):
+    cls = ("6", "1", "C")
+    models.add_student("c001", "Student c001", *cls, "pw")
+    roster = models.get_class_roster(*cls)
+    assert roster == (("c001",), ("Student c001",))
+
+    models.save_bulk_attendance(school["subject_id"], "2025-07-01", {"c001": "Present"}, school["teacher"])
+    assert models.get_class_roster(*cls) is roster
+
+    models.add_student("c002", "Student c002", *cls, "pw")
+    assert models.get_class_roster(*cls) == (("c001", "c002"), ("Student c001", "Student c002"))
+    models.update_student("c001", "Renamed c001", *cls)
+    assert models.get_class_roster(*cls) == (("c001", "c002"), ("Renamed c001", "Student c002"))
+    models.move_class(cls, ("6", "2", "C"))
+    assert models.get_class_roster(*cls) == ((), ())
+    models.remove_student("c002")
+    assert models.get_class_roster("6", "2", "C") == (("c001",), ("Renamed c001",))
+
+def test_class_report_is_served_from_cache_until_the_class_version_moves(school):
+    cls = ("6", "3", "C")
+    models.add_student("c003", "Student c003", *cls, "pw")
+    models.save_bulk_attendance(school["subject_id"], "2025-07-01", {"c003": "Present"}, school["teacher"])
+    version = models.get_class_data_version(*cls)
+    report = models.get_class_report(*cls, school["subject_id"])
+    assert models.get_class_report(*cls, school["subject_id"]) is report
+
+    models.save_bulk_attendance(school["subject_id"], "2025-07-02", {"c003": "Absent"}, school["teacher"])
+    assert models.get_class_data_version(*cls) > version
+    rows, total = models.get_class_report(*cls, school["subject_id"])
+    assert total == 2
+    assert [(mis_no, attended, percent) for mis_no, _, attended, _, percent in rows] == [("c003", 1, 50.0)]
+
+    models.update_student("c003", "Renamed c003", *cls)
+    rows, _ = models.get_class_report(*cls, school["subject_id"])
+    assert rows[0][1] == "Renamed c003"
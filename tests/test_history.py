@@ -0,0 +1,65 @@
+import archive
+import models
+from db import get_db_connection
+def _pages(mis_no, limit, **filters):
+    records, cursor, pages = [], None, 0
+    while True:
+        page, cursor = models.get_student_attendance_page(mis_no, cursor=cursor, limit=limit, **filters)
+        records += page
+        pages += 1
+        if cursor is None:
+            return records, pages
+
+def test_paging_does_not_drop_subjects_with_the_same_name(school):
+    models.add_student("h001", "Student h001", "5", "1", "H", "pw")
+    for code in ("LAB1", "LAB2", "LAB3"):
+        models.add_subject(code, "Lab")
+    labs = [s["subject_id"] for s in models.get_all_subjects() if s["subject_name"] == "Lab"]
+    for subject_id in labs:
+        models.save_bulk_attendance(subject_id, "2025-01-01", {"h001": "Present"}, school["teacher"])
+
+    records, pages = _pages("h001", 1)
+    assert sorted(r["subject_id"] for r in records) == sorted(labs)
+    assert pages == 3
+
+def test_paging_walks_archived_and_live_marks_in_order(school):
+    models.add_student("h002", "Student h002", "5", "2", "H", "pw")
+    for code in ("ARC1", "ARC2"):
+        models.add_subject(code, "Archived")
+    subject_ids = [s["subject_id"] for s in models.get_all_subjects() if s["subject_name"] == "Archived"]
+    subject_ids.append(school["subject_id"])
+    for day in range(1, 6):
+        for period in (1, 2):
+            for subject_id in subject_ids:
+                models.save_bulk_attendance(subject_id, f"2025-02-0{day}", {"h002": "Present" if day % 2 else "Absent"},
+                                            school["teacher"], period)
+    conn = get_db_connection()
+    try:
+        archive.archive_class(conn.cursor(), "5", "2", "H")
+        conn.commit()
+    finally:
+        conn.close()
+    models.save_bulk_attendance(school["subject_id"], "2025-02-09", {"h002": "Present"}, school["teacher"])
+
+    def key(r):
+        return r["date"], r["subject_name"], r["period"], r["subject_id"], r["status"]
+    expected = [key(r) for r in models.get_student_detailed_report("h002")]
+    records, pages = _pages("h002", 4)
+    assert [key(r) for r in records] == expected
+    assert pages == 8
+
+    records, _ = _pages("h002", 3, date_from="2025-02-02", date_to="2025-02-04", subject_id=subject_ids[0])
+    assert [key(r) for r in records] == [k for k in expected
+                                         if "2025-02-02" <= k[0] <= "2025-02-04" and k[3] == subject_ids[0]]
+
+def test_paging_resumes_after_the_cursor_when_newer_marks_arrive(school):
+    models.add_student("h003", "Student h003", "5", "3", "H", "pw")
+    for day in range(1, 5):
+        models.save_bulk_attendance(school["subject_id"], f"2025-03-0{day}", {"h003": "Present"}, school["teacher"])
+
+    first, cursor = models.get_student_attendance_page("h003", limit=2)
+    assert [r["date"] for r in first] == ["2025-03-04", "2025-03-03"]
+    models.save_bulk_attendance(school["subject_id"], "2025-03-09", {"h003": "Absent"}, school["teacher"])
+    second, cursor = models.get_student_attendance_page("h003", cursor=cursor, limit=2)
+    assert [r["date"] for r in second] == ["2025-03-02", "2025-03-01"]
+    assert cursor is None
@@ -0,0 +1,21 @@
+import io
+
+import importer
+from db import get_db_connection
+
+def _stored_hash(mis_no):
+    conn = get_db_connection()
+    try:
+        return conn.execute("SELECT password FROM students WHERE mis_no=?", (mis_no,)).fetchone()[0]
+    finally:
+        conn.close()
+
+def test_imported_passwords_are_upgraded_at_first_login(client):
+    roster = b"mis_no,name,year,semester,section,password\ni001,Student i001,7,1,I,secret\n"
+    result = importer.import_students(io.BytesIO(roster), "roster.csv")
+    assert result["imported"] == 1 and result["errors"] == []
+    assert _stored_hash("i001").startswith(importer.IMPORT_HASH_METHOD + "$")
+
+    response = client.post("/", data={"user_type": "student", "username": "i001", "password": "secret"})
+    assert response.status_code == 302
+    assert not _stored_hash("i001").startswith(importer.IMPORT_HASH_METHOD + "$")
@@ -0,0 +1,90 @@
+import aggregates
+import models
+from db import get_db_connection
+
+def _class(school, cls, mis_nos):
+    for mis_no in mis_nos:
+        models.add_student(mis_no, f"Student {mis_no}", *cls, "pw")
+    models.allocate_subject(school["teacher"], school["subject_id"], *cls)
+
+def _mark(school, date, mis_nos, status="Present"):
+    models.save_bulk_attendance(school["subject_id"], date, {m: status for m in mis_nos}, school["teacher"])
+
+def _drift():
+    conn = get_db_connection()
+    try:
+        return aggregates.verify(conn.cursor())
+    finally:
+        conn.close()
+
+def test_moved_class_stays_within_100_percent(school):
+    source, target = ("1", "1", "M"), ("1", "2", "M")
+    students = ["m001", "m002"]
+    _class(school, source, students)
+    for day in range(1, 7):
+        _mark(school, f"2025-01-{day:02d}", students)
+
+    models.move_class(source, target, carry_allocations=True)
+    _mark(school, "2025-02-01", students[:1])
+    _mark(school, "2025-02-01", students[1:], "Absent")
+
+    rows, total = models.get_class_report(*target, school["subject_id"])
+    assert total == 1
+    assert [(mis_no, attended, percent) for mis_no, _, attended, _, percent in rows] == [
+        ("m001", 1, 100.0), ("m002", 0, 0.0)]
+    assert list(models.iter_class_report(*target, school["subject_id"])) == list(rows)
+    _, summary = models.fetch_student_attendance_summary("m001")
+    assert [(s["present"], s["total"], s["percent"]) for s in summary] == [(1, 1, 100.0)]
+    assert _drift() == []
+
+def test_student_changing_class_stays_within_100_percent(school):
+    old, new = ("2", "1", "U"), ("2", "1", "V")
+    _class(school, old, ["u001"])
+    _class(school, new, ["v001"])
+    for day in range(1, 5):
+        _mark(school, f"2025-03-{day:02d}", ["u001"])
+    _mark(school, "2025-03-01", ["v001"])
+
+    models.update_student("u001", "Student u001", *new)
+    _mark(school, "2025-03-10", ["u001", "v001"])
+
+    rows, total = models.get_class_report(*new, school["subject_id"])
+    assert total == 2
+    assert all(percent <= 100 for *_, percent in rows)
+    assert dict((mis_no, attended) for mis_no, _, attended, _, _ in rows) == {"u001": 1, "v001": 2}
+    assert _drift() == []
+
+def test_editing_a_past_session_after_a_move_counts_towards_the_old_class(school):
+    old, new = ("3", "1", "P"), ("3", "1", "Q")
+    _class(school, old, ["p001"])
+    _class(school, new, ["q001"])
+    _mark(school, "2025-04-01", ["p001"], "Absent")
+    _mark(school, "2025-04-02", ["q001"])
+
+    models.update_student("p001", "Student p001", *new)
+    _mark(school, "2025-04-01", ["p001"])
+
+    rows, _ = models.get_class_report(*new, school["subject_id"])
+    assert dict((mis_no, attended) for mis_no, _, attended, _, _ in rows) == {"p001": 0, "q001": 1}
+    assert _drift() == []
+
+def test_aggregates_match_the_raw_rows_after_saves_moves_and_removals(school):
+    old, new = ("3", "2", "D"), ("3", "3", "D")
+    _class(school, old, ["d001", "d002", "d003"])
+    _mark(school, "2025-05-01", ["d001", "d002", "d003"])
+    _mark(school, "2025-05-01", ["d002"], "Absent")
+    assert _drift() == []
+
+    models.move_class(old, new, carry_allocations=True)
+    _mark(school, "2025-05-02", ["d001", "d002"])
+    assert _drift() == []
+
+    models.update_student("d003", "Student d003", *old)
+    _mark(school, "2025-05-01", ["d003"], "Absent")
+    assert _drift() == []
+
+    models.remove_student("d002")
+    assert _drift() == []
+    rows, total = models.get_class_report(*new, school["subject_id"])
+    assert total == 1
+    assert [(mis_no, attended) for mis_no, _, attended, _, _ in rows] == [("d001", 1)]
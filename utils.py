@@ -1,85 +1,307 @@
-import pandas as pd
+import csv
+import io
+import zipfile
+from abc import ABC, abstractmethod
+from xml.sax.saxutils import escape
 from io import BytesIO
-from flask import send_file
-from reportlab.lib.pagesizes import letter
-from reportlab.pdfgen import canvas
-import matplotlib.pyplot as plt
-import matplotlib
-matplotlib.use('Agg') # Fixes main thread errors for plots
-
-def generate_csv_report(data, columns, filename="report.csv"):
-    df = pd.DataFrame(data, columns=columns)
-    buffer = BytesIO()
-    df.to_csv(buffer, index=False)
-    buffer.seek(0)
-    return send_file(buffer, as_attachment=True, download_name=filename, mimetype='text/csv')
-
-def generate_excel_report(data, columns, filename="report.xlsx"):
-    df = pd.DataFrame(data, columns=columns)
-    buffer = BytesIO()
-    # Requires 'openpyxl' installed: pip install openpyxl
-    with pd.ExcelWriter(buffer, engine='openpyxl') as writer:
-        df.to_excel(writer, index=False, sheet_name='Attendance Report')
+from flask import send_file, Response, stream_with_context
+from cache import report_cache
+
+# openpyxl and reportlab are imported by the engines below on first
+# use, so workers that never export a report never load them.
+
+CSV_CHUNK_ROWS = 500
+CLASS_REPORT_COLUMNS = ["MIS Number", "Name", "Classes Attended", "Total Classes", "Attendance %"]
+
+def iter_csv(rows, columns, chunk_rows=CSV_CHUNK_ROWS):
+    """Encode rows as CSV, yielding UTF-8 chunks of about chunk_rows rows.
+
+    The header goes out on its own so the client gets its first byte before
+    the query behind `rows` has produced anything.
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator="\n")
+    writer.writerow(columns)
+    yield buffer.getvalue().encode("utf-8")
     buffer.seek(0)
-    return send_file(
-        buffer, 
-        as_attachment=True, 
-        download_name=filename, 
-        mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
-    )
+    buffer.truncate()
+    for count, row in enumerate(rows, 1):
+        writer.writerow(row)
+        if count % chunk_rows == 0:
+            yield buffer.getvalue().encode("utf-8")
+            buffer.seek(0)
+            buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode("utf-8")
 
-def generate_pdf_report(data, columns, filename="report.pdf", chart_title="Attendance Chart"):
-    buffer = BytesIO()
-    c = canvas.Canvas(buffer, pagesize=letter)
-    width, height = letter
-    y = height - 50
-
-    c.setFont("Helvetica-Bold", 14)
-    c.drawString(50, y, "Attendance Report")
-    y -= 30
-
-    c.setFont("Helvetica", 10)
-    row_height = 20
-
-    # Draw Headers
-    for i, col in enumerate(columns):
-        c.drawString(50 + i*100, y, str(col))
-    y -= row_height
-
-    # Draw Rows
-    for row in data:
-        for i, item in enumerate(row):
-            c.drawString(50 + i*100, y, str(item))
-        y -= row_height
-        if y < 150: 
-            c.showPage()
-            y = height - 50
+class _ChunkSink(io.RawIOBase):
+    """Write-only, non-seekable stream that hands back what was written since the last drain."""
+
+    def __init__(self):
+        self.chunks = []
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def drain(self):
+        data = b"".join(self.chunks)
+        self.chunks = []
+        return data
+
+def iter_zip(members):
+    """Build a ZIP from (name, content) pairs, yielding it one member at a time.
+
+    zipfile falls back to data descriptors on a non-seekable stream, so each
+    member can go out as soon as it is written.
+    """
+    sink = _ChunkSink()
+    with zipfile.ZipFile(sink, "w", compression=zipfile.ZIP_DEFLATED) as archive:
+        for name, content in members:
+            archive.writestr(name, content)
+            yield sink.drain()
+    yield sink.drain()
+
+# --- REPORT ENGINES ---
+class ReportEngine(ABC):
+    """Renders report rows to a file format.
+
+    render() returns the finished file as bytes; engines import their
+    libraries inside render() rather than at module import.
+    """
+    file_type = None
+    mimetype = "application/octet-stream"
+
+    @abstractmethod
+    def render(self, data, columns, **options):
+        ...
+
+class CsvEngine(ReportEngine):
+    file_type = "csv"
+    mimetype = "text/csv"
+
+    def render(self, data, columns, **options):
+        return b"".join(iter_csv(data, columns))
+
+class ExcelEngine(ReportEngine):
+    """XLSX through openpyxl's write-only mode.
+
+    Rows go to the worksheet XML as they are appended instead of building a
+    cell object model, so memory stays flat however long the report is and
+    data can be a generator over a database cursor.
+    """
+    file_type = "xlsx"
+    mimetype = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+
+    # Attendance % holds 0-100, so the % sign is a literal rather than Excel's
+    # percent format (which would multiply by 100).
+    PERCENT_FORMAT = '0.00"%"'
+    COLUMN_WIDTH = 18
+
+    def render(self, data, columns, sheet_name="Attendance Report", **options):
+        return self.render_sheets([(sheet_name, data)], columns)
+
+    def render_sheets(self, sheets, columns):
+        """One worksheet per (name, rows) pair, in a single workbook."""
+        from openpyxl import Workbook
+        from openpyxl.cell import WriteOnlyCell
+        from openpyxl.styles import Font
+        from openpyxl.utils import get_column_letter
 
+        columns = list(columns)
+        percent_col = columns.index("Attendance %") if "Attendance %" in columns else None
+        workbook = Workbook(write_only=True)
+        for name, rows in sheets:
+            sheet = workbook.create_sheet(self._sheet_title(name, workbook.sheetnames))
+            for i in range(1, len(columns) + 1):
+                sheet.column_dimensions[get_column_letter(i)].width = self.COLUMN_WIDTH
+            sheet.freeze_panes = "A2"
+            header = []
+            for column in columns:
+                cell = WriteOnlyCell(sheet, value=column)
+                cell.font = Font(bold=True)
+                header.append(cell)
+            sheet.append(header)
+            for row in rows:
+                row = list(row)
+                if percent_col is not None:
+                    cell = WriteOnlyCell(sheet, value=row[percent_col])
+                    cell.number_format = self.PERCENT_FORMAT
+                    row[percent_col] = cell
+                sheet.append(row)
+        if not workbook.sheetnames:
+            workbook.create_sheet("Attendance Report").append(columns)
+        buffer = BytesIO()
+        workbook.save(buffer)
+        return buffer.getvalue()
+
+    @staticmethod
+    def _sheet_title(name, taken):
+        # Excel caps titles at 31 characters and forbids []:*?/\
+        title = "".join(ch for ch in str(name) if ch not in '[]:*?/\\')[:31] or "Sheet"
+        base, n = title, 2
+        while title in taken:
+            suffix = f" ({n})"
+            title = base[:31 - len(suffix)] + suffix
+            n += 1
+        return title
+
+class PdfEngine(ReportEngine):
+    """Table-flow PDF with a vector chart, drawn entirely with reportlab.
+
+    No pyplot or other global drawing state is involved, so several threads
+    can render at once.
+    """
+    file_type = "pdf"
+    mimetype = "application/pdf"
+
+    # Above this many rows a bar per student is unreadable; chart the
+    # distribution of percentages instead.
+    MAX_BARS = 40
+    ROWS_PER_TABLE = 100
+
+    def render(self, data, columns, chart_title="Attendance Chart", title="Attendance Report", **options):
+        from reportlab.lib import colors
+        from reportlab.lib.pagesizes import letter
+        from reportlab.lib.styles import getSampleStyleSheet
+        from reportlab.lib.units import inch
+        from reportlab.platypus import KeepTogether, LongTable, Paragraph, SimpleDocTemplate, Spacer, TableStyle
+
+        data = [tuple(row) for row in data]
+        columns = list(columns)
+        buffer = BytesIO()
+        doc = SimpleDocTemplate(buffer, pagesize=letter, title=title,
+                                leftMargin=0.6 * inch, rightMargin=0.6 * inch,
+                                topMargin=0.6 * inch, bottomMargin=0.6 * inch)
+        styles = getSampleStyleSheet()
+
+        style = TableStyle([
+            ("FONT", (0, 0), (-1, 0), "Helvetica-Bold", 9),
+            ("FONT", (0, 1), (-1, -1), "Helvetica", 9),
+            ("BACKGROUND", (0, 0), (-1, 0), colors.HexColor("#343a40")),
+            ("TEXTCOLOR", (0, 0), (-1, 0), colors.white),
+            ("ROWBACKGROUNDS", (0, 1), (-1, -1), [colors.white, colors.HexColor("#f2f2f2")]),
+            ("LINEBELOW", (0, 0), (-1, -1), 0.25, colors.HexColor("#cccccc")),
+        ])
+        col_widths = [doc.width / len(columns)] * len(columns)
+
+        # One table per block of rows: splitting a single long table re-lays
+        # out the remainder on every page, which is quadratic in the row count.
+        story = [Paragraph(escape(title), styles["Title"])]
+        for start in range(0, max(len(data), 1), self.ROWS_PER_TABLE):
+            block = [[str(item) for item in row] for row in data[start:start + self.ROWS_PER_TABLE]]
+            story.append(LongTable([columns] + block, colWidths=col_widths, repeatRows=1, style=style))
+        chart = self._chart(data, columns, doc.width)
+        if chart is not None:
+            story += [Spacer(1, 0.3 * inch), KeepTogether([Paragraph(escape(chart_title), styles["Heading3"]), chart])]
+        doc.build(story)
+        return buffer.getvalue()
+
+    def _chart(self, data, columns, width):
+        from collections import Counter
+        from reportlab.graphics.charts.barcharts import VerticalBarChart
+        from reportlab.graphics.charts.piecharts import Pie
+        from reportlab.graphics.shapes import Drawing
+        from reportlab.lib import colors
+
+        if not data:
+            return None
+        if "Status" in columns:
+            counts = Counter(row[columns.index("Status")] for row in data)
+            total = sum(counts.values())
+            drawing = Drawing(width, 180)
+            pie = Pie()
+            pie.x, pie.y, pie.width, pie.height = 20, 10, 160, 160
+            pie.data = list(counts.values())
+            pie.labels = [f"{label} ({count / total:.1%})" for label, count in counts.items()]
+            pie.slices.strokeColor = colors.white
+            palette = [colors.HexColor("#198754"), colors.HexColor("#dc3545"), colors.HexColor("#6c757d")]
+            for i in range(len(pie.data)):
+                pie.slices[i].fillColor = palette[i % len(palette)]
+            drawing.add(pie)
+            return drawing
+        if "Attendance %" in columns:
+            percents = [float(row[columns.index("Attendance %")]) for row in data]
+            if len(data) <= self.MAX_BARS and "Name" in columns:
+                values = percents
+                labels = [str(row[columns.index("Name")])[:12] for row in data]
+            else:
+                buckets = [0] * 10
+                for percent in percents:
+                    buckets[min(int(percent // 10), 9)] += 1
+                values = buckets
+                labels = [f"{10 * i}-{10 * i + 10}%" for i in range(10)]
+            drawing = Drawing(width, 200)
+            bars = VerticalBarChart()
+            bars.x, bars.y, bars.width, bars.height = 40, 50, width - 60, 140
+            bars.data = [values]
+            bars.bars[0].fillColor = colors.HexColor("#0d6efd")
+            bars.valueAxis.valueMin = 0
+            if values is percents:
+                bars.valueAxis.valueMax = 100
+            bars.categoryAxis.categoryNames = labels
+            bars.categoryAxis.labels.angle = 45
+            bars.categoryAxis.labels.boxAnchor = "ne"
+            bars.categoryAxis.labels.fontSize = 7
+            drawing.add(bars)
+            return drawing
+        return None
+
+ENGINES = {engine.file_type: engine for engine in (CsvEngine(), ExcelEngine(), PdfEngine())}
+
+def get_engine(file_type):
     try:
-        df = pd.DataFrame(data, columns=columns)
-        if "Status" in df.columns:
-            chart_data = df["Status"].value_counts()
-            plt.figure(figsize=(4, 3))
-            chart_data.plot(kind="pie", autopct="%1.1f%%", startangle=90)
-            plt.title(chart_title)
-        elif "Attendance %" in df.columns:
-            plt.figure(figsize=(5, 3))
-            df.plot(kind="bar", x="Name", y="Attendance %", legend=False)
-            plt.title(chart_title)
-            plt.ylabel("Percentage")
-            plt.xticks(rotation=45, ha="right")
-
-        img_buffer = BytesIO()
-        plt.tight_layout()
-        plt.savefig(img_buffer, format="PNG")
-        plt.close()
-        img_buffer.seek(0)
-
-        c.drawImage(img_buffer, 50, 50, width=400, height=200)
-    except Exception as e:
-        c.setFont("Helvetica", 10)
-        c.drawString(50, 100, f"Chart could not be generated: {e}")
-
-    c.save()
-    buffer.seek(0)
-    return send_file(buffer, as_attachment=True, download_name=filename, mimetype="application/pdf")
\ No newline at end of file
+        return ENGINES[file_type]
+    except KeyError:
+        raise ValueError(f"Unsupported report type: {file_type}") from None
+
+def send_report(file_type, data, columns, filename, **options):
+    engine = get_engine(file_type)
+    buffer = BytesIO(engine.render(data, columns, **options))
+    return send_file(buffer, as_attachment=True, download_name=filename, mimetype=engine.mimetype)
+
+def _tee_to_cache(chunks, key):
+    # Keep a copy of the stream for the report cache, giving up once it
+    # outgrows what the cache would accept anyway.
+    parts, size = [], 0
+    for chunk in chunks:
+        if parts is not None:
+            parts.append(chunk)
+            size += len(chunk)
+            if size > report_cache.max_entry:
+                parts = None
+        yield chunk
+    if parts is not None:
+        report_cache.put(key, b"".join(parts), size)
+
+def send_cached_report(key, filename, mimetype):
+    """A download response for report bytes in the report cache, or None on a miss."""
+    content = report_cache.get(key)
+    if content is None:
+        return None
+    return send_file(BytesIO(content), as_attachment=True, download_name=filename, mimetype=mimetype)
+
+def generate_csv_report(data, columns, filename="report.csv", cache_key=None):
+    # data may be any iterable, e.g. a generator over a database cursor; rows
+    # are written out as they arrive and never held in memory together.
+    # With a cache_key, a completed stream is also kept in the report cache.
+    chunks = iter_csv(data, columns)
+    if cache_key is not None:
+        chunks = _tee_to_cache(chunks, cache_key)
+    response = Response(stream_with_context(chunks), mimetype='text/csv')
+    response.headers.set("Content-Disposition", "attachment", filename=filename)
+    return response
+
+def generate_zip_report(members, filename="reports.zip"):
+    response = Response(stream_with_context(iter_zip(members)), mimetype="application/zip")
+    response.headers.set("Content-Disposition", "attachment", filename=filename)
+    return response
+
+def generate_excel_report(data, columns, filename="report.xlsx", sheet_name="Attendance Report"):
+    return send_report("xlsx", data, columns, filename, sheet_name=sheet_name)
+
+def generate_pdf_report(data, columns, filename="report.pdf", chart_title="Attendance Chart"):
+    return send_report("pdf", data, columns, filename, chart_title=chart_title)